@@ -2,9 +2,21 @@
 This module initializes the API endpoints.
 """
 
+from .cache import router as cache_router
+from .debug import router as debug_router
+from .latest_state import router as latest_state_router
+from .live import router as live_router
+from .metrics import router as metrics_router
+from .trips import router as trips_router
 from .vehicle_data import router as vehicle_data_router
 
 
 __all__ = [
+    "cache_router",
+    "debug_router",
+    "latest_state_router",
+    "live_router",
+    "metrics_router",
+    "trips_router",
     "vehicle_data_router",
 ]
@@ -0,0 +1,19 @@
+"""
+This module defines the API endpoints of the query cache.
+"""
+
+from typing import Dict
+
+from fastapi import APIRouter
+
+from app.core.cache import query_cache
+
+router = APIRouter()
+
+
+@router.get("/api/v1/cache/stats/", response_model=Dict[str, int])
+async def get_cache_stats():
+    """
+    Get the counters of the query result cache: hits, misses, evictions, invalidations and size.
+    """
+    return query_cache.stats()
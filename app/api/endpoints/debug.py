@@ -0,0 +1,26 @@
+"""
+This module defines the debug endpoints.
+"""
+
+from fastapi import APIRouter
+
+from app.api.models.debug import SlowQueryReport
+from app.core.config import settings
+from app.core.database.slow_query import slow_query_log
+
+router = APIRouter()
+
+
+@router.get("/api/v1/debug/slow_queries/", response_model=SlowQueryReport)
+async def get_slow_queries():
+    """
+    Get the statements slower than the slow-query threshold, and the query plan of each distinct one.
+
+    A plan reading `SCAN vehicle_data` (SQLite) or `Seq Scan on vehicle_data` (Postgres), or sorting
+    in a temporary B-tree, points at a missing index. The bound parameters of the statements are
+    left out unless `slow_query_expose_parameters` is enabled.
+    """
+    report = slow_query_log.report()
+    if not settings.slow_query_expose_parameters:
+        report["queries"] = [dict(query, parameters=None) for query in report["queries"]]
+    return report
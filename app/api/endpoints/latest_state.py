@@ -0,0 +1,53 @@
+"""
+This module defines the API endpoints for the latest state of vehicles.
+"""
+
+from datetime import datetime
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import ORJSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.api.models.latest_state import LatestVehicleState
+from app.api.services.latest_state_service import LatestStateService
+from app.core.database import get_async_db
+
+router = APIRouter()
+
+
+@router.get("/api/v1/vehicles/latest", response_model=List[LatestVehicleState])
+async def get_latest_vehicle_states(
+    vehicle_id: Optional[List[str]] = Query(None, alias="vehicle_id"),
+    since: Optional[datetime] = Query(None, alias="since"),
+    limit: Optional[int] = Query(None, alias="limit"),
+    skip: Optional[int] = Query(0, alias="skip"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Get the newest reading of every vehicle, ordered by vehicle ID.
+
+    The states are read from the latest_vehicle_state table, maintained on every write, so the whole
+    fleet costs a single read however much history the vehicles have.
+
+    Args:
+        vehicle_id: The IDs of the vehicles, repeated, or None for every vehicle.
+        since: Only the vehicles whose state changed after this time. Pollers pass the newest
+            `updated_at` of their previous poll, and may get again the states changed shortly before it.
+        limit: The maximum number of vehicles to return.
+        skip: The number of vehicles to skip.
+        db: The database session.
+
+    Returns:
+        Per vehicle: its newest reading and the time it was written.
+    """
+    states = await db.run_sync(
+        lambda session: LatestStateService(session).get_latest(
+            vehicle_id=vehicle_id,
+            since=since,
+            limit=limit,
+            skip=skip,
+        )
+    )
+    # Database output is trusted: the states are serialised with orjson without building a model per vehicle
+    return ORJSONResponse(states)
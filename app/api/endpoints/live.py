@@ -0,0 +1,115 @@
+"""
+This module defines the API endpoints pushing new vehicle data to live subscribers.
+"""
+
+import asyncio
+from typing import AsyncIterator, List
+
+import orjson
+from fastapi import APIRouter, Query, WebSocket, status
+from fastapi.responses import StreamingResponse
+
+from app.core.config import settings
+from app.core.pubsub import Subscription, broker
+
+router = APIRouter()
+
+
+def encode_batch(points: List[dict], dropped: int) -> bytes:
+    """
+    Encode a batch of points as the JSON message sent to subscribers.
+    """
+    return orjson.dumps({"points": points, "dropped": dropped})
+
+
+async def live_events(vehicle_ids: List[str]) -> AsyncIterator[bytes]:
+    """
+    Stream the new points of vehicles as Server-Sent Events, one `data:` event per batch.
+
+    A comment is sent when no point arrived for `live_heartbeat_seconds`, so idle streams stay open
+    through proxies. The subscription is removed when the client disconnects.
+    """
+    subscription = broker.subscribe(vehicle_ids)
+    try:
+        while True:
+            try:
+                batch = await asyncio.wait_for(
+                    subscription.next_batch(settings.live_batch_size, settings.live_linger_ms / 1000),
+                    timeout=settings.live_heartbeat_seconds,
+                )
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+                continue
+
+            if batch is None:
+                break
+            yield b"data: " + encode_batch(*batch) + b"\n\n"
+
+        if subscription.overflowed:
+            yield b"event: overflow\ndata: " + orjson.dumps({"detail": "Subscriber too slow"}) + b"\n\n"
+    finally:
+        broker.unsubscribe(subscription)
+
+
+@router.get("/api/v1/vehicles/live")
+async def get_live_events(vehicle_id: List[str] = Query(..., alias="vehicle_id")):
+    """
+    Subscribe to the new vehicle data of vehicles with Server-Sent Events.
+
+    Every event holds a batch of new points, `{"points": [...], "dropped": n}`, where `dropped` is the
+    number of points lost since the previous batch because the client fell behind.
+
+    Args:
+        vehicle_id: The IDs of the vehicles to subscribe to, repeated.
+
+    Returns:
+        A `text/event-stream` response, open until the client disconnects.
+    """
+    return StreamingResponse(
+        live_events(vehicle_id),
+        media_type="text/event-stream",
+        # Proxies must neither cache nor buffer the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _close_on_disconnect(websocket: WebSocket, subscription: Subscription) -> None:
+    """
+    Read the client messages, which are ignored, until the client disconnects, then close the subscription.
+    """
+    while (await websocket.receive())["type"] != "websocket.disconnect":
+        pass
+    subscription.close()
+
+
+@router.websocket("/api/v1/vehicles/live")
+async def live_websocket(websocket: WebSocket, vehicle_id: List[str] = Query(..., alias="vehicle_id")):
+    """
+    Subscribe to the new vehicle data of vehicles over a WebSocket.
+
+    Every text message holds a batch of new points, `{"points": [...], "dropped": n}`. With the `close`
+    overflow policy, a client that falls behind is disconnected with the 1008 close code.
+
+    Args:
+        websocket: The WebSocket connection.
+        vehicle_id: The IDs of the vehicles to subscribe to, repeated.
+    """
+    # Subscribe before accepting, so no point written once the client is connected is missed
+    subscription = broker.subscribe(vehicle_id)
+    receiver = None
+    try:
+        await websocket.accept()
+        receiver = asyncio.create_task(_close_on_disconnect(websocket, subscription))
+
+        while True:
+            batch = await subscription.next_batch(settings.live_batch_size, settings.live_linger_ms / 1000)
+            if batch is None:
+                break
+            await websocket.send_text(encode_batch(*batch).decode())
+
+        if subscription.overflowed:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Subscriber too slow")
+    finally:
+        if receiver is not None:
+            receiver.cancel()
+        broker.unsubscribe(subscription)
@@ -0,0 +1,18 @@
+"""
+This module defines the endpoint exposing the application metrics to Prometheus.
+"""
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.core.metrics import CONTENT_TYPE, REGISTRY
+
+router = APIRouter()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Get the request, SQL and row metrics in the Prometheus text format.
+    """
+    return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
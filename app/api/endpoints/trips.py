@@ -0,0 +1,53 @@
+"""
+This module defines the API endpoints for trips.
+"""
+
+from datetime import datetime
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.api.models.trip import Trip
+from app.api.services.trip_service import TripService
+from app.core.database import get_async_db
+
+router = APIRouter()
+
+
+@router.get("/api/v1/vehicles/{vehicle_id}/trips", response_model=List[Trip])
+async def get_trips(
+    vehicle_id: str,
+    initial_timestamp: Optional[datetime] = Query(None, alias="initial-timestamp"),
+    final_timestamp: Optional[datetime] = Query(None, alias="final-timestamp"),
+    limit: Optional[int] = Query(100, alias="limit"),
+    skip: Optional[int] = Query(0, alias="skip"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Get the trips of a vehicle, in chronological order.
+
+    A trip is a run of readings in a driving shift state (D or R, or no shift state with a positive
+    speed), split at parking readings and at gaps in the data. The trips are segmented when the
+    readings are first read, and persisted.
+
+    Args:
+        vehicle_id: The ID of the vehicle to get the trips of.
+        initial_timestamp: Only the trips ending at or after this timestamp.
+        final_timestamp: Only the trips starting at or before this timestamp.
+        limit: The maximum number of trips to return.
+        skip: The number of trips to skip.
+        db: The database session.
+
+    Returns:
+        Per trip: start/end time, distance from the odometer, SoC used, max/avg speed and elevation change.
+    """
+    return await db.run_sync(
+        lambda session: TripService(session).get_trips(
+            vehicle_id=vehicle_id,
+            initial_timestamp=initial_timestamp,
+            final_timestamp=final_timestamp,
+            limit=limit,
+            skip=skip,
+        )
+    )
@@ -3,17 +3,23 @@ This module defines the API endpoints for vehicle data.
 """
 
 from enum import Enum
-from fastapi import APIRouter, HTTPException, Query, Response
+from fastapi import APIRouter, Header, HTTPException, Query, Request, Response
 from typing import List, Optional
-from sqlalchemy.orm import Session
-from datetime import datetime
-from fastapi.responses import JSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timedelta
+from fastapi.responses import ORJSONResponse, StreamingResponse
 
-from app.api.models.vehicle_data import VehicleModel
+from app.api.models.vehicle_data import BatchIngestResponse, VehicleDataAggregate, VehicleModel
+from app.api.services.aggregation_service import AggregationService
 from app.api.services.exporter_service import ExporterService
-from app.api.services.vehicle_data_service import VehicleDataService
-from app.core.database.models import VehicleDatabase, SortBy, ExportFormat
-from app.core.database import SessionLocal, get_db
+from app.api.services.ingest_service import NDJSON_MEDIA_TYPES, BatchTooLargeError, IngestService
+from app.api.services.async_vehicle_data_service import AsyncVehicleDataService
+from app.api.services.resample_service import ResampleService
+from app.api.services.vehicle_data_service import is_paged
+from app.api.services.write_buffer import WriteBufferFullError, write_buffer
+from app.core.config import settings
+from app.core.database.models import BucketWidth, Durability, FillStrategy, VehicleDatabase, SortBy, ExportFormat
+from app.core.database import get_async_db
 from fastapi import Depends
 
 router = APIRouter()
@@ -22,35 +28,117 @@ router = APIRouter()
 @router.get("/api/v1/vehicle_data/", response_model=List[VehicleModel])
 async def get_vehicle_data(
     export_format: Optional[ExportFormat] = Query(None, alias="export-format"),
-    vehicle_id: str = "f212b271-f033-444c-a445-560511f95e9c",
-    db: Session = Depends(get_db),
+    vehicle_id: Optional[List[str]] = Query(None, alias="vehicle_id"),
+    db: AsyncSession = Depends(get_async_db),
     initial_timestamp: Optional[datetime] = Query(None, alias="initial-timestamp"),
     final_timestamp: Optional[datetime] = Query(None, alias="final-timestamp"),
     sort_by: Optional[SortBy] = Query(None, alias="sort-by"),
     limit: Optional[int] = Query(3, alias="limit"),
     skip: Optional[int] = Query(None, alias="skip"),
+    cursor: Optional[str] = Query(None, alias="cursor"),
+    accept: Optional[str] = Header(None),
 ):
     """
     Get vehicle data filtered by query parameters and optionally export the data in the specified format.
 
     Args:
         export_format: The format in which to export the data.
-        vehicle_id: The ID of the vehicle to retrieve data for.
+        vehicle_id: The IDs of the vehicles to retrieve data for, repeated (`?vehicle_id=a&vehicle_id=b`).
+            All vehicles when none is given. The data of several vehicles is merged in timestamp order.
         db: The database session.
         initial_timestamp: The initial timestamp to filter by.
         final_timestamp: The final timestamp to filter by.
         sort_by: The field to sort the data by.
         limit: The maximum number of records to return.
         skip: The number of records to skip.
+        cursor: The cursor of the page to retrieve, as returned in the X-Next-Cursor header of the previous page.
+        accept: The Accept header. With `application/x-ndjson`, the rows are streamed as NDJSON.
 
     Returns:
-        If an export format is specified, returns a response with the exported data. Otherwise, returns a list of VehicleModel objects.
+        If an export format is specified, returns a streaming response with the exported data.
+        If NDJSON is accepted, returns a streaming response with one VehicleModel object per line.
+        Otherwise, returns a list of VehicleModel objects.
+        When the data is sorted, spans several vehicles or a cursor is given, the X-Next-Cursor header holds
+        the cursor of the next page, if any (except for exports, which stream the page after the cursor).
     """
     # Initialize vehicle data service
-    vehicle_data_service = VehicleDataService(db=db)
+    vehicle_data_service = AsyncVehicleDataService(db=db)
 
-    # Get vehicle data filtered by query parameters
-    vehicle_data = vehicle_data_service.get_vehicle_data(
+    # Stream the data in the specified format if requested
+    if export_format:
+        # Rows are read from a server-side cursor and encoded chunk by chunk while the response is sent
+        vehicle_data = vehicle_data_service.stream_vehicle_data(
+            vehicle_id=vehicle_id,
+            initial_timestamp=initial_timestamp,
+            final_timestamp=final_timestamp,
+            sort_by=sort_by,
+            limit=limit,
+            skip=skip,
+            cursor=cursor,
+        )
+
+        return StreamingResponse(
+            ExporterService.astream(vehicle_data, export_format),
+            media_type=ExporterService.media_type(export_format),
+            headers={
+                "Content-Disposition": f"attachment; filename=vehicle_data.{export_format.value.lower()}",
+            },
+        )
+
+    # Stream one object per line to clients accepting NDJSON, so they can process the first rows
+    # while the next ones are still being read
+    if accept and any(media_type in accept for media_type in NDJSON_MEDIA_TYPES):
+        media_type = ExporterService.media_type(ExportFormat.NDJSON)
+
+        vehicle_data = vehicle_data_service.stream_vehicle_data(
+            vehicle_id=vehicle_id,
+            initial_timestamp=initial_timestamp,
+            final_timestamp=final_timestamp,
+            sort_by=sort_by,
+            limit=limit,
+            skip=skip,
+            cursor=cursor,
+        )
+
+        # The cursor of the next page is sent before the page, which is streamed: it is read from the
+        # positions of the last row of the page and of the row after it only
+        headers = None
+        if limit is not None and is_paged(vehicle_id, sort_by, cursor):
+            next_cursor = await vehicle_data_service.get_next_cursor(
+                vehicle_id=vehicle_id,
+                initial_timestamp=initial_timestamp,
+                final_timestamp=final_timestamp,
+                sort_by=sort_by,
+                limit=limit,
+                skip=skip,
+                cursor=cursor,
+            )
+            headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+
+        return StreamingResponse(
+            ExporterService.astream(vehicle_data, ExportFormat.NDJSON), media_type=media_type, headers=headers
+        )
+
+    # The rows are read as plain tuples and serialised with orjson: database output is trusted, so the
+    # response skips building and validating a VehicleModel per row (response_model only documents it)
+
+    # Page through sorted data with a cursor, so deep pages cost the same as the first one.
+    # The merged data of several vehicles is always sorted.
+    if is_paged(vehicle_id, sort_by, cursor):
+        vehicle_data, next_cursor = await vehicle_data_service.get_vehicle_data_rows_page(
+            vehicle_id=vehicle_id,
+            initial_timestamp=initial_timestamp,
+            final_timestamp=final_timestamp,
+            sort_by=sort_by,
+            limit=limit,
+            skip=skip,
+            cursor=cursor,
+        )
+        headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+        return ORJSONResponse(vehicle_data, headers=headers)
+
+    # Return the data as a list of VehicleModel objects if no export format is requested
+    vehicle_data = await vehicle_data_service.get_vehicle_data_rows(
         vehicle_id=vehicle_id,
         initial_timestamp=initial_timestamp,
         final_timestamp=final_timestamp,
@@ -58,36 +146,134 @@ async def get_vehicle_data(
         limit=limit,
         skip=skip,
     )
+    return ORJSONResponse(vehicle_data)
 
-    # Export the data in the specified format if requested
-    if export_format:
-        # Export the data in the specified format
-        exported_data = ExporterService.export(vehicle_data, export_format)
-
-        # Set the media type and headers for the response
-        media_type = "text/csv" if export_format == ExportFormat.CSV else "application/json"
-        response = JSONResponse(
-        content=exported_data,
-        media_type=media_type,
-        headers={
-            "Content-Disposition": f"attachment; filename=vehicle_data.{export_format.value.lower()}",
-        },
+
+@router.get("/api/v1/vehicle_data/aggregate/", response_model=List[VehicleDataAggregate])
+async def get_vehicle_data_aggregates(
+    vehicle_id: str,
+    bucket: BucketWidth = Query(..., alias="bucket"),
+    initial_timestamp: Optional[datetime] = Query(None, alias="initial-timestamp"),
+    final_timestamp: Optional[datetime] = Query(None, alias="final-timestamp"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Get the vehicle data of a vehicle downsampled into time buckets.
+
+    The aggregation runs in the database, so the response holds one row per non-empty bucket
+    instead of every reading.
+
+    Args:
+        vehicle_id: The ID of the vehicle to aggregate data for.
+        bucket: The width of the time buckets (1m, 15m, 1h or 1d).
+        initial_timestamp: The initial timestamp to filter by.
+        final_timestamp: The final timestamp to filter by, excluded.
+        db: The database session.
+
+    Returns:
+        Per bucket: the number of readings, min/avg/max of speed, soc and elevation,
+        first/last odometer and the dominant shift state.
+    """
+    aggregation_service = AggregationService(db=db)
+    return await aggregation_service.get_aggregates(
+        vehicle_id=vehicle_id,
+        bucket_width=bucket,
+        initial_timestamp=initial_timestamp,
+        final_timestamp=final_timestamp,
+    )
+
+
+@router.get("/api/v1/vehicle_data/resample/", response_model=List[VehicleModel])
+async def get_resampled_vehicle_data(
+    vehicle_id: str,
+    interval: float = Query(..., gt=0, alias="interval"),
+    initial_timestamp: Optional[datetime] = Query(None, alias="initial-timestamp"),
+    final_timestamp: Optional[datetime] = Query(None, alias="final-timestamp"),
+    speed_fill: FillStrategy = Query(FillStrategy.LINEAR, alias="speed-fill"),
+    odometer_fill: FillStrategy = Query(FillStrategy.LINEAR, alias="odometer-fill"),
+    elevation_fill: FillStrategy = Query(FillStrategy.LINEAR, alias="elevation-fill"),
+    soc_fill: FillStrategy = Query(FillStrategy.LINEAR, alias="soc-fill"),
+    shift_state_fill: FillStrategy = Query(FillStrategy.FFILL, alias="shift-state-fill"),
+    export_format: Optional[ExportFormat] = Query(None, alias="export-format"),
+    accept: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Get the vehicle data of a vehicle resampled on a regular time grid, e.g. for ML feature pipelines.
+
+    Every field is filled with its own strategy: `ffill` (last known value), `linear` (interpolated
+    between the known values around, numeric fields only) or `none` (only a value read within the
+    interval ending at the grid point). The series is computed and streamed chunk by chunk.
+
+    Args:
+        vehicle_id: The ID of the vehicle to resample the data of.
+        interval: The interval between two grid points, in seconds.
+        initial_timestamp: The first grid point, by default the first reading rounded up to a multiple of the interval.
+        final_timestamp: The last grid point at most, by default the last reading.
+        speed_fill, odometer_fill, elevation_fill, soc_fill, shift_state_fill: The fill strategy of every field.
+        export_format: The format of the response, a JSON array by default.
+        accept: The Accept header. With `application/x-ndjson`, the points are streamed as NDJSON.
+        db: The database session.
+
+    Returns:
+        A streaming response with one VehicleModel object per grid point.
+    """
+    if shift_state_fill == FillStrategy.LINEAR:
+        raise HTTPException(status_code=400, detail="shift_state cannot be interpolated linearly")
+
+    fills = {
+        "speed": speed_fill,
+        "odometer": odometer_fill,
+        "elevation": elevation_fill,
+        "soc": soc_fill,
+        "shift_state": shift_state_fill,
+    }
+    if timedelta(seconds=interval) < timedelta(microseconds=1):
+        raise HTTPException(status_code=400, detail="The interval must be at least 1 microsecond")
+
+    resample_service = ResampleService(db=db)
+    size = await resample_service.grid_size(vehicle_id, timedelta(seconds=interval), initial_timestamp, final_timestamp)
+    if size > settings.resample_max_points:
+        raise HTTPException(
+            status_code=400,
+            detail=f"The resampling has {size} points, more than {settings.resample_max_points}: "
+            "use a longer interval or a shorter range",
         )
 
-        return response
+    # The points are resampled chunk by chunk while the response is sent
+    points = resample_service.resample(
+        vehicle_id=vehicle_id,
+        interval=timedelta(seconds=interval),
+        fills=fills,
+        initial_timestamp=initial_timestamp,
+        final_timestamp=final_timestamp,
+        max_points=settings.resample_max_points,
+    )
 
-    # Return the data as a list of VehicleModel objects if no export format is requested
+    headers = None
+    if export_format:
+        headers = {
+            "Content-Disposition": f"attachment; filename=vehicle_data_resampled.{export_format.value.lower()}",
+        }
+    elif accept and any(media_type in accept for media_type in NDJSON_MEDIA_TYPES):
+        export_format = ExportFormat.NDJSON
     else:
-        return vehicle_data
+        export_format = ExportFormat.JSON
+
+    return StreamingResponse(
+        ExporterService.astream(points, export_format),
+        media_type=ExporterService.media_type(export_format),
+        headers=headers,
+    )
 
 
 @router.get("/api/v1/vehicle_data/{id}/", response_model=VehicleModel)
-async def get_vehicle_data_by_id(id: int, db: Session = Depends(get_db)):
+async def get_vehicle_data_by_id(id: int, db: AsyncSession = Depends(get_async_db)):
     """
     Retrieves a particular vehicle data by ID.
     """
-    vehicle_data_service = VehicleDataService(db=db)
-    vehicle_data = vehicle_data_service.get_vehicle_data_by_id(id=id)
+    vehicle_data_service = AsyncVehicleDataService(db=db)
+    vehicle_data = await vehicle_data_service.get_vehicle_data_by_id(id=id)
     if vehicle_data is None:
         raise HTTPException(status_code=404, detail=f"Vehicle data with id {id} not found")
     return vehicle_data
@@ -95,12 +281,65 @@ async def get_vehicle_data_by_id(id: int, db: Session = Depends(get_db)):
 
 # Add new vehicle
 @router.post("/api/v1/vehicle_data/", response_model=VehicleModel)
-async def add_vehicle_data(vehicle: VehicleModel, db: Session = Depends(get_db)):
+async def add_vehicle_data(vehicle: VehicleModel, response: Response, db: AsyncSession = Depends(get_async_db)):
     """
     Adds a new vehicle data.
+
+    In write-behind mode the reading is queued and committed in a batch with others. The response is
+    sent once the batch is committed, or with a 202 status as soon as the reading is queued when the
+    durability is `enqueue`. A full queue is answered with a 503 status.
     """
-    vehicle_data_service = VehicleDataService(db=db)
+    if write_buffer.running:
+        try:
+            await write_buffer.submit([vehicle.dict()])
+        except WriteBufferFullError as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+        if write_buffer.durability == Durability.ENQUEUE:
+            response.status_code = 202
+        return vehicle
+
+    vehicle_data_service = AsyncVehicleDataService(db=db)
     # Transform a VehicleModel into a VehicleDatabase
     vehicle = VehicleDatabase(**vehicle.dict())
-    vehicle = vehicle_data_service.add_vehicle_data(vehicle_database=vehicle)
+    vehicle = await vehicle_data_service.add_vehicle_data(vehicle_database=vehicle)
     return vehicle
+
+
+@router.post("/api/v1/vehicle_data/batch/", response_model=BatchIngestResponse)
+async def add_vehicle_data_batch(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """
+    Adds many vehicle data in a single transaction.
+
+    The body is either a JSON array of VehicleModel objects, or NDJSON (one VehicleModel per line)
+    when sent with the `application/x-ndjson` content type. A batch holds at most MAX_BATCH_SIZE
+    (10000) readings and MAX_BATCH_BYTES (10 MiB): larger bodies are refused with a 413 before they
+    are read in full. Invalid readings are rejected individually and the valid ones are inserted;
+    the response reports the status of every reading in request order. Readings with the
+    (vehicle_id, timestamp) of a stored reading are skipped as duplicates, so a retried batch is harmless.
+    """
+    # Read, decode and validate the readings
+    try:
+        body = await IngestService.read_body(request.stream(), request.headers.get("content-length"))
+        items = IngestService.parse_body(body, request.headers.get("content-type", "application/json"))
+    except BatchTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    rows, statuses = IngestService.validate(items)
+
+    # Insert the valid readings in a single transaction, skipping the ones already stored
+    vehicle_data_service = AsyncVehicleDataService(db=db)
+    inserted = await vehicle_data_service.insert_vehicle_data(rows)
+
+    valid_statuses = [status for status in statuses if status.status == "created"]
+    for status, is_inserted in zip(valid_statuses, inserted):
+        if not is_inserted:
+            status.status = "duplicate"
+
+    return BatchIngestResponse(
+        received=len(items),
+        inserted=sum(inserted),
+        duplicates=len(inserted) - sum(inserted),
+        rejected=len(items) - len(rows),
+        items=statuses,
+    )
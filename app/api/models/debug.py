@@ -0,0 +1,40 @@
+"""
+This module defines the models of the debug endpoints.
+"""
+
+from datetime import datetime
+from typing import Any, List, Optional
+
+from pydantic import BaseModel
+
+
+class SlowQuery(BaseModel):
+    """
+    A statement that ran slower than the slow-query threshold.
+    """
+    timestamp: datetime
+    statement: str
+    parameters: Optional[Any] = None
+    executemany: bool
+    duration_ms: float
+    # Unknown when the driver only counts the rows once they are fetched (SQLite)
+    rows: Optional[int] = None
+
+
+class SlowQueryShape(BaseModel):
+    """
+    A distinct slow statement, with its query plan and its slow executions.
+    """
+    statement: str
+    plan: Optional[List[str]] = None
+    count: int
+    max_duration_ms: float
+
+
+class SlowQueryReport(BaseModel):
+    """
+    The recent slow queries, most recent first, and the plans of the slow statements.
+    """
+    threshold_ms: float
+    queries: List[SlowQuery]
+    plans: List[SlowQueryShape]
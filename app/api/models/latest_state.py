@@ -0,0 +1,25 @@
+"""
+This module defines the model for the latest state of vehicles.
+"""
+
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class LatestVehicleState(BaseModel):
+    """
+    The newest reading of a vehicle, and when it was written.
+    """
+    vehicle_id: str
+    timestamp: datetime
+    speed: Optional[float] = None
+    odometer: Optional[float] = None
+    soc: Optional[float] = None
+    elevation: Optional[float] = None
+    shift_state: Optional[str] = None
+    updated_at: datetime
+
+    class Config:
+        orm_mode = True
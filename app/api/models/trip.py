@@ -0,0 +1,33 @@
+"""
+This module defines the model for trips.
+"""
+
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class Trip(BaseModel):
+    """
+    A trip of a vehicle, from its first to its last driving reading.
+    """
+    vehicle_id: str
+    start_timestamp: datetime
+    end_timestamp: datetime
+    # Number of readings of the trip
+    count: int
+    start_odometer: Optional[float] = None
+    end_odometer: Optional[float] = None
+    distance: Optional[float] = None
+    start_soc: Optional[float] = None
+    end_soc: Optional[float] = None
+    soc_used: Optional[float] = None
+    max_speed: Optional[float] = None
+    avg_speed: Optional[float] = None
+    start_elevation: Optional[float] = None
+    end_elevation: Optional[float] = None
+    elevation_change: Optional[float] = None
+
+    class Config:
+        orm_mode = True
@@ -2,7 +2,7 @@
 This module defines the model for vehicle data.
 """
 
-from typing import Optional
+from typing import List, Optional
 from fastapi.encoders import jsonable_encoder
 
 from pydantic import BaseModel
@@ -27,3 +27,48 @@ class VehicleModel(BaseModel):
 
     def _json(self):
         return jsonable_encoder(self.dict())
+
+
+class BatchItemStatus(BaseModel):
+    """
+    The outcome of a single reading of a batch ingest request.
+    """
+    index: int
+    # created, duplicate or rejected
+    status: str
+    errors: Optional[List[dict]] = None
+
+
+class BatchIngestResponse(BaseModel):
+    """
+    The summary of a batch ingest request, with the status of every reading.
+    """
+    received: int
+    inserted: int
+    # Valid readings already stored, with the same (vehicle_id, timestamp)
+    duplicates: int = 0
+    rejected: int
+    items: List[BatchItemStatus]
+
+
+class VehicleDataAggregate(BaseModel):
+    """
+    The aggregated vehicle data of a time bucket.
+    """
+    bucket_start: datetime
+    count: int
+    speed_min: Optional[float] = None
+    speed_avg: Optional[float] = None
+    speed_max: Optional[float] = None
+    soc_min: Optional[float] = None
+    soc_avg: Optional[float] = None
+    soc_max: Optional[float] = None
+    elevation_min: Optional[float] = None
+    elevation_avg: Optional[float] = None
+    elevation_max: Optional[float] = None
+    odometer_first: Optional[float] = None
+    odometer_last: Optional[float] = None
+    shift_state: Optional[str] = None
+
+    class Config:
+        orm_mode = True
@@ -3,9 +3,25 @@ This module initializes the API services.
 """
 
 from .vehicle_data_service import VehicleDataService
+from .async_vehicle_data_service import AsyncVehicleDataService
 from .exporter_service import ExporterService
+from .ingest_service import IngestService
+from .aggregation_service import AggregationService
+from .trip_service import TripService
+from .resample_service import ResampleService
+from .latest_state_service import LatestStateService
+from .write_buffer import WriteBuffer
+from .partition_service import PartitionService
 
 __all__ = [
     "VehicleDataService",
-    "ExporterService"
+    "AsyncVehicleDataService",
+    "ExporterService",
+    "IngestService",
+    "AggregationService",
+    "TripService",
+    "ResampleService",
+    "LatestStateService",
+    "WriteBuffer",
+    "PartitionService",
 ]
@@ -0,0 +1,157 @@
+"""
+This module defines the service aggregating vehicle data into time buckets.
+"""
+
+from datetime import datetime
+from typing import Any, List, Optional
+
+from sqlalchemy import Select, and_, func, literal_column, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.api.models.vehicle_data import VehicleDataAggregate
+from app.api.services.partition_service import PartitionService
+from app.api.services.rollup_service import (
+    ROLLUP_RESOLUTIONS,
+    build_rollup_statement,
+    is_aligned,
+    rollup_to_aggregate,
+)
+from app.core.database.functions import epoch_seconds, to_utc_naive
+from app.core.database.models import BucketWidth, VehicleDatabase
+
+
+def build_aggregate_statement(
+    vehicle_id: str,
+    bucket_width: BucketWidth,
+    initial_timestamp: Optional[datetime] = None,
+    final_timestamp: Optional[datetime] = None,
+    source: Any = VehicleDatabase,
+) -> Select:
+    """
+    Build the statement aggregating the vehicle data of a vehicle into time buckets.
+
+    Each row holds the bucket start (in epoch seconds), the number of readings, the min/avg/max of
+    speed, soc and elevation, the first and last known odometer, and the most frequent shift state.
+    The readings are read from `source`, VehicleDatabase or the partitions of the range. The range is
+    half-open, as over the rollups: readings at the final timestamp are left out.
+    """
+    filters = [source.vehicle_id == vehicle_id, source.timestamp.isnot(None)]
+    if initial_timestamp:
+        filters.append(source.timestamp >= to_utc_naive(initial_timestamp))
+    if final_timestamp:
+        filters.append(source.timestamp < to_utc_naive(final_timestamp))
+
+    # The width is rendered inline, so the bucket expressions of SELECT and GROUP BY are identical
+    width = literal_column(str(bucket_width.seconds))
+    bucket = epoch_seconds(source.timestamp) // width * width
+
+    # Readings with the first and last known odometer of their bucket
+    odometer_missing = source.odometer.is_(None)
+    readings = (
+        select(
+            bucket.label("bucket"),
+            source.speed,
+            source.soc,
+            source.elevation,
+            func.first_value(source.odometer).over(
+                partition_by=bucket, order_by=[odometer_missing, source.timestamp.asc()]
+            ).label("odometer_first"),
+            func.first_value(source.odometer).over(
+                partition_by=bucket, order_by=[odometer_missing, source.timestamp.desc()]
+            ).label("odometer_last"),
+        )
+        .where(*filters)
+        .subquery()
+    )
+
+    aggregates = (
+        select(
+            readings.c.bucket,
+            func.count().label("count"),
+            func.min(readings.c.speed).label("speed_min"),
+            func.avg(readings.c.speed).label("speed_avg"),
+            func.max(readings.c.speed).label("speed_max"),
+            func.min(readings.c.soc).label("soc_min"),
+            func.avg(readings.c.soc).label("soc_avg"),
+            func.max(readings.c.soc).label("soc_max"),
+            func.min(readings.c.elevation).label("elevation_min"),
+            func.avg(readings.c.elevation).label("elevation_avg"),
+            func.max(readings.c.elevation).label("elevation_max"),
+            func.max(readings.c.odometer_first).label("odometer_first"),
+            func.max(readings.c.odometer_last).label("odometer_last"),
+        )
+        .group_by(readings.c.bucket)
+        .subquery()
+    )
+
+    # Shift states of each bucket, ranked by frequency
+    shift_states = (
+        select(
+            bucket.label("bucket"),
+            source.shift_state,
+            func.row_number().over(
+                partition_by=bucket, order_by=[func.count().desc(), source.shift_state]
+            ).label("rank"),
+        )
+        .where(*filters, source.shift_state.isnot(None))
+        .group_by(bucket, source.shift_state)
+        .subquery()
+    )
+
+    return (
+        select(aggregates, shift_states.c.shift_state)
+        .outerjoin(shift_states, and_(shift_states.c.bucket == aggregates.c.bucket, shift_states.c.rank == 1))
+        .order_by(aggregates.c.bucket)
+    )
+
+
+class AggregationService:
+    """
+    Aggregate vehicle data in the database, so only one row per time bucket leaves it.
+
+    Buckets of 1 minute, 1 hour and 1 day are read from the rollups maintained at ingest time, whose
+    cost does not depend on the number of raw rows. Other widths, and ranges not aligned on the bucket
+    width, are aggregated from the raw rows.
+    """
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def get_aggregates(
+        self,
+        vehicle_id: str,
+        bucket_width: BucketWidth,
+        initial_timestamp: Optional[datetime] = None,
+        final_timestamp: Optional[datetime] = None,
+    ) -> List[VehicleDataAggregate]:
+        """
+        Get the vehicle data of a vehicle aggregated into time buckets.
+
+        Args:
+            vehicle_id: The ID of the vehicle.
+            bucket_width: The width of the time buckets.
+            initial_timestamp: The initial timestamp to filter by.
+            final_timestamp: The final timestamp to filter by, excluded.
+
+        Returns:
+            One VehicleDataAggregate per non-empty bucket, ordered by time.
+        """
+        if (
+            bucket_width in ROLLUP_RESOLUTIONS
+            and is_aligned(initial_timestamp, bucket_width)
+            and is_aligned(final_timestamp, bucket_width)
+        ):
+            statement = build_rollup_statement(vehicle_id, bucket_width, initial_timestamp, final_timestamp)
+            result = await self.db.execute(statement)
+            return [rollup_to_aggregate(rollup, shift_state) for rollup, shift_state in result]
+
+        source = await self.db.run_sync(
+            lambda session: PartitionService(session).source(initial_timestamp, final_timestamp)
+        )
+        statement = build_aggregate_statement(vehicle_id, bucket_width, initial_timestamp, final_timestamp, source)
+        result = await self.db.execute(statement)
+
+        return [
+            VehicleDataAggregate(bucket_start=datetime.utcfromtimestamp(row.bucket), **row._asdict())
+            for row in result
+        ]
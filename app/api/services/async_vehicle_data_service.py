@@ -0,0 +1,336 @@
+"""
+This module defines the asynchronous service for vehicle data, used by the async endpoints.
+"""
+
+from datetime import datetime
+from typing import Any, AsyncIterator, List, Optional, Tuple, Union
+
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.api.services.latest_state_service import LatestStateService
+from app.api.services.partition_service import PartitionService
+from app.api.services.rollup_service import RollupService, vehicle_to_row
+from app.api.services.trip_service import TripService
+from app.api.services.vehicle_data_service import (
+    build_insert_statement,
+    build_next_cursor_statement,
+    build_vehicle_data_page_statement,
+    build_vehicle_data_statement,
+    deduplicate_rows,
+    encode_cursor,
+    hot_tier_page,
+    inserted_flags,
+    is_paged,
+    page_cache_key,
+    page_range,
+    ROW_COLUMNS,
+    rows_to_dicts,
+    single_vehicle_id,
+    split_page,
+)
+from app.core.cache import make_key, query_cache
+from app.core.config import settings
+from app.core.hot_tier import hot_tier
+from app.core.pubsub import broker
+from app.core.metrics import ROWS_RETURNED
+from app.core.database.functions import to_utc_naive
+from app.core.database.models import SortBy, VehicleDatabase
+
+
+class AsyncVehicleDataService:
+    """
+    Same as VehicleDataService, on an AsyncSession (aiosqlite or asyncpg), so a query never blocks the event loop.
+    """
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def _source(self, initial_timestamp: Optional[datetime] = None, final_timestamp: Optional[datetime] = None):
+        """
+        Get the entity to select the readings of a time range from, see `PartitionService.source`.
+        """
+        return await self.db.run_sync(
+            lambda session: PartitionService(session).source(initial_timestamp, final_timestamp)
+        )
+
+    async def get_vehicle_data(
+        self,
+        vehicle_id: Union[str, List[str], None] = None,
+        initial_timestamp: Optional[datetime] = None,
+        final_timestamp: Optional[datetime] = None,
+        sort_by: Optional[SortBy] = None,
+        limit: int = 100,
+        skip: int = 0,
+    ) -> List[VehicleDatabase]:
+        """
+        Get vehicle data based on the specified filters, through the query cache.
+        """
+        # Only queries on a single vehicle are cached, as the cache is invalidated per vehicle
+        vehicle = single_vehicle_id(vehicle_id)
+        key = make_key(vehicle, initial_timestamp, final_timestamp, sort_by, limit, skip)
+        # Read before the query runs, so a write committed meanwhile keeps its result out of the cache
+        version = query_cache.version(vehicle)
+        rows = query_cache.get(vehicle, key)
+        if rows is not None:
+            return [VehicleDatabase(**row) for row in rows]
+
+        source = await self._source(initial_timestamp, final_timestamp)
+        statement = build_vehicle_data_statement(
+            vehicle_id, initial_timestamp, final_timestamp, sort_by, limit, skip, source=source
+        )
+
+        result = await self.db.execute(statement)
+        vehicles = result.scalars().all()
+        ROWS_RETURNED.inc(len(vehicles))
+        query_cache.set(vehicle, key, [vehicle_to_row(row) for row in vehicles], version)
+        return vehicles
+
+    async def get_vehicle_data_rows(
+        self,
+        vehicle_id: Union[str, List[str], None] = None,
+        initial_timestamp: Optional[datetime] = None,
+        final_timestamp: Optional[datetime] = None,
+        sort_by: Optional[SortBy] = None,
+        limit: int = 100,
+        skip: int = 0,
+    ) -> List[dict]:
+        """
+        Get vehicle data based on the specified filters as plain dictionaries, through the query cache.
+        """
+        # Recent ranges of a single vehicle are answered from memory
+        vehicle = single_vehicle_id(vehicle_id)
+        rows = hot_tier.query(vehicle, initial_timestamp, final_timestamp, sort_by, limit, skip)
+        if rows is not None:
+            return rows
+
+        key = make_key(vehicle, initial_timestamp, final_timestamp, sort_by, limit, skip, view="rows")
+        version = query_cache.version(vehicle)
+        rows = query_cache.get(vehicle, key)
+        if rows is not None:
+            return rows
+
+        source = await self._source(initial_timestamp, final_timestamp)
+        statement = build_vehicle_data_statement(
+            vehicle_id, initial_timestamp, final_timestamp, sort_by, limit, skip, columns=ROW_COLUMNS, source=source
+        )
+
+        result = await self.db.execute(statement)
+        rows = rows_to_dicts(result.all())
+        ROWS_RETURNED.inc(len(rows))
+        query_cache.set(vehicle, key, rows, version)
+        return rows
+
+    async def get_vehicle_data_page(
+        self,
+        vehicle_id: Union[str, List[str], None] = None,
+        initial_timestamp: Optional[datetime] = None,
+        final_timestamp: Optional[datetime] = None,
+        sort_by: Optional[SortBy] = None,
+        limit: Optional[int] = 100,
+        skip: Optional[int] = 0,
+        cursor: Optional[str] = None,
+    ) -> Tuple[List[VehicleDatabase], Optional[str]]:
+        """
+        Get a page of vehicle data with keyset (cursor) pagination on (timestamp, id).
+        """
+        source = await self._source(*page_range(initial_timestamp, final_timestamp, sort_by, cursor))
+        statement = build_vehicle_data_page_statement(
+            vehicle_id, initial_timestamp, final_timestamp, sort_by, limit, skip, cursor, source=source
+        )
+
+        result = await self.db.execute(statement)
+        vehicles = result.scalars().all()
+        ROWS_RETURNED.inc(len(vehicles))
+        return split_page(vehicles, limit)
+
+    async def get_vehicle_data_rows_page(
+        self,
+        vehicle_id: Union[str, List[str], None] = None,
+        initial_timestamp: Optional[datetime] = None,
+        final_timestamp: Optional[datetime] = None,
+        sort_by: Optional[SortBy] = None,
+        limit: Optional[int] = 100,
+        skip: Optional[int] = 0,
+        cursor: Optional[str] = None,
+    ) -> Tuple[List[dict], Optional[str]]:
+        """
+        Same as `get_vehicle_data_page`, with the rows of the page as plain dictionaries.
+
+        Recent pages of a single vehicle are answered from the hot tier, and the first page of a query is
+        cached with its next cursor, as in `VehicleDataService.get_vehicle_data_rows_page`.
+        """
+        page = hot_tier_page(vehicle_id, initial_timestamp, final_timestamp, sort_by, limit, skip, cursor)
+        if page is not None:
+            return page
+
+        if cursor is None:
+            key = page_cache_key(vehicle_id, initial_timestamp, final_timestamp, sort_by, limit, skip)
+            version = query_cache.version(vehicle_id)
+            page = query_cache.get(vehicle_id, key)
+            if page is not None:
+                return page
+
+        source = await self._source(*page_range(initial_timestamp, final_timestamp, sort_by, cursor))
+        statement = build_vehicle_data_page_statement(
+            vehicle_id, initial_timestamp, final_timestamp, sort_by, limit, skip, cursor, columns=ROW_COLUMNS,
+            source=source,
+        )
+
+        result = await self.db.execute(statement)
+        rows = result.all()
+        ROWS_RETURNED.inc(len(rows))
+        rows, next_cursor = split_page(rows, limit)
+        page = rows_to_dicts(rows), next_cursor
+        if cursor is None:
+            query_cache.set(vehicle_id, key, page, version)
+        return page
+
+    async def get_next_cursor(
+        self,
+        vehicle_id: Union[str, List[str], None] = None,
+        initial_timestamp: Optional[datetime] = None,
+        final_timestamp: Optional[datetime] = None,
+        sort_by: Optional[SortBy] = None,
+        limit: int = 100,
+        skip: Optional[int] = 0,
+        cursor: Optional[str] = None,
+    ) -> Optional[str]:
+        """
+        Get the cursor of the page after the page of `get_vehicle_data_page`, without reading that page.
+        """
+        if limit <= 0:
+            return None
+
+        source = await self._source(*page_range(initial_timestamp, final_timestamp, sort_by, cursor))
+        statement = build_next_cursor_statement(
+            vehicle_id, initial_timestamp, final_timestamp, sort_by, limit, skip, cursor, source=source
+        )
+
+        result = await self.db.execute(statement)
+        rows = result.all()
+        return encode_cursor(rows[0]) if len(rows) > 1 else None
+
+    async def stream_vehicle_data(
+        self,
+        vehicle_id: Union[str, List[str], None] = None,
+        initial_timestamp: Optional[datetime] = None,
+        final_timestamp: Optional[datetime] = None,
+        sort_by: Optional[SortBy] = None,
+        limit: Optional[int] = None,
+        skip: Optional[int] = 0,
+        chunk_size: int = 1000,
+        cursor: Optional[str] = None,
+    ) -> AsyncIterator[VehicleDatabase]:
+        """
+        Stream vehicle data based on the specified filters from an async server-side cursor.
+
+        Paged queries (see `is_paged`) stream the rows of the page of `get_vehicle_data_page`, in the
+        same order, without the cursor of the next page: `get_next_cursor` reads it. The query only runs
+        once the iterator is consumed.
+        """
+        if is_paged(vehicle_id, sort_by, cursor):
+            source = await self._source(*page_range(initial_timestamp, final_timestamp, sort_by, cursor))
+            # The page statement selects one extra row, which only tells whether there is a next page
+            statement = build_vehicle_data_page_statement(
+                vehicle_id, initial_timestamp, final_timestamp, sort_by, limit, skip, cursor, source=source
+            )
+        else:
+            source = await self._source(initial_timestamp, final_timestamp)
+            statement = build_vehicle_data_statement(
+                vehicle_id, initial_timestamp, final_timestamp, sort_by, limit, skip, source=source
+            )
+
+        result = await self.db.stream_scalars(statement.execution_options(yield_per=chunk_size))
+        count = 0
+        async for vehicle in result:
+            if limit is not None and count == limit:
+                break
+            count += 1
+            yield vehicle
+
+    async def get_vehicle_data_by_id(self, id: int) -> Optional[VehicleDatabase]:
+        """
+        Get vehicle data by ID.
+        """
+        source = await self.db.run_sync(lambda session: PartitionService(session).source_of_id(id))
+        result = await self.db.execute(select(source).where(source.id == id))
+        vehicle = result.scalars().first()
+        if not vehicle:
+            raise HTTPException(status_code=404, detail=f"Vehicle data with id {id} not found.")
+        return vehicle
+
+    async def add_vehicle_data(self, vehicle_database: VehicleDatabase) -> VehicleDatabase:
+        """
+        Add vehicle data to the database, or get the stored reading with the same (vehicle_id, timestamp).
+        """
+        _, returned = await self._write([vehicle_to_row(vehicle_database)])
+        if returned:
+            return await self.get_vehicle_data_by_id(returned[0][0])
+
+        timestamp = to_utc_naive(vehicle_database.timestamp)
+        source = await self._source(timestamp, timestamp)
+        result = await self.db.execute(
+            select(source).where(source.vehicle_id == vehicle_database.vehicle_id, source.timestamp == timestamp)
+        )
+        return result.scalars().first()
+
+    async def add_vehicle_data_bulk(self, rows: List[dict]) -> int:
+        """
+        Add many vehicle data rows to the database in a single transaction.
+
+        Returns:
+            The number of rows inserted, without the duplicates.
+        """
+        return sum(await self.insert_vehicle_data(rows))
+
+    async def insert_vehicle_data(self, rows: List[dict]) -> List[bool]:
+        """
+        Add many vehicle data rows to the database in a single transaction, skipping the duplicates.
+
+        Returns:
+            Whether each row was inserted, False for the duplicates.
+        """
+        inserted, _ = await self._write(rows)
+        return inserted
+
+    async def _write(self, rows: List[dict]) -> Tuple[List[bool], List[Any]]:
+        """
+        Insert the new rows into their table (vehicle_data or the partition of their month) and update
+        their derived state, then commit.
+
+        Returns:
+            Whether each row was inserted, and the (id, vehicle_id, timestamp) of the inserted rows.
+        """
+        if not rows:
+            return [], []
+
+        rows, first = deduplicate_rows(rows)
+        try:
+            dialect_name = self.db.get_bind().dialect.name
+            groups = await self.db.run_sync(
+                lambda session: PartitionService(session).route([row for row, is_first in zip(rows, first) if is_first])
+            )
+            returned = []
+            for table, group in groups:
+                result = await self.db.execute(build_insert_statement(dialect_name, table), group)
+                returned += result.all()
+            inserted = inserted_flags(rows, first, returned)
+            new_rows = [row for row, is_inserted in zip(rows, inserted) if is_inserted]
+
+            if settings.rollups_enabled:
+                await self.db.run_sync(lambda session: RollupService(session).add(new_rows))
+            await self.db.run_sync(lambda session: TripService(session).mark_dirty(new_rows))
+            await self.db.run_sync(lambda session: LatestStateService(session).upsert(new_rows))
+            await self.db.commit()
+        except Exception as e:
+            await self.db.rollback()
+            raise HTTPException(status_code=500, detail=str(e))
+
+        if new_rows:
+            query_cache.invalidate(row["vehicle_id"] for row in new_rows)
+            hot_tier.add(new_rows, returned)
+            broker.publish(new_rows)
+
+        return inserted, returned
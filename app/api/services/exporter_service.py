@@ -1,87 +1,336 @@
 import csv
 import io
-import json
-from typing import List, Union
+from abc import ABC, abstractmethod
+from typing import Any, AsyncIterable, AsyncIterator, Iterable, Iterator, List, Optional, Union
+
+import orjson
+import pyarrow as pa
+import pyarrow.parquet as pq
+from starlette.concurrency import run_in_threadpool
 
-from app.api.models.vehicle_data import VehicleModel
 from app.core.database.models import ExportFormat
-from fastapi.encoders import jsonable_encoder
+from app.core.metrics import ROWS_EXPORTED
+
+
+# Columns written by every export format, in order
+EXPORT_FIELDS = ["vehicle_id", "timestamp", "speed", "odometer", "elevation", "soc", "shift_state"]
+
+# Number of rows encoded per chunk, unless the encoder asks for another
+DEFAULT_CHUNK_SIZE = 1000
+
+# Typed columns of the columnar formats. The repeated strings are dictionary-encoded (categorical).
+ARROW_SCHEMA = pa.schema(
+    [
+        ("vehicle_id", pa.dictionary(pa.int32(), pa.string())),
+        ("timestamp", pa.timestamp("us")),
+        ("speed", pa.float64()),
+        ("odometer", pa.float64()),
+        ("elevation", pa.float64()),
+        ("soc", pa.float64()),
+        ("shift_state", pa.dictionary(pa.int32(), pa.string())),
+    ]
+)
+
+
+def _row_values(row: Any) -> List[Any]:
+    """
+    Get the exported column values of a row.
+    """
+    return [getattr(row, field) for field in EXPORT_FIELDS]
+
+
+class CsvEncoder:
+    """
+    Encode chunks of rows as CSV, after a header row.
+    """
+
+    def header(self) -> str:
+        return ",".join(EXPORT_FIELDS) + "\n"
+
+    def encode(self, rows: List[Any]) -> str:
+        # Create a CSV file-like object in memory for the chunk
+        csv_file = io.StringIO()
+        csv_writer = csv.writer(csv_file, lineterminator='\n')
+
+        for row in rows:
+            values = _row_values(row)
+            if values[1] is not None:
+                values[1] = values[1].isoformat()
+            csv_writer.writerow(values)
+
+        return csv_file.getvalue()
+
+    def footer(self) -> str:
+        return ""
+
+
+class JsonEncoder:
+    """
+    Encode chunks of rows as the elements of a single JSON array.
+    """
+
+    def __init__(self):
+        self.separator = ""
+
+    def header(self) -> str:
+        return "["
+
+    def encode(self, rows: List[Any]) -> str:
+        chunk = self.separator + ",".join(
+            orjson.dumps(dict(zip(EXPORT_FIELDS, _row_values(row)))).decode() for row in rows
+        )
+        self.separator = ","
+        return chunk
+
+    def footer(self) -> str:
+        return "]"
+
+
+class NdjsonEncoder:
+    """
+    Encode chunks of rows as newline-delimited JSON, one object per line.
+
+    Every line is complete on its own, so a consumer can process the rows as they arrive.
+    """
+
+    def header(self) -> str:
+        return ""
+
+    def encode(self, rows: List[Any]) -> str:
+        return "".join(
+            orjson.dumps(dict(zip(EXPORT_FIELDS, _row_values(row))), option=orjson.OPT_APPEND_NEWLINE).decode()
+            for row in rows
+        )
+
+    def footer(self) -> str:
+        return ""
+
+
+def _record_batch(rows: List[Any]) -> pa.RecordBatch:
+    """
+    Convert a chunk of rows into an Arrow record batch of ARROW_SCHEMA.
+    """
+    columns = []
+    for index, field in enumerate(ARROW_SCHEMA):
+        values = [getattr(row, field.name) for row in rows]
+        if pa.types.is_dictionary(field.type):
+            column = pa.array(values, type=field.type.value_type).dictionary_encode()
+        else:
+            column = pa.array(values, type=field.type)
+        columns.append(column)
+    return pa.RecordBatch.from_arrays(columns, schema=ARROW_SCHEMA)
+
+
+class _ColumnarEncoder(ABC):
+    """
+    Base of the binary columnar encoders, which write to an in-memory sink that is drained after every chunk.
+    """
+
+    # Columnar formats compress better, and cost less per row, with larger batches
+    chunk_size = 10000
+
+    # Encoding a batch of this size is CPU-bound for long: async streams run it in the thread pool
+    cpu_bound = True
+
+    def __init__(self):
+        self.sink = io.BytesIO()
+        self.writer = None
+
+    @abstractmethod
+    def _open(self):
+        """
+        Open the writer of the format on the sink, writing its header.
+        """
+
+    def _drain(self) -> bytes:
+        data = self.sink.getvalue()
+        self.sink.seek(0)
+        self.sink.truncate()
+        return data
+
+    def header(self) -> bytes:
+        self.writer = self._open()
+        return self._drain()
+
+    def encode(self, rows: List[Any]) -> bytes:
+        self.writer.write_batch(_record_batch(rows))
+        return self._drain()
+
+    def footer(self) -> bytes:
+        self.writer.close()
+        return self._drain()
+
+
+class ArrowEncoder(_ColumnarEncoder):
+    """
+    Encode chunks of rows as the record batches of an Arrow IPC stream, after its schema.
+    """
+
+    def _open(self):
+        return pa.ipc.new_stream(self.sink, ARROW_SCHEMA)
+
+
+class ParquetEncoder(_ColumnarEncoder):
+    """
+    Encode chunks of rows as the row groups of a Parquet file, whose metadata is written in the footer.
+    """
+
+    def _open(self):
+        return pq.ParquetWriter(self.sink, ARROW_SCHEMA, compression="zstd")
+
+
+# Encoder class of each export format
+ENCODERS = {
+    ExportFormat.CSV: CsvEncoder,
+    ExportFormat.JSON: JsonEncoder,
+    ExportFormat.NDJSON: NdjsonEncoder,
+    ExportFormat.ARROW: ArrowEncoder,
+    ExportFormat.PARQUET: ParquetEncoder,
+}
+
+# Media type of each export format
+MEDIA_TYPES = {
+    ExportFormat.CSV: "text/csv",
+    ExportFormat.JSON: "application/json",
+    ExportFormat.NDJSON: "application/x-ndjson",
+    ExportFormat.ARROW: "application/vnd.apache.arrow.stream",
+    ExportFormat.PARQUET: "application/vnd.apache.parquet",
+}
 
 
 class ExporterService:
     """
-    Utility class for exporting vehicle data to CSV or JSON format.
+    Utility class for exporting vehicle data to CSV, JSON, NDJSON, Arrow IPC stream or Parquet format.
     """
 
     @staticmethod
-    def export(vehicle_data: List[VehicleModel], export_format: ExportFormat) -> Union[str, bytes]:
+    def media_type(export_format: ExportFormat) -> str:
+        """
+        Get the media type of the specified export format.
+        """
+        return MEDIA_TYPES[export_format]
+
+    @staticmethod
+    def export(vehicle_data: Iterable[Any], export_format: ExportFormat) -> Union[str, bytes]:
         """
-        Export vehicle data in the specified format (CSV or JSON).
+        Export vehicle data in the specified format.
 
         Args:
-            vehicle_data: A list of VehicleModel objects.
-            export_format: The export format ("csv" or "json").
+            vehicle_data: VehicleDatabase or VehicleModel objects.
+            export_format: The export format.
 
         Returns:
-            The vehicle data in the specified format as a string or bytes object, depending on the Python version.
+            The vehicle data in the specified format, as a string for CSV and JSON and as bytes for
+            the binary formats (Arrow and Parquet).
         """
-        if export_format == ExportFormat.CSV:
-            # Export the data as CSV
-            csv_data = ExporterService._export_csv(vehicle_data)
-            return csv_data
-        elif export_format == ExportFormat.JSON:
-            # Export the data as JSON
-            json_data = ExporterService._export_json(vehicle_data)
-            return json_data
-        else:
+        chunks = list(ExporterService.stream(vehicle_data, export_format))
+        return (b"" if chunks and isinstance(chunks[0], bytes) else "").join(chunks)
+
+    @staticmethod
+    def _encoder(export_format: ExportFormat):
+        """
+        Create the encoder of the specified export format.
+        """
+        if export_format not in ENCODERS:
             # Invalid export format
             raise ValueError(f"Invalid export format: {export_format}")
+        return ENCODERS[export_format]()
 
     @staticmethod
-    def _export_csv(vehicle_data: List[VehicleModel]) -> Union[str, bytes]:
+    def stream(
+        vehicle_data: Iterable[Any], export_format: ExportFormat, chunk_size: Optional[int] = None
+    ) -> Iterator[Union[str, bytes]]:
         """
-        Export vehicle data as CSV.
+        Encode vehicle data in the specified format as a stream of chunks.
+
+        The rows are consumed lazily and encoded `chunk_size` at a time, so memory use does not
+        depend on the size of the export. The first chunk is produced before any row is read.
+        For the columnar formats every chunk is one Arrow record batch or Parquet row group.
 
         Args:
-            vehicle_data: A list of VehicleModel objects.
+            vehicle_data: VehicleDatabase or VehicleModel objects, typically a server-side cursor.
+            export_format: The export format.
+            chunk_size: The number of rows encoded per chunk, by default the one of the format.
 
         Returns:
-            The vehicle data as a CSV string or bytes object, depending on the Python version.
+            An iterator over the encoded chunks.
         """
-        json_data = jsonable_encoder(vehicle_data)
+        encoder = ExporterService._encoder(export_format)
+        return ExporterService._stream(
+            vehicle_data, encoder, chunk_size or ExporterService._chunk_size(encoder), export_format
+        )
 
-        # Create a CSV file-like object in memory
-        csv_file = io.StringIO()
+    @staticmethod
+    def astream(
+        vehicle_data: AsyncIterable[Any], export_format: ExportFormat, chunk_size: Optional[int] = None
+    ) -> AsyncIterator[Union[str, bytes]]:
+        """
+        Encode vehicle data read from an async server-side cursor as a stream of chunks.
 
-        # Create a CSV writer object
-        csv_writer = csv.writer(csv_file, lineterminator='\n')
+        Same as `stream`, for the rows of the AsyncVehicleDataService. The chunks of the columnar
+        formats are encoded in the thread pool, so the event loop serves other requests meanwhile.
+        """
+        encoder = ExporterService._encoder(export_format)
+        return ExporterService._astream(
+            vehicle_data, encoder, chunk_size or ExporterService._chunk_size(encoder), export_format
+        )
+
+    @staticmethod
+    def _chunk_size(encoder) -> int:
+        return getattr(encoder, "chunk_size", DEFAULT_CHUNK_SIZE)
 
-        # Write the CSV header row
-        csv_writer.writerow(["vehicle_id", "timestamp", "speed", "odometer", "elevation", "soc", "shift_state"])
+    @staticmethod
+    async def _aencode(encoder, rows: List[Any]) -> Union[str, bytes]:
+        if getattr(encoder, "cpu_bound", False):
+            return await run_in_threadpool(encoder.encode, rows)
+        return encoder.encode(rows)
 
-        # Write each data row to the CSV file
-        for row in json_data:
-            csv_writer.writerow([row["vehicle_id"], row["timestamp"], row["speed"], row["odometer"], row["elevation"], row["soc"], row["shift_state"]])
+    @staticmethod
+    def _stream(
+        vehicle_data: Iterable[Any], encoder, chunk_size: int, export_format: ExportFormat
+    ) -> Iterator[Union[str, bytes]]:
+        rows_exported = ROWS_EXPORTED.labels(export_format.value)
+        header = encoder.header()
+        if header:
+            yield header
 
-        # Get the CSV data as a string
-        csv_data = csv_file.getvalue()
+        chunk = []
+        for row in vehicle_data:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield encoder.encode(chunk)
+                rows_exported.inc(len(chunk))
+                chunk = []
 
-        # Print the CSV data
-        print(csv_data)
-        return csv_data
+        if chunk:
+            yield encoder.encode(chunk)
+            rows_exported.inc(len(chunk))
+
+        footer = encoder.footer()
+        if footer:
+            yield footer
 
     @staticmethod
-    def _export_json(vehicle_data: List[VehicleModel]) -> str:
-        """
-        Export vehicle data as JSON.
+    async def _astream(
+        vehicle_data: AsyncIterable[Any], encoder, chunk_size: int, export_format: ExportFormat
+    ) -> AsyncIterator[Union[str, bytes]]:
+        rows_exported = ROWS_EXPORTED.labels(export_format.value)
+        header = encoder.header()
+        if header:
+            yield header
 
-        Args:
-            vehicle_data: A list of VehicleModel objects.
+        chunk = []
+        async for row in vehicle_data:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield await ExporterService._aencode(encoder, chunk)
+                rows_exported.inc(len(chunk))
+                chunk = []
 
-        Returns:
-            The vehicle data as a JSON string.
-        """
-        # Convert the VehicleModel objects to a list of dictionaries
-        json_data = jsonable_encoder(vehicle_data)
+        if chunk:
+            yield await ExporterService._aencode(encoder, chunk)
+            rows_exported.inc(len(chunk))
 
-        return json_data
+        footer = encoder.footer()
+        if footer:
+            yield footer
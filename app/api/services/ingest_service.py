@@ -0,0 +1,117 @@
+"""
+This module defines the service used to parse and validate batches of vehicle data.
+"""
+
+from typing import Any, AsyncIterable, List, Optional, Tuple
+
+import orjson
+from pydantic import ValidationError
+
+from app.api.models.vehicle_data import BatchItemStatus, VehicleModel
+
+
+# Maximum number of readings accepted in a single batch ingest request
+MAX_BATCH_SIZE = 10000
+
+# Maximum size of a batch ingest request body: 1 KiB per reading, several times a typical reading
+MAX_BATCH_BYTES = MAX_BATCH_SIZE * 1024
+
+NDJSON_MEDIA_TYPES = ("application/x-ndjson", "application/ndjson")
+
+
+class BatchTooLargeError(ValueError):
+    """
+    Raised when a batch holds more than MAX_BATCH_SIZE readings, or more than MAX_BATCH_BYTES bytes.
+    """
+
+
+class IngestService:
+    """
+    Utility class for turning a batch request body into rows ready to be inserted.
+    """
+
+    @staticmethod
+    async def read_body(chunks: AsyncIterable[bytes], content_length: Optional[str] = None) -> bytes:
+        """
+        Read a batch request body, refusing it before it is read in full if it is too large.
+
+        Args:
+            chunks: The chunks of the request body, as received.
+            content_length: The Content-Length header of the request, checked before reading.
+
+        Returns:
+            The raw request body.
+
+        Raises:
+            BatchTooLargeError: If the body holds more than MAX_BATCH_BYTES bytes.
+        """
+        if content_length is not None and content_length.isdigit() and int(content_length) > MAX_BATCH_BYTES:
+            raise BatchTooLargeError(f"A batch holds at most {MAX_BATCH_BYTES} bytes, got {content_length}")
+
+        # The header may be missing (chunked encoding) or wrong, so the bytes read are counted too
+        body = bytearray()
+        async for chunk in chunks:
+            body += chunk
+            if len(body) > MAX_BATCH_BYTES:
+                raise BatchTooLargeError(f"A batch holds at most {MAX_BATCH_BYTES} bytes")
+        return bytes(body)
+
+    @staticmethod
+    def parse_body(body: bytes, content_type: str = "application/json") -> List[Any]:
+        """
+        Parse a batch request body, either a JSON array or NDJSON (one JSON object per line).
+
+        Args:
+            body: The raw request body.
+            content_type: The Content-Type header of the request.
+
+        Returns:
+            The list of decoded readings, not validated yet.
+
+        Raises:
+            ValueError: If the body cannot be decoded.
+            BatchTooLargeError: If the body holds more than MAX_BATCH_SIZE readings.
+        """
+        media_type = content_type.split(";")[0].strip().lower()
+
+        try:
+            if media_type in NDJSON_MEDIA_TYPES:
+                items = [orjson.loads(line) for line in body.splitlines() if line.strip()]
+            else:
+                items = orjson.loads(body)
+        except orjson.JSONDecodeError as e:
+            raise ValueError(f"Invalid request body: {e}")
+
+        if not isinstance(items, list):
+            raise ValueError("The request body must be a JSON array or NDJSON")
+
+        if len(items) > MAX_BATCH_SIZE:
+            raise BatchTooLargeError(f"A batch holds at most {MAX_BATCH_SIZE} readings, got {len(items)}")
+
+        return items
+
+    @staticmethod
+    def validate(items: List[Any]) -> Tuple[List[dict], List[BatchItemStatus]]:
+        """
+        Validate every reading of a batch against the VehicleModel.
+
+        Args:
+            items: The decoded readings.
+
+        Returns:
+            The column values of the valid readings, and the status of every reading in request order.
+        """
+        rows = []
+        statuses = []
+
+        for index, item in enumerate(items):
+            try:
+                vehicle = VehicleModel.parse_obj(item)
+            except ValidationError as e:
+                statuses.append(BatchItemStatus(index=index, status="rejected", errors=e.errors()))
+                continue
+
+            rows.append(vehicle.dict())
+            statuses.append(BatchItemStatus(index=index, status="created"))
+
+        return rows, statuses
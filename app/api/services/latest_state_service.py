@@ -0,0 +1,131 @@
+"""
+This module defines the service maintaining the latest state of every vehicle.
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database.functions import dialect_insert, to_utc_naive
+from app.core.database.models import LatestVehicleStateDatabase
+
+
+# Reading fields copied into the latest state
+STATE_FIELDS = ["timestamp", "speed", "odometer", "soc", "elevation", "shift_state"]
+
+STATE_COLUMNS = [
+    LatestVehicleStateDatabase.vehicle_id,
+    *[getattr(LatestVehicleStateDatabase, field) for field in STATE_FIELDS],
+    LatestVehicleStateDatabase.updated_at,
+]
+
+
+def newest_rows(rows: Iterable[dict]) -> List[dict]:
+    """
+    Get the newest row of every vehicle. Of rows with the same timestamp, the last one wins.
+
+    Args:
+        rows: Dictionaries of VehicleDatabase column values. Rows without a timestamp are ignored.
+
+    Returns:
+        One dictionary of LatestVehicleStateDatabase column values per vehicle, without `updated_at`.
+    """
+    newest: Dict[str, dict] = {}
+    for row in rows:
+        if row.get("timestamp") is None:
+            continue
+        timestamp = to_utc_naive(row["timestamp"])
+        current = newest.get(row["vehicle_id"])
+        if current is None or timestamp >= current["timestamp"]:
+            newest[row["vehicle_id"]] = dict(
+                {field: row.get(field) for field in STATE_FIELDS}, vehicle_id=row["vehicle_id"], timestamp=timestamp
+            )
+    return list(newest.values())
+
+
+class LatestStateService:
+    """
+    Maintain and read the newest reading of every vehicle, for fleet maps.
+
+    The state is upserted in the transaction writing the raw rows, and only replaced by a reading at
+    least as recent, so backfilled history never overwrites it. It works on a synchronous Session; the
+    async services call it through `AsyncSession.run_sync`.
+
+    `updated_at` is the time of the write, taken before its commit: a state becomes visible up to the
+    duration of its transaction (and the clock skew between the workers) after its `updated_at`. Polls
+    with `since` therefore also return the states updated a configurable overlap before it, so a poller
+    passing the newest `updated_at` it received never misses a state, but may get some twice.
+    """
+
+    def __init__(self, db: Session, since_overlap: Optional[timedelta] = None):
+        self.db = db
+        self.since_overlap = (
+            since_overlap if since_overlap is not None else timedelta(seconds=settings.latest_state_since_overlap_seconds)
+        )
+
+    def upsert(self, rows: Iterable[dict]) -> None:
+        """
+        Merge new rows of vehicle data into the latest states, without committing.
+
+        Args:
+            rows: Dictionaries of VehicleDatabase column values.
+        """
+        # A single statement cannot update the same row twice, so only the newest row of each vehicle is sent
+        states = newest_rows(rows)
+        if not states:
+            return
+
+        updated_at = datetime.utcnow()
+        for state in states:
+            state["updated_at"] = updated_at
+
+        insert = dialect_insert(self.db.get_bind().dialect.name)
+        statement = insert(LatestVehicleStateDatabase)
+        existing = LatestVehicleStateDatabase.__table__.c
+        statement = statement.on_conflict_do_update(
+            index_elements=[existing.vehicle_id],
+            set_={field: statement.excluded[field] for field in STATE_FIELDS + ["updated_at"]},
+            where=statement.excluded.timestamp >= existing.timestamp,
+        )
+        self.db.execute(statement, states)
+
+    def delete_before(self, cutoff: datetime) -> None:
+        """
+        Delete the states of the vehicles without any reading from `cutoff` on, without committing.
+
+        Used when the readings before `cutoff` are expired: the newest reading of these vehicles is gone.
+        """
+        state = LatestVehicleStateDatabase
+        self.db.execute(delete(state).where(state.timestamp < cutoff))
+
+    def get_latest(
+        self,
+        vehicle_id: Optional[Sequence[str]] = None,
+        since: Optional[datetime] = None,
+        limit: Optional[int] = None,
+        skip: int = 0,
+    ) -> List[dict]:
+        """
+        Get the latest state of vehicles, ordered by vehicle ID, in one read of the state table.
+
+        Args:
+            vehicle_id: The IDs of the vehicles, or None for every vehicle.
+            since: Only the vehicles whose state was updated after this time, minus the overlap.
+            limit: The maximum number of vehicles to return.
+            skip: The number of vehicles to skip.
+
+        Returns:
+            A dictionary of LatestVehicleStateDatabase column values per vehicle.
+        """
+        state = LatestVehicleStateDatabase
+        statement = select(*STATE_COLUMNS)
+        if vehicle_id:
+            statement = statement.where(state.vehicle_id.in_(list(vehicle_id)))
+        if since is not None:
+            statement = statement.where(state.updated_at > to_utc_naive(since) - self.since_overlap)
+        statement = statement.order_by(state.vehicle_id).offset(skip).limit(limit)
+
+        return [dict(row) for row in self.db.execute(statement).mappings()]
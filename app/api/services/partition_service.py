@@ -0,0 +1,235 @@
+"""
+This module defines the service managing the monthly partitions of the vehicle data.
+"""
+
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import Table, delete, func, select
+from sqlalchemy.orm import Session
+
+from app.api.services.latest_state_service import LatestStateService
+from app.api.services.rollup_service import RollupService
+from app.api.services.trip_service import TripService
+from app.core.cache import query_cache
+from app.core.config import settings
+from app.core.database.functions import dialect_insert
+from app.core.database.models import VehicleDatabase, VehicleDataPartitionDatabase
+from app.core.database.partitions import (
+    add_months,
+    create_partition,
+    month_start,
+    partition_name,
+    partition_start_of_id,
+    partition_table,
+    partition_tables,
+    vehicle_data_source,
+)
+
+
+def retention_cutoff(months: int, now: Optional[datetime] = None) -> datetime:
+    """
+    Get the start of the oldest month kept by a retention of `months` months, counting the current month.
+    """
+    return add_months(month_start(now or datetime.utcnow()), -months)
+
+
+class PartitionService:
+    """
+    Route vehicle data to its monthly partitions, and expire old months.
+
+    With partitioning enabled, a reading is written to the partition of its month, created on demand.
+    Readings without a timestamp, and readings of months without a partition, go to vehicle_data.
+    Reads only touch vehicle_data and the partitions overlapping their time range. It works on a
+    synchronous Session; the async services call it through `AsyncSession.run_sync`.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def source(self, initial_timestamp: Optional[datetime] = None, final_timestamp: Optional[datetime] = None):
+        """
+        Get the entity to select the readings of a time range from, in place of VehicleDatabase.
+        """
+        return vehicle_data_source(partition_tables(self.db, initial_timestamp, final_timestamp))
+
+    def source_of_id(self, id: int):
+        """
+        Get the entity to select the reading of an id from.
+
+        An id assigned by a partition is only looked up in that partition. Readings moved from
+        vehicle_data keep their id, so the ids of vehicle_data are looked up in every table.
+        """
+        start = partition_start_of_id(id)
+        if start is None:
+            return self.source()
+
+        partition = VehicleDataPartitionDatabase
+        registered = self.db.execute(select(partition.name).where(partition.range_start == start)).first()
+        return vehicle_data_source([partition_table(start) if registered else VehicleDatabase.__table__])
+
+    def route(self, rows: List[dict]) -> List[Tuple[Table, List[dict]]]:
+        """
+        Group rows to be inserted by their table, creating the missing partitions if enabled, without committing.
+
+        A row whose (vehicle_id, timestamp) is still stored in vehicle_data, written before its month
+        was partitioned and not moved yet, is routed to vehicle_data, so it is found to be a duplicate
+        there instead of being stored a second time in the partition.
+
+        Args:
+            rows: Dictionaries of VehicleDatabase column values, with naive UTC timestamps.
+
+        Returns:
+            The (table, rows) pairs.
+        """
+        months = {month_start(row["timestamp"]) for row in rows if row["timestamp"] is not None}
+        partitioned = set()
+        if months:
+            partition = VehicleDataPartitionDatabase
+            partitioned = set(
+                self.db.execute(select(partition.range_start).where(partition.range_start.in_(months))).scalars()
+            )
+            if settings.partitioning_enabled:
+                for start in months - partitioned:
+                    create_partition(self.db.connection(), start)
+                partitioned = months
+
+        legacy = set()
+        routed = [row for row in rows if row["timestamp"] is not None and month_start(row["timestamp"]) in partitioned]
+        if routed:
+            # One range scan of the (vehicle_id, timestamp) index per vehicle, empty once the legacy readings are moved
+            vehicle = VehicleDatabase.__table__.c
+            legacy = set(self.db.execute(
+                select(vehicle.vehicle_id, vehicle.timestamp).where(
+                    vehicle.vehicle_id.in_({row["vehicle_id"] for row in routed}),
+                    vehicle.timestamp >= min(row["timestamp"] for row in routed),
+                    vehicle.timestamp <= max(row["timestamp"] for row in routed),
+                )
+            ).all())
+
+        groups: Dict[Optional[datetime], List[dict]] = {}
+        for row in rows:
+            start = None if row["timestamp"] is None else month_start(row["timestamp"])
+            if start not in partitioned or (row["vehicle_id"], row["timestamp"]) in legacy:
+                start = None
+            groups.setdefault(start, []).append(row)
+
+        return [
+            (VehicleDatabase.__table__ if start is None else partition_table(start), group)
+            for start, group in groups.items()
+        ]
+
+    def premake(self, months: int, now: Optional[datetime] = None) -> List[str]:
+        """
+        Create the partitions of the current month and of the next `months` months, and commit.
+
+        Creating them ahead keeps the DDL off the write path, and lets the other processes see a
+        partition before its first reading is written.
+
+        Returns:
+            The names of the partitions.
+        """
+        start = month_start(now or datetime.utcnow())
+        tables = [create_partition(self.db.connection(), add_months(start, i)) for i in range(months + 1)]
+        self.db.commit()
+        return [table.name for table in tables]
+
+    def move_legacy(self, chunk_size: int = 10000) -> int:
+        """
+        Move the readings of vehicle_data with a timestamp into the partitions of their month.
+
+        It converts a database written before partitioning, oldest month first, `chunk_size` readings
+        per transaction. The readings keep their ids. A reading whose (vehicle_id, timestamp) was
+        written to the partition in the meantime is dropped.
+
+        Returns:
+            The number of readings moved.
+        """
+        legacy = VehicleDatabase.__table__
+        insert = dialect_insert(self.db.get_bind().dialect.name)
+        columns = [column.name for column in legacy.columns]
+
+        total = 0
+        while True:
+            oldest = self.db.execute(select(func.min(legacy.c.timestamp))).scalar()
+            if oldest is None:
+                break
+
+            start = month_start(oldest)
+            table = create_partition(self.db.connection(), start)
+            ids = self.db.execute(
+                select(legacy.c.id)
+                .where(legacy.c.timestamp >= start, legacy.c.timestamp < add_months(start, 1))
+                .order_by(legacy.c.id)
+                .limit(chunk_size)
+            ).scalars().all()
+
+            self.db.execute(
+                insert(table)
+                .from_select(columns, select(legacy).where(legacy.c.id.in_(ids)))
+                .on_conflict_do_nothing(index_elements=["vehicle_id", "timestamp"])
+            )
+            self.db.execute(delete(legacy).where(legacy.c.id.in_(ids)))
+            self.db.commit()
+            total += len(ids)
+
+        return total
+
+    def drop_partitions(self, before: Optional[datetime] = None) -> List[str]:
+        """
+        Drop the partitions ending at or before `before`, or every partition, and commit.
+
+        Each partition is dropped with its table, whatever its number of readings.
+
+        Returns:
+            The names of the partitions dropped.
+        """
+        partition = VehicleDataPartitionDatabase
+        statement = select(partition.range_start).order_by(partition.range_start)
+        if before is not None:
+            statement = statement.where(partition.range_end <= before)
+
+        names = []
+        for start in self.db.execute(statement).scalars().all():
+            self.db.execute(delete(partition).where(partition.range_start == start))
+            partition_table(start).drop(bind=self.db.connection(), checkfirst=True)
+            names.append(partition_name(start))
+
+        self.db.commit()
+        return names
+
+    def apply_retention(self, cutoff: datetime, chunk_size: int = 10000) -> Tuple[List[str], int]:
+        """
+        Delete the readings before a month, with the rollups, trips and latest states derived from them.
+
+        The partitions before the month are dropped a table at a time. Only the older readings left
+        in vehicle_data are deleted row by row, `chunk_size` per transaction. The query cache of this
+        process is cleared; the other processes see the deletion once their cache TTL expires.
+
+        Args:
+            cutoff: The oldest timestamp kept, rounded down to the start of its month.
+            chunk_size: The number of readings of vehicle_data deleted per transaction.
+
+        Returns:
+            The names of the partitions dropped, and the number of readings deleted from vehicle_data.
+        """
+        cutoff = month_start(cutoff)
+        dropped = self.drop_partitions(before=cutoff)
+
+        legacy = VehicleDatabase.__table__
+        deleted = 0
+        while True:
+            expired = select(legacy.c.id).where(legacy.c.timestamp < cutoff).limit(chunk_size)
+            count = self.db.execute(delete(legacy).where(legacy.c.id.in_(expired))).rowcount
+            self.db.commit()
+            deleted += count
+            if count < chunk_size:
+                break
+
+        RollupService(self.db).delete_before(cutoff)
+        TripService(self.db).delete_before(cutoff)
+        LatestStateService(self.db).delete_before(cutoff)
+        self.db.commit()
+        query_cache.clear()
+
+        return dropped, deleted
@@ -0,0 +1,448 @@
+"""
+This module defines the service resampling the vehicle data of a vehicle on a regular time grid.
+"""
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.api.services.exporter_service import EXPORT_FIELDS
+from app.api.services.partition_service import PartitionService
+from app.core.database.functions import to_utc_naive
+from app.core.database.models import FillStrategy
+
+
+# Fields of the resampled series, each with its own fill strategy
+RESAMPLED_FIELDS = ["speed", "odometer", "elevation", "soc", "shift_state"]
+
+# Fields stored as object arrays, where None stands for NULL. The others are float arrays with NaN.
+OBJECT_FIELDS = {"shift_state"}
+
+# A point of a resampled series, with the exported fields, so ExporterService encodes it like a reading
+ResampledPoint = namedtuple("ResampledPoint", EXPORT_FIELDS)
+
+
+def _to_microseconds(timestamp: datetime) -> int:
+    return int(np.datetime64(to_utc_naive(timestamp), "us").astype(np.int64))
+
+
+def _known(values: np.ndarray) -> np.ndarray:
+    if values.dtype == object:
+        return np.not_equal(values, None)
+    return ~np.isnan(values)
+
+
+class Resampler:
+    """
+    Resample a series of readings on a regular grid, one vectorised pass per chunk of readings.
+
+    The readings are fed in timestamp order, and the grid points are produced as soon as no later reading
+    can change them. Only the readings after the last grid point produced are kept, with the last known
+    value of every field before them, so memory does not depend on the length of the range.
+
+    An interpolated grid point needs the next known value of its field. Without it, the grid points after
+    the last known value wait for the next one to be fed; `set_upcoming` gives it ahead of the readings,
+    so a run of NULLs does not hold the grid points back.
+    """
+
+    def __init__(
+        self,
+        step: timedelta,
+        fills: Dict[str, FillStrategy],
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        chunk_size: int = 10000,
+        max_points: Optional[int] = None,
+    ):
+        """
+        Args:
+            step: The interval between two grid points.
+            fills: The fill strategy of every resampled field.
+            start: The first grid point, by default the first reading rounded up to a multiple of the step.
+            end: The last grid point at most, by default the last reading.
+            chunk_size: The largest number of grid points produced at a time.
+            max_points: The largest number of grid points produced in total, unlimited by default.
+        """
+        self.step = step // timedelta(microseconds=1)
+        if self.step <= 0:
+            raise ValueError(f"The resampling interval must be at least 1 microsecond: {step}")
+        self.fills = fills
+        self.dtypes = {field: object if field in OBJECT_FIELDS else np.float64 for field in fills}
+        self.end = None if end is None else _to_microseconds(end)
+        self.chunk_size = chunk_size
+        self.max_points = max_points
+        # Last grid point allowed by max_points
+        self.limit = None
+        # Next grid point, in microseconds since the epoch
+        self.next = None
+        if start is not None:
+            self._begin(_to_microseconds(start))
+
+        # Readings fed and not yet passed by the grid points, one (timestamps, values) pair per chunk
+        self.chunks: List[Tuple[np.ndarray, Dict[str, np.ndarray]]] = []
+        # Timestamp of the last reading fed
+        self.last = None
+        # Last known (timestamp, value) of every field among the readings passed by the grid points
+        self.previous: Dict[str, Tuple[int, object]] = {}
+        # Next known (timestamp, value) of linear fields after the readings fed, or None when there is none
+        self.upcoming: Dict[str, Optional[Tuple[int, object]]] = {}
+
+    def set_upcoming(self, field: str, timestamp: Optional[datetime], value: object = None) -> None:
+        """
+        Give the next known value of a linear field, at or after the last reading fed, or None if it has none.
+        """
+        self.upcoming[field] = None if timestamp is None else (_to_microseconds(timestamp), value)
+
+    def awaiting(self, field: str, timestamp: datetime) -> bool:
+        """
+        Whether a linear field lacks a next known value at or after `timestamp`, given by `set_upcoming`.
+        """
+        return self._awaiting(field, _to_microseconds(timestamp))
+
+    def _awaiting(self, field: str, timestamp: int) -> bool:
+        if field not in self.upcoming:
+            return True
+        upcoming = self.upcoming[field]
+        return upcoming is not None and upcoming[0] < timestamp
+
+    def feed(self, timestamps: np.ndarray, values: Dict[str, np.ndarray]) -> Iterator[Dict[str, np.ndarray]]:
+        """
+        Add readings, later than the readings already fed.
+
+        Args:
+            timestamps: The timestamps of the readings as datetime64, in ascending order.
+            values: The values of every resampled field, NaN or None for NULL.
+
+        Returns:
+            An iterator over the columns of the grid points the readings complete.
+        """
+        if len(timestamps) == 0:
+            return
+
+        timestamps = timestamps.astype("datetime64[us]").astype(np.int64)
+        self.chunks.append((timestamps, {field: values[field] for field in self.fills}))
+        self.last = int(timestamps[-1])
+
+        if self.next is None:
+            self._begin(-(-int(timestamps[0]) // self.step) * self.step)
+
+        # A later reading with the same timestamp can still change the grid points at the last timestamp,
+        # and an interpolated value needs a known value after the grid point
+        until = self.last
+        for field, fill in self.fills.items():
+            if fill == FillStrategy.LINEAR and self._awaiting(field, self.last):
+                last_known = self._last_known(field)
+                if last_known is not None:
+                    until = min(until, last_known)
+
+        yield from self._emit(until - 1)
+
+    def finish(self) -> Iterator[Dict[str, np.ndarray]]:
+        """
+        Get the remaining grid points, once every reading is fed.
+        """
+        end = self.end if self.end is not None else self.last
+        if self.next is None or end is None:
+            return
+        yield from self._emit(end)
+
+    def _begin(self, first: int) -> None:
+        self.next = first
+        if self.max_points is not None:
+            self.limit = first + (self.max_points - 1) * self.step
+
+    def _last_known(self, field: str) -> Optional[int]:
+        """
+        Get the timestamp of the last known value of a field among the readings fed.
+        """
+        for timestamps, values in reversed(self.chunks):
+            known = np.flatnonzero(_known(values[field]))
+            if len(known):
+                return int(timestamps[known[-1]])
+        previous = self.previous.get(field)
+        return None if previous is None else previous[0]
+
+    def _emit(self, until: int) -> Iterator[Dict[str, np.ndarray]]:
+        """
+        Produce the grid points up to `until`, at most `chunk_size` at a time.
+        """
+        if self.end is not None:
+            until = min(until, self.end)
+        if self.limit is not None:
+            until = min(until, self.limit)
+        if until < self.next:
+            return
+
+        # The chunks fed since the last grid points are joined once, and each field is reduced to its known values
+        if len(self.chunks) == 1:
+            timestamps, values = self.chunks[0]
+        else:
+            timestamps = np.concatenate([chunk[0] for chunk in self.chunks])
+            values = {field: np.concatenate([chunk[1][field] for chunk in self.chunks]) for field in self.fills}
+        series = {field: self._known_series(field, timestamps, values[field]) for field in self.fills}
+
+        while until >= self.next:
+            count = min((until - self.next) // self.step + 1, self.chunk_size)
+            grid = self.next + self.step * np.arange(count, dtype=np.int64)
+            yield self._sample(grid, series)
+            self.next = int(grid[-1]) + self.step
+
+        self._trim(self.next - self.step, timestamps, values)
+
+    def _known_series(self, field: str, timestamps: np.ndarray, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get the timestamps and values of the known values of a field: the last one before the buffered
+        readings, the buffered ones, and the upcoming one of a linear field.
+        """
+        known = _known(values)
+        known_timestamps, known_values = timestamps[known], values[known]
+        dtype = self.dtypes[field]
+
+        previous = self.previous.get(field)
+        if previous is not None:
+            known_timestamps = np.concatenate([np.array([previous[0]], dtype=np.int64), known_timestamps])
+            known_values = np.concatenate([np.array([previous[1]], dtype=dtype), known_values])
+
+        upcoming = self.upcoming.get(field)
+        if self.fills[field] == FillStrategy.LINEAR and upcoming is not None:
+            if len(known_timestamps) == 0 or upcoming[0] > known_timestamps[-1]:
+                known_timestamps = np.concatenate([known_timestamps, np.array([upcoming[0]], dtype=np.int64)])
+                known_values = np.concatenate([known_values, np.array([upcoming[1]], dtype=dtype)])
+
+        return known_timestamps, known_values
+
+    def _sample(self, grid: np.ndarray, series: Dict[str, Tuple[np.ndarray, np.ndarray]]) -> Dict[str, np.ndarray]:
+        columns = {"timestamp": grid.astype("datetime64[us]")}
+        for field, fill in self.fills.items():
+            known_timestamps, known_values = series[field]
+            dtype = self.dtypes[field]
+
+            result = np.full(len(grid), None if dtype is object else np.nan, dtype=dtype)
+            if len(known_timestamps) == 0:
+                columns[field] = result
+                continue
+
+            if fill == FillStrategy.LINEAR:
+                # Relative to the first known timestamp, as epoch microseconds lose precision in float64
+                origin = known_timestamps[0]
+                columns[field] = np.interp(
+                    grid - origin, known_timestamps - origin, known_values, left=np.nan, right=np.nan
+                )
+                continue
+
+            # Last known value at or before every grid point
+            index = np.searchsorted(known_timestamps, grid, side="right") - 1
+            found = index >= 0
+            if fill == FillStrategy.NONE:
+                found &= known_timestamps[np.maximum(index, 0)] > grid - self.step
+            result[found] = known_values[index[found]]
+            columns[field] = result
+        return columns
+
+    def _trim(self, last: int, timestamps: np.ndarray, values: Dict[str, np.ndarray]) -> None:
+        """
+        Drop the readings up to the grid point `last`, keeping the last known value of every field among them.
+        """
+        keep = int(np.searchsorted(timestamps, last, side="right"))
+        for field in self.fills:
+            known = np.flatnonzero(_known(values[field][:keep]))
+            if len(known):
+                self.previous[field] = (int(timestamps[known[-1]]), values[field][known[-1]])
+
+        if keep < len(timestamps):
+            self.chunks = [(timestamps[keep:].copy(), {field: array[keep:].copy() for field, array in values.items()})]
+        else:
+            self.chunks = []
+
+
+def columns_to_points(vehicle_id: str, columns: Dict[str, np.ndarray]) -> List[ResampledPoint]:
+    """
+    Turn the columns of resampled grid points into ResampledPoint rows, with None for NULL.
+    """
+    values = {"vehicle_id": [vehicle_id] * len(columns["timestamp"]), "timestamp": columns["timestamp"].tolist()}
+    for field in RESAMPLED_FIELDS:
+        # NaN is the only value not equal to itself
+        values[field] = [None if value != value else value for value in columns[field].tolist()]
+    return [ResampledPoint(*point) for point in zip(*[values[field] for field in EXPORT_FIELDS])]
+
+
+class ResampleService:
+    """
+    Resample the vehicle data of a vehicle on a regular grid, e.g. for the feature pipelines of ML models.
+
+    The readings of the range are read from a server-side cursor and resampled chunk by chunk, so large
+    ranges are streamed. The last known value of every field before the range, and the first one after
+    it, are read too, so the grid points at the edges of the range are filled like the others. The next
+    known value of a linearly filled field is looked up whenever a chunk of readings ends without it.
+    """
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def _edge_values(
+        self, vehicle_id: str, fields: List[str], timestamp: datetime, before: bool, inclusive: bool = False
+    ) -> List[tuple]:
+        """
+        Get the last known value of every field before `timestamp`, or the first one after it (or at it, if inclusive).
+        """
+        # Only the partitions on the side of the edge are read
+        initial_timestamp, final_timestamp = (None, timestamp) if before else (timestamp, None)
+        source = await self.db.run_sync(
+            lambda session: PartitionService(session).source(initial_timestamp, final_timestamp)
+        )
+        edges = []
+        for field in fields:
+            column = getattr(source, field)
+            order = [source.timestamp, source.id]
+            statement = (
+                select(source.timestamp, column)
+                .where(
+                    source.vehicle_id == vehicle_id,
+                    column.isnot(None),
+                    source.timestamp < timestamp if before else (
+                        source.timestamp >= timestamp if inclusive else source.timestamp > timestamp
+                    ),
+                )
+                .order_by(*[key.desc() for key in order] if before else order)
+                .limit(1)
+            )
+            row = (await self.db.execute(statement)).first()
+            if row is not None:
+                edges.append((row[0], field, row[1]))
+        return sorted(edges, key=lambda edge: edge[0])
+
+    async def grid_size(
+        self,
+        vehicle_id: str,
+        interval: timedelta,
+        initial_timestamp: Optional[datetime] = None,
+        final_timestamp: Optional[datetime] = None,
+    ) -> int:
+        """
+        Get the number of grid points of a resampling, the missing bounds being those of the readings.
+        """
+        initial_timestamp = initial_timestamp and to_utc_naive(initial_timestamp)
+        final_timestamp = final_timestamp and to_utc_naive(final_timestamp)
+        step = interval // timedelta(microseconds=1)
+
+        first, last = initial_timestamp, final_timestamp
+        if first is None or last is None:
+            source = await self.db.run_sync(
+                lambda session: PartitionService(session).source(initial_timestamp, final_timestamp)
+            )
+            statement = select(func.min(source.timestamp), func.max(source.timestamp)).where(
+                source.vehicle_id == vehicle_id
+            )
+            if initial_timestamp is not None:
+                statement = statement.where(source.timestamp >= initial_timestamp)
+            if final_timestamp is not None:
+                statement = statement.where(source.timestamp <= final_timestamp)
+            oldest, newest = (await self.db.execute(statement)).one()
+            if oldest is None:
+                return 0
+            first = first or oldest
+            last = last or newest
+
+        start = _to_microseconds(first)
+        if initial_timestamp is None:
+            start = -(-start // step) * step
+        end = _to_microseconds(last)
+        return max((end - start) // step + 1, 0)
+
+    def _feed_edges(self, resampler: Resampler, edges: List[tuple]) -> Iterator[Dict[str, np.ndarray]]:
+        """
+        Feed the edge values as readings where only their field is known.
+        """
+        for timestamp, field, value in edges:
+            values = {name: np.array([None], dtype=resampler.dtypes[name]) for name in resampler.fills}
+            values[field][0] = value
+            yield from resampler.feed(np.array([timestamp], dtype="datetime64[us]"), values)
+
+    async def resample(
+        self,
+        vehicle_id: str,
+        interval: timedelta,
+        fills: Dict[str, FillStrategy],
+        initial_timestamp: Optional[datetime] = None,
+        final_timestamp: Optional[datetime] = None,
+        chunk_size: int = 10000,
+        max_points: Optional[int] = None,
+    ) -> AsyncIterator[ResampledPoint]:
+        """
+        Stream the vehicle data of a vehicle resampled on a regular grid.
+
+        Args:
+            vehicle_id: The ID of the vehicle.
+            interval: The interval between two grid points.
+            fills: The fill strategy of every field of RESAMPLED_FIELDS.
+            initial_timestamp: The first grid point, by default the first reading rounded up to a multiple of the interval.
+            final_timestamp: The last grid point at most, by default the last reading.
+            chunk_size: The number of readings read, and of grid points produced, at a time.
+            max_points: The largest number of grid points produced, unlimited by default.
+
+        Returns:
+            An async iterator over the grid points, in chronological order.
+        """
+        initial_timestamp = initial_timestamp and to_utc_naive(initial_timestamp)
+        final_timestamp = final_timestamp and to_utc_naive(final_timestamp)
+        resampler = Resampler(interval, fills, initial_timestamp, final_timestamp, chunk_size, max_points)
+        linear = [field for field, fill in fills.items() if fill == FillStrategy.LINEAR]
+
+        if initial_timestamp is not None:
+            edges = await self._edge_values(vehicle_id, list(fills), initial_timestamp, before=True)
+            for columns in self._feed_edges(resampler, edges):
+                for point in columns_to_points(vehicle_id, columns):
+                    yield point
+
+        source = await self.db.run_sync(
+            lambda session: PartitionService(session).source(initial_timestamp, final_timestamp)
+        )
+        statement = (
+            select(source.timestamp, *[getattr(source, field) for field in fills])
+            .where(source.vehicle_id == vehicle_id, source.timestamp.isnot(None))
+            .order_by(source.timestamp, source.id)
+            .execution_options(yield_per=chunk_size)
+        )
+        if initial_timestamp is not None:
+            statement = statement.where(source.timestamp >= initial_timestamp)
+        if final_timestamp is not None:
+            statement = statement.where(source.timestamp <= final_timestamp)
+
+        result = await self.db.stream(statement)
+        async for rows in result.partitions():
+            columns = list(zip(*rows))
+            values = {
+                field: np.array(column, dtype=object if field in OBJECT_FIELDS else np.float64)
+                for field, column in zip(fills, columns[1:])
+            }
+
+            # A run of NULLs at the end of the chunk would hold back the interpolated grid points until the
+            # next known value is read: it is looked up ahead
+            last = columns[0][-1]
+            for field in linear:
+                if not _known(values[field][-1:])[0] and resampler.awaiting(field, last):
+                    edges = await self._edge_values(vehicle_id, [field], last, before=False, inclusive=True)
+                    if edges:
+                        timestamp, _, value = edges[0]
+                        resampler.set_upcoming(field, timestamp, value)
+                    else:
+                        resampler.set_upcoming(field, None)
+
+            for grid_columns in resampler.feed(np.array(columns[0], dtype="datetime64[us]"), values):
+                for point in columns_to_points(vehicle_id, grid_columns):
+                    yield point
+
+        # Interpolating up to the end of the range needs the next known values
+        if final_timestamp is not None:
+            edges = await self._edge_values(vehicle_id, linear, final_timestamp, before=False)
+            for columns in self._feed_edges(resampler, edges):
+                for point in columns_to_points(vehicle_id, columns):
+                    yield point
+
+        for columns in resampler.finish():
+            for point in columns_to_points(vehicle_id, columns):
+                yield point
@@ -0,0 +1,312 @@
+"""
+This module defines the service maintaining the vehicle data rollups.
+"""
+
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import Select, and_, case, delete, func, select
+from sqlalchemy.orm import Session
+
+from app.api.models.vehicle_data import VehicleDataAggregate
+from app.core.database.functions import dialect_insert, greatest, least, to_utc_naive
+from app.core.database.models import (
+    BucketWidth,
+    VehicleDatabase,
+    VehicleDataRollupDatabase,
+    VehicleDataRollupShiftStateDatabase,
+)
+from app.core.database.partitions import partition_tables, vehicle_data_source
+
+
+# Resolutions at which rollups are maintained
+ROLLUP_RESOLUTIONS = (BucketWidth.ONE_MINUTE, BucketWidth.ONE_HOUR, BucketWidth.ONE_DAY)
+
+# Fields aggregated as count, sum, min and max
+ROLLUP_FIELDS = ("speed", "soc", "elevation")
+
+EPOCH = datetime(1970, 1, 1)
+
+VEHICLE_COLUMNS = [column.name for column in VehicleDatabase.__table__.columns]
+
+
+def vehicle_to_row(vehicle: VehicleDatabase) -> dict:
+    """
+    Get the column values of a VehicleDatabase object.
+    """
+    return {column: getattr(vehicle, column) for column in VEHICLE_COLUMNS}
+
+
+def compute_rollups(rows: Iterable[dict]) -> Tuple[List[dict], List[dict]]:
+    """
+    Aggregate rows of vehicle data into partial rollups at every resolution.
+
+    Args:
+        rows: Dictionaries of VehicleDatabase column values. Rows without a timestamp are ignored.
+
+    Returns:
+        The VehicleDataRollupDatabase rows and the VehicleDataRollupShiftStateDatabase rows.
+    """
+    buckets: Dict[Tuple[str, int, int], dict] = {}
+    shift_states: Dict[Tuple[str, int, int, str], int] = defaultdict(int)
+
+    for row in rows:
+        if row.get("timestamp") is None:
+            continue
+        timestamp = to_utc_naive(row["timestamp"])
+        epoch = int((timestamp - EPOCH).total_seconds())
+
+        for resolution in ROLLUP_RESOLUTIONS:
+            key = (row["vehicle_id"], resolution.seconds, epoch - epoch % resolution.seconds)
+            bucket = buckets.get(key)
+            if bucket is None:
+                bucket = buckets[key] = {
+                    "count": 0,
+                    "odometer_first_timestamp": None,
+                    "odometer_first": None,
+                    "odometer_last_timestamp": None,
+                    "odometer_last": None,
+                }
+                for field in ROLLUP_FIELDS:
+                    bucket.update({f"{field}_count": 0, f"{field}_sum": 0.0, f"{field}_min": None, f"{field}_max": None})
+
+            bucket["count"] += 1
+            for field in ROLLUP_FIELDS:
+                value = row.get(field)
+                if value is None:
+                    continue
+                bucket[f"{field}_count"] += 1
+                bucket[f"{field}_sum"] += value
+                if bucket[f"{field}_min"] is None or value < bucket[f"{field}_min"]:
+                    bucket[f"{field}_min"] = value
+                if bucket[f"{field}_max"] is None or value > bucket[f"{field}_max"]:
+                    bucket[f"{field}_max"] = value
+
+            odometer = row.get("odometer")
+            if odometer is not None:
+                if bucket["odometer_first_timestamp"] is None or timestamp < bucket["odometer_first_timestamp"]:
+                    bucket["odometer_first_timestamp"] = timestamp
+                    bucket["odometer_first"] = odometer
+                if bucket["odometer_last_timestamp"] is None or timestamp >= bucket["odometer_last_timestamp"]:
+                    bucket["odometer_last_timestamp"] = timestamp
+                    bucket["odometer_last"] = odometer
+
+            if row.get("shift_state") is not None:
+                shift_states[key + (row["shift_state"],)] += 1
+
+    rollups = [
+        dict(bucket, vehicle_id=vehicle_id, resolution=resolution, bucket_start=EPOCH + timedelta(seconds=start))
+        for (vehicle_id, resolution, start), bucket in buckets.items()
+    ]
+    rollup_shift_states = [
+        {
+            "vehicle_id": vehicle_id,
+            "resolution": resolution,
+            "bucket_start": EPOCH + timedelta(seconds=start),
+            "shift_state": shift_state,
+            "count": count,
+        }
+        for (vehicle_id, resolution, start, shift_state), count in shift_states.items()
+    ]
+    return rollups, rollup_shift_states
+
+
+def is_aligned(timestamp: Optional[datetime], bucket_width: BucketWidth) -> bool:
+    """
+    Whether a range bound falls on a bucket boundary (or is open), so rollups answer the range exactly.
+    """
+    if timestamp is None:
+        return True
+    return (to_utc_naive(timestamp) - EPOCH) % timedelta(seconds=bucket_width.seconds) == timedelta(0)
+
+
+def build_rollup_statement(
+    vehicle_id: str,
+    bucket_width: BucketWidth,
+    initial_timestamp: Optional[datetime] = None,
+    final_timestamp: Optional[datetime] = None,
+) -> Select:
+    """
+    Build the statement reading the rollups of a vehicle, with the dominant shift state of each bucket.
+
+    The range bounds are expected to be aligned on the bucket width. The bucket starting at the final
+    timestamp is left out.
+    """
+    def filters(table) -> list:
+        clauses = [table.vehicle_id == vehicle_id, table.resolution == bucket_width.seconds]
+        if initial_timestamp:
+            clauses.append(table.bucket_start >= to_utc_naive(initial_timestamp))
+        if final_timestamp:
+            clauses.append(table.bucket_start < to_utc_naive(final_timestamp))
+        return clauses
+
+    rollup = VehicleDataRollupDatabase
+    shift_state = VehicleDataRollupShiftStateDatabase
+    shift_states = (
+        select(
+            shift_state.bucket_start,
+            shift_state.shift_state,
+            func.row_number().over(
+                partition_by=shift_state.bucket_start,
+                order_by=[shift_state.count.desc(), shift_state.shift_state],
+            ).label("rank"),
+        )
+        .where(*filters(shift_state))
+        .subquery()
+    )
+
+    return (
+        select(rollup, shift_states.c.shift_state)
+        .outerjoin(
+            shift_states,
+            and_(shift_states.c.bucket_start == rollup.bucket_start, shift_states.c.rank == 1),
+        )
+        .where(*filters(rollup))
+        .order_by(rollup.bucket_start)
+    )
+
+
+def rollup_to_aggregate(rollup: VehicleDataRollupDatabase, shift_state: Optional[str]) -> VehicleDataAggregate:
+    """
+    Turn a rollup into the VehicleDataAggregate of its bucket.
+    """
+    values = {}
+    for field in ROLLUP_FIELDS:
+        count = getattr(rollup, f"{field}_count")
+        values[f"{field}_min"] = getattr(rollup, f"{field}_min")
+        values[f"{field}_avg"] = getattr(rollup, f"{field}_sum") / count if count else None
+        values[f"{field}_max"] = getattr(rollup, f"{field}_max")
+
+    return VehicleDataAggregate(
+        bucket_start=rollup.bucket_start,
+        count=rollup.count,
+        odometer_first=rollup.odometer_first,
+        odometer_last=rollup.odometer_last,
+        shift_state=shift_state,
+        **values,
+    )
+
+
+class RollupService:
+    """
+    Maintain the rollups of vehicle data at 1 minute, 1 hour and 1 day resolutions.
+
+    The rollups are updated in the transaction writing the raw rows, with upserts merging the partial
+    aggregates of the new rows into the existing buckets. It works on a synchronous Session; the async
+    services call it through `AsyncSession.run_sync`.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def add(self, rows: Iterable[dict]) -> None:
+        """
+        Merge new rows of vehicle data into the rollups, without committing.
+
+        Args:
+            rows: Dictionaries of VehicleDatabase column values.
+        """
+        rollups, rollup_shift_states = compute_rollups(rows)
+        if not rollups:
+            return
+
+        insert = dialect_insert(self.db.get_bind().dialect.name)
+
+        statement = insert(VehicleDataRollupDatabase)
+        existing = VehicleDataRollupDatabase.__table__.c
+        new = statement.excluded
+        updates = {"count": existing.count + new.count}
+        for field in ROLLUP_FIELDS:
+            updates[f"{field}_count"] = existing[f"{field}_count"] + new[f"{field}_count"]
+            updates[f"{field}_sum"] = existing[f"{field}_sum"] + new[f"{field}_sum"]
+            updates[f"{field}_min"] = least(existing[f"{field}_min"], new[f"{field}_min"])
+            updates[f"{field}_max"] = greatest(existing[f"{field}_max"], new[f"{field}_max"])
+
+        # Every SET expression reads the values of the row before the update
+        first_is_new = and_(
+            new.odometer_first_timestamp.isnot(None),
+            (existing.odometer_first_timestamp.is_(None))
+            | (new.odometer_first_timestamp < existing.odometer_first_timestamp),
+        )
+        last_is_new = and_(
+            new.odometer_last_timestamp.isnot(None),
+            (existing.odometer_last_timestamp.is_(None))
+            | (new.odometer_last_timestamp >= existing.odometer_last_timestamp),
+        )
+        updates["odometer_first_timestamp"] = case(
+            (first_is_new, new.odometer_first_timestamp), else_=existing.odometer_first_timestamp
+        )
+        updates["odometer_first"] = case((first_is_new, new.odometer_first), else_=existing.odometer_first)
+        updates["odometer_last_timestamp"] = case(
+            (last_is_new, new.odometer_last_timestamp), else_=existing.odometer_last_timestamp
+        )
+        updates["odometer_last"] = case((last_is_new, new.odometer_last), else_=existing.odometer_last)
+
+        statement = statement.on_conflict_do_update(
+            index_elements=[existing.vehicle_id, existing.resolution, existing.bucket_start],
+            set_=updates,
+        )
+        self.db.execute(statement, rollups)
+
+        if rollup_shift_states:
+            statement = insert(VehicleDataRollupShiftStateDatabase)
+            existing = VehicleDataRollupShiftStateDatabase.__table__.c
+            statement = statement.on_conflict_do_update(
+                index_elements=[existing.vehicle_id, existing.resolution, existing.bucket_start, existing.shift_state],
+                set_={"count": existing.count + statement.excluded.count},
+            )
+            self.db.execute(statement, rollup_shift_states)
+
+    def delete_before(self, cutoff: datetime) -> None:
+        """
+        Delete the buckets starting before `cutoff`, with the readings expired by retention, without committing.
+
+        `cutoff` is a month boundary, so no bucket of any resolution spans it.
+        """
+        for rollup in (VehicleDataRollupDatabase, VehicleDataRollupShiftStateDatabase):
+            self.db.execute(delete(rollup).where(rollup.bucket_start < cutoff))
+
+    def rebuild(self, vehicle_id: Optional[str] = None, chunk_size: int = 10000) -> int:
+        """
+        Rebuild the rollups from the raw vehicle data, e.g. after a backfill or a deletion.
+
+        Each vehicle is rebuilt in its own transaction, streaming its rows `chunk_size` at a time.
+
+        Args:
+            vehicle_id: The vehicle to rebuild, or None to rebuild every vehicle.
+            chunk_size: The number of raw rows aggregated at a time.
+
+        Returns:
+            The number of raw rows aggregated.
+        """
+        vehicle = vehicle_data_source(partition_tables(self.db))
+        if vehicle_id is None:
+            vehicle_ids = self.db.execute(select(vehicle.vehicle_id).distinct()).scalars().all()
+            self.db.execute(delete(VehicleDataRollupDatabase))
+            self.db.execute(delete(VehicleDataRollupShiftStateDatabase))
+        else:
+            vehicle_ids = [vehicle_id]
+
+        total = 0
+        for vehicle_id in vehicle_ids:
+            self.db.execute(delete(VehicleDataRollupDatabase).where(VehicleDataRollupDatabase.vehicle_id == vehicle_id))
+            self.db.execute(
+                delete(VehicleDataRollupShiftStateDatabase).where(
+                    VehicleDataRollupShiftStateDatabase.vehicle_id == vehicle_id
+                )
+            )
+
+            statement = (
+                select(*[getattr(vehicle, column) for column in VEHICLE_COLUMNS])
+                .where(vehicle.vehicle_id == vehicle_id)
+                .execution_options(yield_per=chunk_size)
+            )
+            for partition in self.db.execute(statement).mappings().partitions(chunk_size):
+                self.add(partition)
+                total += len(partition)
+
+            self.db.commit()
+
+        self.db.commit()
+        return total
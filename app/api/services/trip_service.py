@@ -0,0 +1,320 @@
+"""
+This module defines the service segmenting the vehicle data of a vehicle into trips.
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from sqlalchemy import case, delete, func, insert, or_, select, update
+from sqlalchemy.orm import Session
+
+from app.api.services.rollup_service import EPOCH
+from app.core.config import settings
+from app.core.database.functions import dialect_insert, to_utc_naive
+from app.core.database.models import TripDatabase, TripSegmentationDatabase
+from app.core.database.partitions import partition_tables, vehicle_data_source
+
+
+# Shift states of a moving vehicle. A reading without shift state counts as driving when its speed is positive.
+DRIVING_SHIFT_STATES = ("D", "R")
+
+# Measures of which a trip keeps the first and last known values
+ENDPOINT_FIELDS = {"odometer": "distance", "soc": "soc_used", "elevation": "elevation_change"}
+
+
+def _first_and_last_known(values: np.ndarray, starts: np.ndarray, ends: np.ndarray):
+    """
+    Get the first and last non-NaN value of every [start, end) segment of an array, NaN for none.
+    """
+    indices = np.arange(len(values))
+    known = ~np.isnan(values)
+    # Index of the next known value at or after each position, and of the last known value at or before it
+    next_known = np.minimum.accumulate(np.where(known, indices, len(values))[::-1])[::-1]
+    last_known = np.maximum.accumulate(np.where(known, indices, -1))
+
+    padded = np.append(values, np.nan)
+    first = next_known[starts]
+    last = last_known[ends - 1]
+    first = np.where(first < ends, padded[first], np.nan)
+    last = np.where(last >= starts, padded[last], np.nan)
+    return first, last
+
+
+def segment_trips(
+    vehicle_id: str,
+    timestamps: np.ndarray,
+    speed: np.ndarray,
+    odometer: np.ndarray,
+    soc: np.ndarray,
+    elevation: np.ndarray,
+    shift_states: np.ndarray,
+    max_gap: timedelta,
+    min_count: int = 2,
+) -> List[dict]:
+    """
+    Split the readings of a vehicle into trips, in a single vectorised pass.
+
+    A trip is a run of driving readings; it ends at a reading in another shift state (e.g. P) or at a
+    gap between readings longer than `max_gap`.
+
+    Args:
+        vehicle_id: The vehicle of the readings.
+        timestamps: The timestamps of the readings as datetime64, in ascending order.
+        speed, odometer, soc, elevation: The measures of the readings as float arrays, NaN for NULL.
+        shift_states: The shift states of the readings as an object array, None for NULL.
+        max_gap: The longest gap between two readings of a trip.
+        min_count: The least number of readings of a trip.
+
+    Returns:
+        The TripDatabase column values of the trips, in chronological order.
+    """
+    if len(timestamps) == 0:
+        return []
+
+    # Elementwise comparisons, as the shift states mix strings and None
+    driving = np.logical_or.reduce([shift_states == state for state in DRIVING_SHIFT_STATES])
+    driving |= np.equal(shift_states, None) & (np.nan_to_num(speed) > 0)
+
+    # A trip starts at a driving reading following a non-driving reading or a gap
+    gap = np.concatenate([[True], np.diff(timestamps) > np.timedelta64(max_gap)])
+    previous_driving = np.concatenate([[False], driving[:-1]])
+    starts = np.flatnonzero(driving & (~previous_driving | gap))
+
+    # And lasts until the next non-driving reading or the next trip
+    stops = np.flatnonzero(~driving)
+    next_stop = np.append(stops, len(timestamps))[np.searchsorted(stops, starts)]
+    next_start = np.append(starts[1:], len(timestamps))
+    ends = np.minimum(next_stop, next_start)
+
+    keep = ends - starts >= min_count
+    starts, ends = starts[keep], ends[keep]
+    if len(starts) == 0:
+        return []
+
+    # reduceat over the [start, end) pairs: the even results are the trips, the odd ones the readings between them
+    bounds = np.empty(2 * len(starts), dtype=np.intp)
+    bounds[0::2], bounds[1::2] = starts, ends
+    known_speed = ~np.isnan(speed)
+    speed_sum = np.add.reduceat(np.append(np.where(known_speed, speed, 0.0), 0.0), bounds)[0::2]
+    speed_count = np.add.reduceat(np.append(known_speed, False).astype(np.int64), bounds)[0::2]
+    max_speed = np.fmax.reduceat(np.append(speed, np.nan), bounds)[0::2]
+
+    columns = {
+        "start_timestamp": timestamps[starts].astype("datetime64[us]").tolist(),
+        "end_timestamp": timestamps[ends - 1].astype("datetime64[us]").tolist(),
+        "count": (ends - starts).tolist(),
+        "max_speed": max_speed.tolist(),
+        "avg_speed": np.divide(
+            speed_sum, speed_count, out=np.full(len(starts), np.nan), where=speed_count > 0
+        ).tolist(),
+    }
+    measures = {"odometer": odometer, "soc": soc, "elevation": elevation}
+    for field, change in ENDPOINT_FIELDS.items():
+        first, last = _first_and_last_known(measures[field], starts, ends)
+        columns[f"start_{field}"] = first.tolist()
+        columns[f"end_{field}"] = last.tolist()
+        # The state of charge is used, not gained
+        columns[change] = (first - last if field == "soc" else last - first).tolist()
+
+    trips = []
+    for values in zip(*columns.values()):
+        trip = {"vehicle_id": vehicle_id}
+        # NaN is the only value not equal to itself
+        trip.update((name, None if value != value else value) for name, value in zip(columns, values))
+        trips.append(trip)
+    return trips
+
+
+class TripService:
+    """
+    Maintain and serve the trips of the vehicles.
+
+    Segmentation is lazy: writes only mark the segmentation of their vehicles as dirty from their
+    earliest timestamp, in the transaction writing the raw rows, and the next read of the trips of a
+    vehicle segments its readings again from the last trip ending before the dirty timestamp, and
+    persists the result. It works on a synchronous Session; the async services call it through
+    `AsyncSession.run_sync`.
+
+    The segmentation state row of a vehicle is locked while it is segmented (FOR UPDATE on Postgres;
+    SQLite has no row locks, so there the segmentation holds the database write lock with BEGIN
+    IMMEDIATE), so a write committed meanwhile waits to mark the vehicle dirty again. The dirty mark
+    is then cleared only if it is still the one segmented from, otherwise the vehicle is segmented again.
+    """
+
+    def __init__(self, db: Session, max_gap: Optional[timedelta] = None, min_count: Optional[int] = None):
+        self.db = db
+        self.max_gap = max_gap if max_gap is not None else timedelta(seconds=settings.trip_max_gap_seconds)
+        self.min_count = min_count if min_count is not None else settings.trip_min_readings
+
+    def mark_dirty(self, rows: Iterable[dict]) -> None:
+        """
+        Mark the trips of the vehicles of new rows as dirty from their earliest timestamp, without committing.
+
+        Args:
+            rows: Dictionaries of VehicleDatabase column values.
+        """
+        earliest: Dict[str, datetime] = {}
+        for row in rows:
+            if row.get("timestamp") is None:
+                continue
+            timestamp = to_utc_naive(row["timestamp"])
+            if row["vehicle_id"] not in earliest or timestamp < earliest[row["vehicle_id"]]:
+                earliest[row["vehicle_id"]] = timestamp
+
+        # Vehicles never segmented have no row, and are segmented in full on their next read
+        state = TripSegmentationDatabase
+        for vehicle_id, timestamp in earliest.items():
+            self.db.execute(
+                update(state)
+                .where(state.vehicle_id == vehicle_id)
+                .values(dirty_from=case(
+                    (or_(state.dirty_from.is_(None), state.dirty_from > timestamp), timestamp),
+                    else_=state.dirty_from,
+                ))
+                .execution_options(synchronize_session=False)
+            )
+
+    def delete_before(self, cutoff: datetime) -> None:
+        """
+        Delete the trips starting before `cutoff`, with the readings expired by retention, without committing.
+
+        The vehicles with a trip across `cutoff` lose their segmentation state, so their remaining
+        readings are segmented again in full on their next read.
+        """
+        trips = TripDatabase
+        across = select(trips.vehicle_id).where(trips.start_timestamp < cutoff, trips.end_timestamp >= cutoff)
+        self.db.execute(delete(TripSegmentationDatabase).where(TripSegmentationDatabase.vehicle_id.in_(across)))
+        self.db.execute(delete(trips).where(trips.start_timestamp < cutoff))
+
+    def update(self, vehicle_id: str) -> int:
+        """
+        Segment the readings of a vehicle written since its last segmentation, and commit the trips.
+
+        Returns:
+            The number of trips written.
+        """
+        state = TripSegmentationDatabase
+        current = self.db.get(state, vehicle_id)
+        if current is not None and current.dirty_from is None:
+            return 0
+
+        if current is None:
+            # Registered first, so that the writes committed while segmenting mark it dirty
+            self.db.execute(
+                dialect_insert(self.db.get_bind().dialect.name)(state)
+                .values(vehicle_id=vehicle_id, dirty_from=EPOCH)
+                .on_conflict_do_nothing(index_elements=[state.vehicle_id])
+            )
+            self.db.commit()
+
+        written = 0
+        while True:
+            # Locked until the commit: a write committed meanwhile waits to mark the vehicle dirty again,
+            # instead of having its mark cleared along with the readings it did not see
+            self._begin_write()
+            current = self.db.execute(
+                select(state)
+                .where(state.vehicle_id == vehicle_id)
+                .with_for_update()
+                .execution_options(populate_existing=True)
+            ).scalar_one()
+            dirty_from = current.dirty_from
+            if dirty_from is None:
+                self.db.commit()
+                return written
+
+            written += self._segment(vehicle_id, dirty_from)
+
+            # Cleared only if no write marked the vehicle dirty since it was read, else segmented again
+            cleared = self.db.execute(
+                update(state)
+                .where(state.vehicle_id == vehicle_id, state.dirty_from == dirty_from)
+                .values(dirty_from=None)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            self.db.commit()
+            if cleared:
+                return written
+
+    def _begin_write(self) -> None:
+        """
+        Start a new transaction that holds the database write lock on SQLite, where FOR UPDATE does nothing.
+
+        The driver only starts a transaction before a write, so the readings read before it would not
+        be isolated from the writes committed meanwhile.
+        """
+        self.db.commit()
+        connection = self.db.connection()
+        if connection.dialect.name == "sqlite":
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+    def _segment(self, vehicle_id: str, dirty_from: datetime) -> int:
+        """
+        Segment the readings of a vehicle again from the last trip ending a gap before `dirty_from`, without committing.
+
+        Returns:
+            The number of trips written.
+        """
+        # The new readings can only extend, merge or split the trips ending less than a gap before them
+        trips = TripDatabase
+        self.db.execute(
+            delete(trips).where(trips.vehicle_id == vehicle_id, trips.end_timestamp >= dirty_from - self.max_gap)
+        )
+        since = self.db.execute(select(func.max(trips.end_timestamp)).where(trips.vehicle_id == vehicle_id)).scalar()
+
+        vehicle = vehicle_data_source(partition_tables(self.db, since))
+        statement = (
+            select(
+                vehicle.timestamp,
+                vehicle.speed,
+                vehicle.odometer,
+                vehicle.soc,
+                vehicle.elevation,
+                vehicle.shift_state,
+            )
+            .where(vehicle.vehicle_id == vehicle_id, vehicle.timestamp.isnot(None))
+            .order_by(vehicle.timestamp, vehicle.id)
+        )
+        # The reading following a trip is not driving or comes after a gap, so a trip never spans past it
+        if since is not None:
+            statement = statement.where(vehicle.timestamp > since)
+
+        rows = self.db.execute(statement).all()
+        columns = list(zip(*rows)) or [()] * 6
+        new_trips = segment_trips(
+            vehicle_id,
+            np.array(columns[0], dtype="datetime64[us]"),
+            *[np.array(column, dtype=np.float64) for column in columns[1:5]],
+            np.array(columns[5], dtype=object),
+            max_gap=self.max_gap,
+            min_count=self.min_count,
+        )
+        if new_trips:
+            self.db.execute(insert(trips), new_trips)
+
+        return len(new_trips)
+
+    def get_trips(
+        self,
+        vehicle_id: str,
+        initial_timestamp: Optional[datetime] = None,
+        final_timestamp: Optional[datetime] = None,
+        limit: Optional[int] = 100,
+        skip: Optional[int] = 0,
+    ) -> List[TripDatabase]:
+        """
+        Get the trips of a vehicle overlapping a time range, in chronological order.
+
+        The trips are brought up to date with the readings written since the last read first.
+        """
+        self.update(vehicle_id)
+
+        statement = select(TripDatabase).where(TripDatabase.vehicle_id == vehicle_id)
+        if initial_timestamp:
+            statement = statement.where(TripDatabase.end_timestamp >= to_utc_naive(initial_timestamp))
+        if final_timestamp:
+            statement = statement.where(TripDatabase.start_timestamp <= to_utc_naive(final_timestamp))
+        statement = statement.order_by(TripDatabase.start_timestamp).offset(skip).limit(limit)
+
+        return self.db.execute(statement).scalars().all()
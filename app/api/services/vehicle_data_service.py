@@ -2,16 +2,30 @@
 This module defines the service for vehicle data.
 """
 
-from typing import List, Optional
+import base64
+import binascii
+from typing import Any, Iterator, List, Optional, Sequence, Tuple, Union
 from pydantic import ValidationError
 
 from typing import List
 from sqlalchemy.orm import Session
 from fastapi import Depends, HTTPException
 
-# from app.api.models.vehicle_data import VehicleData
+from app.api.models.vehicle_data import VehicleModel
+from app.api.services.latest_state_service import LatestStateService
+from app.api.services.partition_service import PartitionService
+from app.api.services.rollup_service import VEHICLE_COLUMNS, RollupService, vehicle_to_row
+from app.api.services.trip_service import TripService
+from app.core.cache import make_key, query_cache
+from app.core.config import settings
+from app.core.hot_tier import NULL_ID, hot_tier
+from app.core.pubsub import broker
+from app.core.metrics import ROWS_RETURNED
+from app.core.database.functions import dialect_insert, to_utc_naive
 from app.core.database.models import SortBy, VehicleDatabase
-from sqlalchemy import asc, desc
+from app.core.database.query_plan import explain
+from sqlalchemy import Select, Table, asc, case, desc, select, tuple_, union_all
+from sqlalchemy.sql import Executable
 from datetime import datetime
 
 
@@ -20,6 +34,414 @@ from datetime import datetime
 from sqlalchemy.orm import Session
 
 
+def encode_cursor(vehicle: VehicleDatabase) -> str:
+    """
+    Encode the (timestamp, id) position of a row as an opaque pagination cursor. A NULL timestamp is left empty.
+    """
+    return encode_position(vehicle.timestamp, vehicle.id)
+
+
+def encode_position(timestamp: Optional[datetime], id: int) -> str:
+    """
+    Encode a (timestamp, id) position as an opaque pagination cursor, see `encode_cursor`.
+    """
+    position = f"{'' if timestamp is None else timestamp.isoformat()}|{id}"
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[datetime], int]:
+    """
+    Decode a pagination cursor into its (timestamp, id) position, the timestamp being None for a row without one.
+    """
+    try:
+        timestamp, id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        if not timestamp:
+            return None, int(id)
+        return to_utc_naive(datetime.fromisoformat(timestamp)), int(id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {cursor}")
+
+
+# Vehicles of a query merged from one index range scan each. Larger sets are filtered with IN and sorted by the database.
+MAX_MERGED_VEHICLES = 100
+
+
+def vehicle_ids_of(vehicle_id: Union[str, Sequence[str], None]) -> Optional[List[str]]:
+    """
+    Normalise the vehicle filter of a query into a list of distinct vehicle IDs, or None for all vehicles.
+    """
+    if vehicle_id is None:
+        return None
+    if isinstance(vehicle_id, str):
+        return [vehicle_id]
+    return list(dict.fromkeys(vehicle_id))
+
+
+def single_vehicle_id(vehicle_id: Union[str, Sequence[str], None]) -> Optional[str]:
+    """
+    Get the vehicle of a query on exactly one vehicle, or None for a query on several or all vehicles.
+    """
+    vehicle_ids = vehicle_ids_of(vehicle_id)
+    return vehicle_ids[0] if vehicle_ids is not None and len(vehicle_ids) == 1 else None
+
+
+def build_vehicle_data_statement(
+    vehicle_id: Union[str, Sequence[str], None] = None,
+    initial_timestamp: Optional[datetime] = None,
+    final_timestamp: Optional[datetime] = None,
+    sort_by: Optional[SortBy] = None,
+    limit: Optional[int] = 100,
+    skip: Optional[int] = 0,
+    null_timestamp: Optional[bool] = None,
+    cursor: Optional[Tuple[Optional[datetime], int]] = None,
+    columns: Optional[list] = None,
+    source: Any = VehicleDatabase,
+) -> Executable:
+    """
+    Build the statement selecting vehicle data based on the specified filters.
+
+    The statement is shared by the synchronous and the asynchronous services. With `null_timestamp`,
+    only the rows without a timestamp (True) or with one (False) are selected. When a cursor is given,
+    only the rows after its (timestamp, id) position in the sort order are selected, which the index
+    serves without reading the previous pages; among the rows without a timestamp, only the id is compared.
+
+    `vehicle_id` is one vehicle, a list of vehicles, or None for all vehicles. The rows of several
+    vehicles are always ordered by (timestamp, id), ascending unless `sort_by` is DESC. Up to
+    MAX_MERGED_VEHICLES, every vehicle is read in order from the (vehicle_id, timestamp) index and
+    the sorted streams are merged by the database (MERGE UNION ALL on SQLite, Merge Append on
+    Postgres), so a page only reads its own rows. All vehicles are read from the timestamp index.
+
+    With `columns`, these columns are selected instead of VehicleDatabase objects. `source` is the
+    entity the rows are read from: VehicleDatabase, or the partitions of the range (see
+    `PartitionService.source`), in which case `columns` are the VehicleDatabase columns to read from them.
+
+    Timestamps are stored in naive UTC: timezone-aware bounds are converted to it.
+    """
+    initial_timestamp = initial_timestamp and to_utc_naive(initial_timestamp)
+    final_timestamp = final_timestamp and to_utc_naive(final_timestamp)
+    vehicle_ids = vehicle_ids_of(vehicle_id)
+    if vehicle_ids is None or len(vehicle_ids) != 1:
+        sort_by = sort_by or SortBy.ASC
+
+    if columns and source is not VehicleDatabase:
+        columns = [getattr(source, column.key) for column in columns]
+
+    def where(statement: Select) -> Select:
+        if initial_timestamp:
+            statement = statement.where(source.timestamp >= initial_timestamp)
+
+        if final_timestamp:
+            statement = statement.where(source.timestamp <= final_timestamp)
+
+        if null_timestamp is not None:
+            statement = statement.where(source.timestamp.is_(None) if null_timestamp else source.timestamp.isnot(None))
+
+        if cursor:
+            position, after = tuple_(source.timestamp, source.id), tuple_(*cursor)
+            if null_timestamp:
+                position, after = source.id, cursor[1]
+            statement = statement.where(position > after if sort_by == SortBy.ASC else position < after)
+
+        return statement
+
+    order = []
+    if sort_by == SortBy.ASC:
+        order = [source.timestamp.asc(), source.id.asc()]
+    elif sort_by == SortBy.DESC:
+        order = [source.timestamp.desc(), source.id.desc()]
+
+    if vehicle_ids is not None and 1 < len(vehicle_ids) <= MAX_MERGED_VEHICLES:
+        arm_columns = columns or [getattr(source, column.name) for column in VehicleDatabase.__table__.columns]
+        merged = union_all(
+            *[where(select(*arm_columns).where(source.vehicle_id == vehicle)) for vehicle in vehicle_ids]
+        ).order_by(*order).offset(skip).limit(limit)
+        return merged if columns else select(VehicleDatabase).from_statement(merged)
+
+    statement = select(*(columns or [source]))
+    if vehicle_ids is not None:
+        if len(vehicle_ids) == 1:
+            statement = statement.where(source.vehicle_id == vehicle_ids[0])
+        else:
+            statement = statement.where(source.vehicle_id.in_(vehicle_ids))
+
+    return where(statement).order_by(*order).offset(skip).limit(limit)
+
+
+def build_vehicle_data_page_statement(
+    vehicle_id: Union[str, Sequence[str], None] = None,
+    initial_timestamp: Optional[datetime] = None,
+    final_timestamp: Optional[datetime] = None,
+    sort_by: Optional[SortBy] = None,
+    limit: Optional[int] = 100,
+    skip: Optional[int] = 0,
+    cursor: Optional[str] = None,
+    columns: Optional[list] = None,
+    source: Any = VehicleDatabase,
+) -> Executable:
+    """
+    Build the statement selecting a page of vehicle data after a cursor.
+
+    Pages are ordered by (timestamp, id). The rows without a timestamp, which have no place in that
+    order, come first in ascending order and last in descending order, by id. A page reaching them
+    selects them apart and merges them with the other rows, so every other page is a single index
+    range scan.
+
+    One extra row is selected, so `split_page` can tell whether there is a next page.
+    """
+    sort_by = sort_by or SortBy.ASC
+    position = decode_cursor(cursor) if cursor else None
+    limit = None if limit is None else limit + 1
+
+    # The rows without a timestamp are out of any time range, and of the pages after them
+    with_nulls = initial_timestamp is None and final_timestamp is None
+    if position is not None:
+        with_nulls &= sort_by == SortBy.DESC or position[0] is None
+    # Only the rows without a timestamp are left after one of them
+    with_timestamps = position is None or position[0] is not None or sort_by == SortBy.ASC
+
+    def arm(null_timestamp: bool, arm_columns: Optional[list], arm_skip: Optional[int], arm_limit: Optional[int]):
+        # The cursor only applies to the rows on its side of the NULL timestamps
+        arm_cursor = position if position is not None and (position[0] is None) == null_timestamp else None
+        return build_vehicle_data_statement(
+            vehicle_id, initial_timestamp, final_timestamp, sort_by, arm_limit, arm_skip,
+            null_timestamp=null_timestamp, cursor=arm_cursor, columns=arm_columns, source=source,
+        )
+
+    if not with_nulls or not with_timestamps:
+        return arm(not with_timestamps, columns, skip, limit)
+
+    # Each side selects up to the whole page, and the page is taken from the merge of both
+    page_columns = columns or [getattr(VehicleDatabase, column.key) for column in VehicleDatabase.__table__.columns]
+    arm_limit = None if limit is None else (skip or 0) + limit
+    arms = [arm(null_timestamp, page_columns, 0, arm_limit).subquery() for null_timestamp in (True, False)]
+    page = union_all(*[select(*subquery.c) for subquery in arms]).subquery("vehicle_data_page")
+
+    without_timestamp = case((page.c.timestamp.is_(None), 0), else_=1)
+    order = [without_timestamp, page.c.timestamp, page.c.id]
+    statement = (
+        select(*[page.c[column.key] for column in page_columns])
+        .order_by(*[key.asc() if sort_by == SortBy.ASC else key.desc() for key in order])
+        .offset(skip)
+        .limit(limit)
+    )
+    return statement if columns else select(VehicleDatabase).from_statement(statement)
+
+
+def build_next_cursor_statement(
+    vehicle_id: Union[str, Sequence[str], None],
+    initial_timestamp: Optional[datetime],
+    final_timestamp: Optional[datetime],
+    sort_by: Optional[SortBy],
+    limit: int,
+    skip: Optional[int],
+    cursor: Optional[str],
+    source: Any = VehicleDatabase,
+) -> Executable:
+    """
+    Build the statement selecting the (id, timestamp) of the last row of a page, and of the row after it if any.
+
+    The cursor of the next page is read from it, so a streamed page does not have to be held to find it.
+    """
+    return build_vehicle_data_page_statement(
+        vehicle_id, initial_timestamp, final_timestamp, sort_by, 1, (skip or 0) + limit - 1, cursor,
+        columns=[VehicleDatabase.id, VehicleDatabase.timestamp], source=source,
+    )
+
+
+def is_paged(vehicle_id: Union[str, Sequence[str], None], sort_by: Optional[SortBy], cursor: Optional[str]) -> bool:
+    """
+    Tell whether a query is read in keyset pages: it is sorted, continues a cursor, or spans several vehicles.
+    """
+    return bool(sort_by or cursor) or single_vehicle_id(vehicle_id) is None
+
+
+def page_range(
+    initial_timestamp: Optional[datetime],
+    final_timestamp: Optional[datetime],
+    sort_by: Optional[SortBy],
+    cursor: Optional[str],
+) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """
+    Get the time range left to read by a page: the rows before the cursor position are already read.
+
+    The partitions outside of it are not read, so the next pages only touch the partitions ahead.
+    """
+    if not cursor:
+        return initial_timestamp, final_timestamp
+
+    position, _ = decode_cursor(cursor)
+    if position is None:
+        return initial_timestamp, final_timestamp
+    if sort_by == SortBy.DESC:
+        return initial_timestamp, position
+    return position, final_timestamp
+
+
+def page_cache_key(
+    vehicle_id: Union[str, Sequence[str], None],
+    initial_timestamp: Optional[datetime],
+    final_timestamp: Optional[datetime],
+    sort_by: Optional[SortBy],
+    limit: Optional[int],
+    skip: Optional[int],
+) -> Tuple:
+    """
+    Build the query cache key of the first page of a query, cached with the cursor of the next page.
+
+    Pages are always sorted, ascending unless `sort_by` is DESC.
+    """
+    return make_key(
+        single_vehicle_id(vehicle_id), initial_timestamp, final_timestamp, sort_by or SortBy.ASC, limit, skip,
+        view="page",
+    )
+
+
+# Columns of the row read path, in the order of the VehicleModel fields
+ROW_FIELDS = list(VehicleModel.__fields__)
+
+# Columns selected by the row read path: the id, used by pagination cursors, then the ROW_FIELDS columns
+ROW_COLUMNS = [VehicleDatabase.id, *[getattr(VehicleDatabase, field) for field in ROW_FIELDS]]
+
+
+def rows_to_dicts(rows: List[Any]) -> List[dict]:
+    """
+    Convert the ROW_COLUMNS tuples into VehicleModel-shaped dictionaries.
+
+    The values come straight from the database, so they are not validated again.
+    """
+    return [dict(zip(ROW_FIELDS, row[1:])) for row in rows]
+
+
+def split_page(vehicles: List[Any], limit: Optional[int]) -> Tuple[List[Any], Optional[str]]:
+    """
+    Split the rows selected by `build_vehicle_data_page_statement` into the page and the next cursor.
+
+    The rows are VehicleDatabase objects or ROW_COLUMNS tuples.
+    """
+    if limit is None or len(vehicles) <= limit:
+        return vehicles, None
+
+    vehicles = vehicles[:limit]
+    return vehicles, encode_cursor(vehicles[-1])
+
+
+def hot_tier_page(
+    vehicle_id: Union[str, Sequence[str], None],
+    initial_timestamp: Optional[datetime],
+    final_timestamp: Optional[datetime],
+    sort_by: Optional[SortBy],
+    limit: Optional[int],
+    skip: Optional[int],
+    cursor: Optional[str],
+) -> Optional[Tuple[List[dict], Optional[str]]]:
+    """
+    Get a page of the rows of a single vehicle from the hot tier, like `get_vehicle_data_rows_page`.
+
+    The timestamps of a vehicle are unique, so the timestamp order of the hot tier is the (timestamp,
+    id) order of the pages, and a cursor stands for its timestamp.
+
+    Returns:
+        The rows of the page and the cursor of the next page, or None when the page has to be read
+        from the database: several vehicles, a range or a cursor before the points held, or a row
+        of the page without id.
+    """
+    vehicle = single_vehicle_id(vehicle_id)
+    if vehicle is None:
+        return None
+
+    sort_by = sort_by or SortBy.ASC
+    initial_timestamp = initial_timestamp and to_utc_naive(initial_timestamp)
+    final_timestamp = final_timestamp and to_utc_naive(final_timestamp)
+    position = None
+    if cursor:
+        position, _ = decode_cursor(cursor)
+        # Only the rows without a timestamp are left, which the hot tier does not hold
+        if position is None:
+            return None
+        if sort_by == SortBy.DESC:
+            final_timestamp = position if final_timestamp is None else min(final_timestamp, position)
+        else:
+            initial_timestamp = position if initial_timestamp is None else max(initial_timestamp, position)
+
+    # The row at the cursor, if still held, and the first row of the next page are read along
+    skip = skip or 0
+    rows = hot_tier.query(
+        vehicle, initial_timestamp, final_timestamp, sort_by, None if limit is None else skip + limit + 2, 0,
+        with_ids=True,
+    )
+    if rows is None:
+        return None
+    if position is not None:
+        rows = [row for row in rows if row["timestamp"] != position]
+    rows = rows[skip:]
+
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        if rows[-1]["id"] == NULL_ID:
+            return None
+        next_cursor = encode_position(rows[-1]["timestamp"], rows[-1]["id"])
+    for row in rows:
+        del row["id"]
+    return rows, next_cursor
+
+
+# Columns written by the insert path; the id is assigned by the database
+INSERT_COLUMNS = [column for column in VEHICLE_COLUMNS if column != "id"]
+
+
+def deduplicate_rows(rows: List[dict]) -> Tuple[List[dict], List[bool]]:
+    """
+    Normalise rows to be inserted, and flag the first row of every (vehicle_id, timestamp).
+
+    Args:
+        rows: Dictionaries of VehicleDatabase column values.
+
+    Returns:
+        The rows with every INSERT_COLUMNS column and a naive UTC timestamp, and whether each one is
+        the first of its (vehicle_id, timestamp) in the batch. Rows without a timestamp are never duplicates.
+    """
+    normalized = []
+    first = []
+    seen = set()
+    for row in rows:
+        row = {column: row.get(column) for column in INSERT_COLUMNS}
+        if row["timestamp"] is not None:
+            row["timestamp"] = to_utc_naive(row["timestamp"])
+            key = (row["vehicle_id"], row["timestamp"])
+            first.append(key not in seen)
+            seen.add(key)
+        else:
+            first.append(True)
+        normalized.append(row)
+    return normalized, first
+
+
+def build_insert_statement(dialect_name: str, table: Table = VehicleDatabase.__table__):
+    """
+    Build the INSERT of vehicle data skipping the readings already stored, with the same (vehicle_id, timestamp).
+
+    It returns the id, vehicle_id and timestamp of the rows actually inserted. `table` is vehicle_data
+    or one of its partitions.
+    """
+    insert = dialect_insert(dialect_name)
+    return (
+        insert(table)
+        .on_conflict_do_nothing(index_elements=["vehicle_id", "timestamp"])
+        .returning(table.c.id, table.c.vehicle_id, table.c.timestamp)
+    )
+
+
+def inserted_flags(rows: List[dict], first: List[bool], returned: List[Any]) -> List[bool]:
+    """
+    Get whether each row of `deduplicate_rows` was inserted, from the rows returned by the INSERT.
+    """
+    keys = {(row[1], row[2]) for row in returned}
+    return [
+        is_first and (row["timestamp"] is None or (row["vehicle_id"], row["timestamp"]) in keys)
+        for row, is_first in zip(rows, first)
+    ]
+
 
 class VehicleDataService:
     def __init__(self, db: Session):
@@ -27,7 +449,7 @@ class VehicleDataService:
 
     def get_vehicle_data(
         self,
-        vehicle_id: str = None,
+        vehicle_id: Union[str, List[str], None] = None,
         initial_timestamp: Optional[datetime] = None,
         final_timestamp: Optional[datetime] = None,
         sort_by: Optional[SortBy] = None,
@@ -36,29 +458,218 @@ class VehicleDataService:
     ) -> List[VehicleDatabase]:
         """
         Get vehicle data based on the specified filters.
+
+        Results are served from the query cache until a write to the vehicle invalidates them.
+        Cached rows are returned as VehicleDatabase objects detached from any session.
         """
-        query = self.db.query(VehicleDatabase).filter(VehicleDatabase.vehicle_id == vehicle_id)
+        # Only queries on a single vehicle are cached, as the cache is invalidated per vehicle
+        vehicle = single_vehicle_id(vehicle_id)
+        key = make_key(vehicle, initial_timestamp, final_timestamp, sort_by, limit, skip)
+        # Read before the query runs, so a write committed meanwhile keeps its result out of the cache
+        version = query_cache.version(vehicle)
+        rows = query_cache.get(vehicle, key)
+        if rows is not None:
+            return [VehicleDatabase(**row) for row in rows]
 
-        if initial_timestamp:
-            query = query.filter(VehicleDatabase.timestamp >= initial_timestamp)
+        source = PartitionService(self.db).source(initial_timestamp, final_timestamp)
+        statement = build_vehicle_data_statement(
+            vehicle_id, initial_timestamp, final_timestamp, sort_by, limit, skip, source=source
+        )
 
-        if final_timestamp:
-            query = query.filter(VehicleDatabase.timestamp <= final_timestamp)
+        vehicles = self.db.execute(statement).scalars().all()
+        ROWS_RETURNED.inc(len(vehicles))
+        query_cache.set(vehicle, key, [vehicle_to_row(row) for row in vehicles], version)
+        return vehicles
+
+    def get_vehicle_data_rows(
+        self,
+        vehicle_id: Union[str, List[str], None] = None,
+        initial_timestamp: Optional[datetime] = None,
+        final_timestamp: Optional[datetime] = None,
+        sort_by: Optional[SortBy] = None,
+        limit: int = 100,
+        skip: int = 0,
+    ) -> List[dict]:
+        """
+        Get vehicle data based on the specified filters, as plain dictionaries.
 
-        if sort_by:
-            sort_field = VehicleDatabase.timestamp.asc() if sort_by == SortBy.ASC else VehicleDatabase.timestamp.desc()
-            query = query.order_by(sort_field)
+        Same as `get_vehicle_data`, but the columns are selected as tuples instead of ORM objects,
+        so the rows can be serialised directly (e.g. with orjson) without building a model per row.
 
-        query = query.offset(skip).limit(limit)
+        Returns:
+            A list of dictionaries with the VehicleModel fields.
+        """
+        # Recent ranges of a single vehicle are answered from memory
+        vehicle = single_vehicle_id(vehicle_id)
+        rows = hot_tier.query(vehicle, initial_timestamp, final_timestamp, sort_by, limit, skip)
+        if rows is not None:
+            return rows
 
-        vehicles = query.all()
-        return vehicles
+        key = make_key(vehicle, initial_timestamp, final_timestamp, sort_by, limit, skip, view="rows")
+        version = query_cache.version(vehicle)
+        rows = query_cache.get(vehicle, key)
+        if rows is not None:
+            return rows
+
+        source = PartitionService(self.db).source(initial_timestamp, final_timestamp)
+        statement = build_vehicle_data_statement(
+            vehicle_id, initial_timestamp, final_timestamp, sort_by, limit, skip, columns=ROW_COLUMNS, source=source
+        )
+
+        rows = rows_to_dicts(self.db.execute(statement).all())
+        ROWS_RETURNED.inc(len(rows))
+        query_cache.set(vehicle, key, rows, version)
+        return rows
+
+    def get_vehicle_data_page(
+        self,
+        vehicle_id: Union[str, List[str], None] = None,
+        initial_timestamp: Optional[datetime] = None,
+        final_timestamp: Optional[datetime] = None,
+        sort_by: Optional[SortBy] = None,
+        limit: Optional[int] = 100,
+        skip: Optional[int] = 0,
+        cursor: Optional[str] = None,
+    ) -> Tuple[List[VehicleDatabase], Optional[str]]:
+        """
+        Get a page of vehicle data with keyset (cursor) pagination on (timestamp, id).
+
+        Pages are ordered by timestamp (ascending unless `sort_by` is DESC), and each page costs the
+        same no matter how far in it is. Rows without a timestamp come first in ascending order, and
+        last in descending order.
+
+        Args:
+            cursor: The opaque `next_cursor` returned with the previous page, or None for the first page.
+
+        Returns:
+            The rows of the page, and the cursor of the next page or None if this is the last page.
+        """
+        source = PartitionService(self.db).source(*page_range(initial_timestamp, final_timestamp, sort_by, cursor))
+        statement = build_vehicle_data_page_statement(
+            vehicle_id, initial_timestamp, final_timestamp, sort_by, limit, skip, cursor, source=source
+        )
+
+        vehicles = self.db.execute(statement).scalars().all()
+        ROWS_RETURNED.inc(len(vehicles))
+        return split_page(vehicles, limit)
+
+    def get_vehicle_data_rows_page(
+        self,
+        vehicle_id: Union[str, List[str], None] = None,
+        initial_timestamp: Optional[datetime] = None,
+        final_timestamp: Optional[datetime] = None,
+        sort_by: Optional[SortBy] = None,
+        limit: Optional[int] = 100,
+        skip: Optional[int] = 0,
+        cursor: Optional[str] = None,
+    ) -> Tuple[List[dict], Optional[str]]:
+        """
+        Same as `get_vehicle_data_page`, with the rows of the page as plain dictionaries.
+
+        Recent pages of a single vehicle are answered from the hot tier. The first page of a query
+        (without cursor) is served from the query cache, along with its next cursor, until a write to
+        one of its vehicles invalidates it.
+        """
+        page = hot_tier_page(vehicle_id, initial_timestamp, final_timestamp, sort_by, limit, skip, cursor)
+        if page is not None:
+            return page
+
+        if cursor is None:
+            key = page_cache_key(vehicle_id, initial_timestamp, final_timestamp, sort_by, limit, skip)
+            version = query_cache.version(vehicle_id)
+            page = query_cache.get(vehicle_id, key)
+            if page is not None:
+                return page
+
+        source = PartitionService(self.db).source(*page_range(initial_timestamp, final_timestamp, sort_by, cursor))
+        statement = build_vehicle_data_page_statement(
+            vehicle_id, initial_timestamp, final_timestamp, sort_by, limit, skip, cursor, columns=ROW_COLUMNS,
+            source=source,
+        )
+
+        rows = self.db.execute(statement).all()
+        ROWS_RETURNED.inc(len(rows))
+        rows, next_cursor = split_page(rows, limit)
+        page = rows_to_dicts(rows), next_cursor
+        if cursor is None:
+            query_cache.set(vehicle_id, key, page, version)
+        return page
+
+    def get_next_cursor(
+        self,
+        vehicle_id: Union[str, List[str], None] = None,
+        initial_timestamp: Optional[datetime] = None,
+        final_timestamp: Optional[datetime] = None,
+        sort_by: Optional[SortBy] = None,
+        limit: int = 100,
+        skip: Optional[int] = 0,
+        cursor: Optional[str] = None,
+    ) -> Optional[str]:
+        """
+        Get the cursor of the page after the page of `get_vehicle_data_page`, without reading that page.
+
+        Only the positions of its last row and of the row after it are read.
+        """
+        if limit <= 0:
+            return None
+
+        source = PartitionService(self.db).source(*page_range(initial_timestamp, final_timestamp, sort_by, cursor))
+        statement = build_next_cursor_statement(
+            vehicle_id, initial_timestamp, final_timestamp, sort_by, limit, skip, cursor, source=source
+        )
+
+        rows = self.db.execute(statement).all()
+        return encode_cursor(rows[0]) if len(rows) > 1 else None
+
+    def stream_vehicle_data(
+        self,
+        vehicle_id: Union[str, List[str], None] = None,
+        initial_timestamp: Optional[datetime] = None,
+        final_timestamp: Optional[datetime] = None,
+        sort_by: Optional[SortBy] = None,
+        limit: Optional[int] = None,
+        skip: Optional[int] = 0,
+        chunk_size: int = 1000,
+    ) -> Iterator[VehicleDatabase]:
+        """
+        Stream vehicle data based on the specified filters.
+
+        The rows are fetched `chunk_size` at a time from a server-side cursor (yield_per), so the
+        full result is never held in memory. The query only runs once the iterator is consumed.
+        """
+        source = PartitionService(self.db).source(initial_timestamp, final_timestamp)
+        statement = build_vehicle_data_statement(
+            vehicle_id, initial_timestamp, final_timestamp, sort_by, limit, skip, source=source
+        )
+
+        yield from self.db.execute(statement.execution_options(yield_per=chunk_size)).scalars()
+
+    def explain_vehicle_data(
+        self,
+        vehicle_id: Union[str, List[str], None] = None,
+        initial_timestamp: Optional[datetime] = None,
+        final_timestamp: Optional[datetime] = None,
+        sort_by: Optional[SortBy] = None,
+        limit: int = 100,
+        skip: int = 0,
+    ) -> List[str]:
+        """
+        Get the database query plan of `get_vehicle_data` for the specified filters.
+
+        Used to check that the composite (vehicle_id, timestamp) index serves both the range and the sort.
+        """
+        source = PartitionService(self.db).source(initial_timestamp, final_timestamp)
+        statement = build_vehicle_data_statement(
+            vehicle_id, initial_timestamp, final_timestamp, sort_by, limit, skip, source=source
+        )
+        return explain(self.db, statement)
 
     def get_vehicle_data_by_id(self, id: int) -> Optional[VehicleDatabase]:
         """
         Get vehicle data by ID.
         """
-        vehicle = self.db.query(VehicleDatabase).filter_by(id=id).first()
+        source = PartitionService(self.db).source_of_id(id)
+        vehicle = self.db.execute(select(source).where(source.id == id)).scalars().first()
         if not vehicle:
             raise HTTPException(status_code=404, detail=f"Vehicle data with id {id} not found.")
         return vehicle
@@ -66,16 +677,91 @@ class VehicleDataService:
     def add_vehicle_data(self, vehicle_database: VehicleDatabase) -> VehicleDatabase:
         """
         Add vehicle data to the database.
+
+        A reading with the (vehicle_id, timestamp) of a stored one is not inserted again, and the stored
+        reading is returned, so a retried request has no effect.
         """
         try:
-            self.db.add(vehicle_database)
+            _, returned = self._write([vehicle_to_row(vehicle_database)])
+            if returned:
+                vehicle = self.get_vehicle_data_by_id(returned[0][0])
+            else:
+                timestamp = to_utc_naive(vehicle_database.timestamp)
+                source = PartitionService(self.db).source(timestamp, timestamp)
+                vehicle = self.db.execute(
+                    select(source).where(
+                        source.vehicle_id == vehicle_database.vehicle_id, source.timestamp == timestamp
+                    )
+                ).scalars().first()
+        finally:
+            self.db.close()
+
+        return vehicle
+
+    def add_vehicle_data_bulk(self, rows: List[dict]) -> int:
+        """
+        Add many vehicle data rows to the database in a single transaction.
+
+        The rows are written with one executemany INSERT instead of one ORM object per row,
+        so a batch costs a single commit. The rollups and latest states are updated in the same transaction.
+
+        Args:
+            rows: A list of dictionaries holding the VehicleDatabase column values.
+
+        Returns:
+            The number of rows inserted, without the duplicates.
+        """
+        return sum(self.insert_vehicle_data(rows))
+
+    def insert_vehicle_data(self, rows: List[dict]) -> List[bool]:
+        """
+        Add many vehicle data rows to the database in a single transaction, skipping the duplicates.
+
+        A row with the (vehicle_id, timestamp) of a stored row, or of an earlier row of the batch, is
+        not inserted: re-importing a file or retrying a batch only writes the missing rows. The rollups,
+        trips, latest states, caches and subscribers only see the rows actually inserted.
+
+        Args:
+            rows: A list of dictionaries holding the VehicleDatabase column values.
+
+        Returns:
+            Whether each row was inserted, False for the duplicates.
+        """
+        inserted, _ = self._write(rows)
+        return inserted
+
+    def _write(self, rows: List[dict]) -> Tuple[List[bool], List[Any]]:
+        """
+        Insert the new rows into their table (vehicle_data or the partition of their month) and update
+        their derived state, then commit.
+
+        Returns:
+            Whether each row was inserted, and the (id, vehicle_id, timestamp) of the inserted rows.
+        """
+        if not rows:
+            return [], []
+
+        rows, first = deduplicate_rows(rows)
+        try:
+            dialect_name = self.db.get_bind().dialect.name
+            returned = []
+            for table, group in PartitionService(self.db).route([row for row, is_first in zip(rows, first) if is_first]):
+                returned += self.db.execute(build_insert_statement(dialect_name, table), group).all()
+            inserted = inserted_flags(rows, first, returned)
+            new_rows = [row for row, is_inserted in zip(rows, inserted) if is_inserted]
+
+            if settings.rollups_enabled:
+                RollupService(self.db).add(new_rows)
+            TripService(self.db).mark_dirty(new_rows)
+            LatestStateService(self.db).upsert(new_rows)
             self.db.commit()
-            self.db.refresh(vehicle_database)
         except Exception as e:
             self.db.rollback()
             raise HTTPException(status_code=500, detail=str(e))
-        finally:
-            self.db.close()
 
-        return vehicle_database
+        if new_rows:
+            query_cache.invalidate(row["vehicle_id"] for row in new_rows)
+            hot_tier.add(new_rows, returned)
+            broker.publish(new_rows)
 
+        return inserted, returned
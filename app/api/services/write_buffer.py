@@ -0,0 +1,311 @@
+"""
+This module defines the write-behind buffer of vehicle data: readings queued in process and committed in batches.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Callable, List, Optional
+
+from sqlalchemy.exc import DataError, DBAPIError, IntegrityError, OperationalError, StatementError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.api.services.async_vehicle_data_service import AsyncVehicleDataService
+from app.core.config import Settings, settings
+from app.core.database.models import Durability
+from app.core.metrics import (
+    WRITE_BEHIND_FLUSH_DURATION,
+    WRITE_BEHIND_LATENCY,
+    WRITE_BEHIND_QUEUE_DEPTH,
+    WRITE_BEHIND_ROWS,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBufferFullError(Exception):
+    """
+    Raised when the write-behind buffer has no room left for the readings submitted.
+    """
+
+
+def _causes(error: BaseException):
+    """
+    Iterate over an error and the errors it was raised from or while handling.
+    """
+    while error is not None:
+        yield error
+        error = error.__cause__ or error.__context__
+
+
+def is_row_error(error: BaseException) -> bool:
+    """
+    Tell whether an error comes from the values of some of the rows written: a constraint violation,
+    an invalid value, or a value that could not be bound to the statement.
+    """
+    for cause in _causes(error):
+        if isinstance(cause, (IntegrityError, DataError)):
+            return True
+        # The other DBAPI errors (locks, connections, ...) are those of the database, not of the rows
+        if isinstance(cause, StatementError) and not isinstance(cause, DBAPIError):
+            return True
+    return False
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """
+    Tell whether an error may not happen again when the write is retried, e.g. "database is locked".
+    """
+    return any(isinstance(cause, OperationalError) for cause in _causes(error))
+
+
+class WriteBuffer:
+    """
+    Queue readings in memory and commit them in batches from a background task.
+
+    Many single-reading requests then share one transaction and one fsync, and hold the database
+    writer lock once per batch instead of once per reading. A batch is flushed when it holds
+    `batch_size` readings, or when its oldest reading has waited `flush_interval`.
+
+    With the COMMIT durability, `submit` returns once the batch holding the readings is committed,
+    and raises the error of its readings if they failed. With ENQUEUE, it returns as soon as the
+    readings are queued: readings still queued are lost if the process crashes, and failed readings
+    are only logged. Queued readings are not visible to reads until they are flushed.
+
+    A batch failing on the values of its readings is split in halves committed separately, down to
+    single submits, so the readings of the other submits are committed and only the submits at fault
+    get the error. A batch failing with a transient error is retried whole `retries` times with an
+    exponential backoff, holding back the next batches; it then fails whole, as on any other error.
+    If the flusher dies, the pending submits fail with its error and the buffer stops.
+
+    The buffer runs on the event loop it is started on, and is not thread-safe.
+    """
+
+    def __init__(
+        self,
+        max_rows: int = 100000,
+        batch_size: int = 5000,
+        flush_interval: float = 0.02,
+        durability: Durability = Durability.COMMIT,
+        enabled: bool = True,
+        retries: int = 3,
+        retry_backoff: float = 0.1,
+    ):
+        """
+        Args:
+            max_rows: The maximum number of readings queued; more are refused with WriteBufferFullError.
+            batch_size: The number of readings that triggers a flush, and the most committed at a time.
+            flush_interval: How long the oldest queued reading waits at most before a flush (seconds).
+            durability: When `submit` returns: once the readings are queued, or once they are committed.
+            enabled: Whether `start` starts the background flusher.
+            retries: How many times a batch failing with a transient error is retried.
+            retry_backoff: How long to wait before the first retry (seconds), doubled at each retry.
+        """
+        self.max_rows = max_rows
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.durability = Durability(durability)
+        self.enabled = enabled
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+
+        # (rows, future resolved on commit or None, time queued) per submit
+        self._entries: deque = deque()
+        self._depth = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._session_factory: Optional[Callable[[], AsyncSession]] = None
+
+    @property
+    def running(self) -> bool:
+        """
+        Whether the background flusher is running, so writes must go through `submit`.
+        """
+        return self._task is not None
+
+    def start(self, session_factory: Callable[[], AsyncSession]) -> None:
+        """
+        Start the background flusher on the running event loop, if the buffer is enabled.
+
+        Args:
+            session_factory: The factory of the sessions the batches are written with.
+        """
+        if not self.enabled or self._task is not None:
+            return
+        self._session_factory = session_factory
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+        self._task.add_done_callback(self._on_stopped)
+
+    async def stop(self) -> None:
+        """
+        Flush every queued reading, then stop the background flusher.
+        """
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        try:
+            await self._task
+        finally:
+            self._task = None
+
+    async def submit(self, rows: List[dict]) -> None:
+        """
+        Queue readings to be committed by the background flusher.
+
+        Args:
+            rows: Dictionaries of VehicleDatabase column values.
+
+        Raises:
+            WriteBufferFullError: If the buffer has no room left for the readings.
+            Exception: With the COMMIT durability, the error of the batch holding the readings.
+        """
+        if not self.running or self._stopping:
+            raise RuntimeError("The write-behind buffer is not running")
+        if self._depth + len(rows) > self.max_rows:
+            raise WriteBufferFullError(f"The write-behind buffer is full ({self._depth} readings queued)")
+
+        future = asyncio.get_running_loop().create_future() if self.durability == Durability.COMMIT else None
+        self._entries.append((rows, future, time.perf_counter()))
+        self._depth += len(rows)
+        WRITE_BEHIND_QUEUE_DEPTH.set(self._depth)
+        self._wakeup.set()
+
+        if future is not None:
+            await future
+
+    async def _run(self) -> None:
+        """
+        Flush batches until the buffer is stopped and empty.
+        """
+        while True:
+            if not self._entries:
+                if self._stopping:
+                    return
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            # Wait for a full batch, or for the oldest reading to have waited the flush interval
+            deadline = self._entries[0][2] + self.flush_interval
+            while self._depth < self.batch_size and not self._stopping:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    break
+
+            await self._flush()
+
+    def _on_stopped(self, task: asyncio.Task) -> None:
+        """
+        Fail the readings still queued if the flusher died, and mark the buffer as stopped.
+        """
+        # A buffer restarted meanwhile runs another task
+        if self._task is not None and task is not self._task:
+            return
+        self._task = None
+
+        error = None if task.cancelled() else task.exception()
+        if error is None and not self._entries:
+            return
+        if error is None:
+            error = RuntimeError("The write-behind buffer stopped")
+        logger.error("Write-behind flusher stopped with %d readings queued: %s", self._depth, error)
+
+        while self._entries:
+            rows, future, _ = self._entries.popleft()
+            WRITE_BEHIND_ROWS.labels("failed").inc(len(rows))
+            if future is not None and not future.done():
+                future.set_exception(error)
+        self._depth = 0
+        WRITE_BEHIND_QUEUE_DEPTH.set(0)
+
+    async def _flush(self) -> None:
+        """
+        Commit the oldest queued readings, up to a batch, and resolve their futures.
+        """
+        entries = [self._entries.popleft()]
+        count = len(entries[0][0])
+        while self._entries and count + len(self._entries[0][0]) <= self.batch_size:
+            entries.append(self._entries.popleft())
+            count += len(entries[-1][0])
+        self._depth -= count
+        WRITE_BEHIND_QUEUE_DEPTH.set(self._depth)
+
+        start = time.perf_counter()
+        await self._commit(entries)
+        WRITE_BEHIND_FLUSH_DURATION.observe(time.perf_counter() - start)
+
+    async def _commit(self, entries: List[tuple]) -> None:
+        """
+        Commit the readings of queued submits in one transaction and resolve their futures.
+
+        If the transaction fails on the values of the readings, each half of the submits is committed
+        separately, until the submits at fault are alone in theirs and get the error.
+        """
+        rows = [row for entry_rows, _, _ in entries for row in entry_rows]
+        error = await self._write(rows)
+        if error is not None:
+            if len(entries) > 1 and is_row_error(error):
+                middle = len(entries) // 2
+                await self._commit(entries[:middle])
+                await self._commit(entries[middle:])
+                return
+            logger.error("Write-behind flush of %d readings failed: %s", len(rows), error)
+
+        now = time.perf_counter()
+        WRITE_BEHIND_ROWS.labels("failed" if error else "committed").inc(len(rows))
+        for _, future, queued_at in entries:
+            WRITE_BEHIND_LATENCY.observe(now - queued_at)
+            if future is None or future.done():
+                continue
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(error)
+
+    async def _write(self, rows: List[dict]) -> Optional[Exception]:
+        """
+        Write readings in one transaction, retrying it on transient errors.
+
+        Returns:
+            The error of the last attempt, or None once the readings are committed.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                async with self._session_factory() as db:
+                    await AsyncVehicleDataService(db=db).add_vehicle_data_bulk(rows)
+                return None
+            except Exception as e:
+                if attempt == self.retries or not is_transient_error(e):
+                    return e
+                delay = self.retry_backoff * 2 ** attempt
+                logger.warning("Write-behind flush of %d readings failed, retrying in %.2fs: %s", len(rows), delay, e)
+                await asyncio.sleep(delay)
+
+
+def create_write_buffer(settings: Settings) -> WriteBuffer:
+    """
+    Create the write-behind buffer described by the settings.
+    """
+    return WriteBuffer(
+        max_rows=settings.write_behind_queue_size,
+        batch_size=settings.write_behind_batch_size,
+        flush_interval=settings.write_behind_flush_ms / 1000,
+        durability=settings.write_behind_durability,
+        enabled=settings.write_behind_enabled,
+        retries=settings.write_behind_retries,
+        retry_backoff=settings.write_behind_retry_backoff_ms / 1000,
+    )
+
+
+write_buffer = create_write_buffer(settings)
@@ -0,0 +1,365 @@
+"""
+This module defines the result cache of vehicle data queries.
+
+Results are cached per vehicle, so a write to a vehicle invalidates its cached queries only.
+The default backend is a bounded in-process LRU with a TTL; a Redis backend lets several workers share it.
+"""
+
+import pickle
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Hashable, Iterable, Optional, Sequence, Set, Tuple, Union
+
+from app.core.config import Settings, settings
+from app.core.database.functions import to_utc_naive
+
+
+def make_key(
+    vehicle_id: Optional[str],
+    initial_timestamp: Optional[datetime] = None,
+    final_timestamp: Optional[datetime] = None,
+    sort_by: Optional[Any] = None,
+    limit: Optional[int] = None,
+    skip: Optional[int] = None,
+    view: str = "vehicles",
+) -> Tuple:
+    """
+    Build the cache key of a query from its normalised parameters.
+
+    Parameters that select the same rows give the same key, e.g. skip=None and skip=0, or the same
+    bound in two time zones. The view tells apart the cached shapes of the same query (VehicleDatabase
+    column values, response rows, or pages with their next cursor).
+    """
+    return (
+        view,
+        vehicle_id,
+        to_utc_naive(initial_timestamp).isoformat() if initial_timestamp else None,
+        to_utc_naive(final_timestamp).isoformat() if final_timestamp else None,
+        getattr(sort_by, "value", sort_by),
+        limit,
+        skip or 0,
+    )
+
+
+class CacheBackend(ABC):
+    """
+    The interface of a query cache backend.
+
+    Every entry belongs to a vehicle, and `invalidate` drops all the entries of a vehicle.
+
+    A query that misses reads the `version` of its vehicle before running, and passes it to `set`:
+    if the vehicle was invalidated in the meantime, the result may predate the write and is not stored.
+    """
+
+    @abstractmethod
+    def version(self, vehicle_id: Optional[str]) -> Hashable:
+        """
+        Get the current version of the entries of a vehicle, changed by every invalidation.
+        """
+
+    @abstractmethod
+    def get(self, vehicle_id: Optional[str], key: Hashable) -> Optional[Any]:
+        """
+        Get a cached value, or None on a miss.
+        """
+
+    @abstractmethod
+    def set(self, vehicle_id: Optional[str], key: Hashable, value: Any, version: Optional[Hashable] = None) -> None:
+        """
+        Cache a value, unless the version of its vehicle is no longer `version`.
+        """
+
+    @abstractmethod
+    def invalidate(self, vehicle_id: Optional[str]) -> None:
+        """
+        Drop all the cached values of a vehicle.
+        """
+
+    @abstractmethod
+    def clear(self) -> None:
+        """
+        Drop all the cached values.
+        """
+
+    @abstractmethod
+    def stats(self) -> Dict[str, int]:
+        """
+        Get the counters of the cache.
+        """
+
+
+class MemoryCacheBackend(CacheBackend):
+    """
+    In-process LRU cache with a TTL, bounded both in number of entries and in bytes.
+
+    Values are stored pickled, which gives their size and keeps callers from mutating cached results.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024, ttl: float = 60):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        # (vehicle_id, key) -> (expiry, pickled value), least recently used first
+        self._entries: "OrderedDict[Tuple[Optional[str], Hashable], Tuple[float, bytes]]" = OrderedDict()
+        # vehicle_id -> keys of its entries, for the per-vehicle invalidation
+        self._vehicle_keys: Dict[Optional[str], Set[Hashable]] = {}
+        # vehicle_id -> number of invalidations, and number of clears, which make up the versions
+        self._generations: Dict[Optional[str], int] = {}
+        self._clears = 0
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def version(self, vehicle_id: Optional[str]) -> Hashable:
+        with self._lock:
+            return self._clears, self._generations.get(vehicle_id, 0)
+
+    def get(self, vehicle_id: Optional[str], key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get((vehicle_id, key))
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expiry, data = entry
+            if expiry <= time.monotonic():
+                self._remove(vehicle_id, key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end((vehicle_id, key))
+            self.hits += 1
+
+        return pickle.loads(data)
+
+    def set(self, vehicle_id: Optional[str], key: Hashable, value: Any, version: Optional[Hashable] = None) -> None:
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        # A value larger than the whole cache would evict everything and still not fit
+        if len(data) > self.max_bytes:
+            return
+
+        with self._lock:
+            if version is not None and version != (self._clears, self._generations.get(vehicle_id, 0)):
+                return
+
+            if (vehicle_id, key) in self._entries:
+                self._remove(vehicle_id, key)
+
+            self._entries[(vehicle_id, key)] = (time.monotonic() + self.ttl, data)
+            self._vehicle_keys.setdefault(vehicle_id, set()).add(key)
+            self._bytes += len(data)
+
+            # Evict the least recently used entries until both bounds hold
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                (lru_vehicle_id, lru_key), _ = next(iter(self._entries.items()))
+                self._remove(lru_vehicle_id, lru_key)
+                self.evictions += 1
+
+    def invalidate(self, vehicle_id: Optional[str]) -> None:
+        with self._lock:
+            for key in list(self._vehicle_keys.get(vehicle_id, ())):
+                self._remove(vehicle_id, key)
+            self._generations[vehicle_id] = self._generations.get(vehicle_id, 0) + 1
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._vehicle_keys.clear()
+            self._generations.clear()
+            self._clears += 1
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+    def _remove(self, vehicle_id: Optional[str], key: Hashable) -> None:
+        """
+        Remove an entry. The lock must be held.
+        """
+        _, data = self._entries.pop((vehicle_id, key))
+        self._bytes -= len(data)
+
+        keys = self._vehicle_keys[vehicle_id]
+        keys.discard(key)
+        if not keys:
+            del self._vehicle_keys[vehicle_id]
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Cache shared by several workers through Redis.
+
+    Every vehicle has a generation counter that is part of the keys of its entries: invalidating a
+    vehicle increments it, so its previous entries are never read again and expire with their TTL.
+    The generation is the version of the vehicle: a value set with an older generation is stored
+    under keys that are no longer read.
+    Redis bounds the memory itself (maxmemory with an LRU policy).
+    The counters are those of this worker.
+    """
+
+    def __init__(self, url: str, ttl: float = 60, prefix: str = "volteras:cache"):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("The redis cache backend requires the redis package: pip install redis")
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def version(self, vehicle_id: Optional[str]) -> Hashable:
+        return int(self.client.get(self._generation_key(vehicle_id)) or 0)
+
+    def get(self, vehicle_id: Optional[str], key: Hashable) -> Optional[Any]:
+        data = self.client.get(self._key(vehicle_id, key))
+        if data is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return pickle.loads(data)
+
+    def set(self, vehicle_id: Optional[str], key: Hashable, value: Any, version: Optional[Hashable] = None) -> None:
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self.client.set(self._key(vehicle_id, key, version), data, px=int(self.ttl * 1000))
+
+    def invalidate(self, vehicle_id: Optional[str]) -> None:
+        self.client.incr(self._generation_key(vehicle_id))
+        self.invalidations += 1
+
+    def clear(self) -> None:
+        # The generations are kept, so the values of the queries running meanwhile stay unreachable
+        for redis_key in self.client.scan_iter(f"{self.prefix}:entry:*"):
+            self.client.delete(redis_key)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "invalidations": self.invalidations}
+
+    def _generation_key(self, vehicle_id: Optional[str]) -> str:
+        return f"{self.prefix}:generation:{vehicle_id}"
+
+    def _key(self, vehicle_id: Optional[str], key: Hashable, generation: Optional[int] = None) -> str:
+        if generation is None:
+            generation = self.version(vehicle_id)
+        return f"{self.prefix}:entry:{vehicle_id}:{generation}:{key!r}"
+
+
+class QueryCache:
+    """
+    The query result cache used by the vehicle data services.
+
+    When disabled, every lookup is a miss and nothing is stored. Queries on all vehicles (`vehicle_id`
+    None) are never cached, as writes only invalidate the queries of their vehicle. A query on a set
+    of vehicles is stored apart from them, under a key holding the version of every vehicle of the
+    set: a write to any of them makes it unreachable, and it expires with its TTL.
+    """
+
+    def __init__(self, backend: CacheBackend, enabled: bool = True):
+        self.backend = backend
+        self.enabled = enabled
+
+    def version(self, vehicle_id: Union[str, Sequence[str], None]) -> Optional[Hashable]:
+        """
+        Get the version of the cached queries of a vehicle, to be read before running a query and passed to `set`.
+        """
+        vehicle_ids = self._vehicle_ids(vehicle_id)
+        if not self.enabled or vehicle_ids is None:
+            return None
+        if len(vehicle_ids) == 1:
+            return self.backend.version(vehicle_ids[0])
+        return tuple(self.backend.version(vehicle) for vehicle in vehicle_ids)
+
+    def get(self, vehicle_id: Union[str, Sequence[str], None], key: Hashable) -> Optional[Any]:
+        vehicle_ids = self._vehicle_ids(vehicle_id)
+        if not self.enabled or vehicle_ids is None:
+            return None
+        if len(vehicle_ids) == 1:
+            return self.backend.get(vehicle_ids[0], key)
+        return self.backend.get(None, (vehicle_ids, self.version(vehicle_ids), key))
+
+    def set(
+        self, vehicle_id: Union[str, Sequence[str], None], key: Hashable, value: Any, version: Optional[Hashable] = None
+    ) -> None:
+        """
+        Cache the result of a query, unless a vehicle of the query was written to since `version` was read.
+        """
+        vehicle_ids = self._vehicle_ids(vehicle_id)
+        if not self.enabled or vehicle_ids is None:
+            return
+        if len(vehicle_ids) == 1:
+            self.backend.set(vehicle_ids[0], key, value, version)
+            return
+
+        current = self.version(vehicle_ids)
+        if version is None or version == current:
+            self.backend.set(None, (vehicle_ids, current, key), value)
+
+    def invalidate(self, vehicle_ids: Iterable[Optional[str]]) -> None:
+        """
+        Drop the cached queries of every vehicle written to.
+        """
+        if self.enabled:
+            for vehicle_id in set(vehicle_ids):
+                self.backend.invalidate(vehicle_id)
+
+    def clear(self) -> None:
+        self.backend.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return self.backend.stats()
+
+    @staticmethod
+    def _vehicle_ids(vehicle_id: Union[str, Sequence[str], None]) -> Optional[Tuple[str, ...]]:
+        """
+        Normalise the vehicle filter of a query into its sorted distinct vehicles, or None for all vehicles.
+        """
+        if vehicle_id is None:
+            return None
+        if isinstance(vehicle_id, str):
+            return (vehicle_id,)
+        return tuple(sorted(set(vehicle_id))) or None
+
+
+def create_query_cache(settings: Settings) -> QueryCache:
+    """
+    Create the query cache described by the settings.
+    """
+    if settings.cache_backend == "redis":
+        backend = RedisCacheBackend(settings.cache_redis_url, ttl=settings.cache_ttl)
+    elif settings.cache_backend == "memory":
+        backend = MemoryCacheBackend(
+            max_entries=settings.cache_max_entries,
+            max_bytes=settings.cache_max_bytes,
+            ttl=settings.cache_ttl,
+        )
+    else:
+        raise ValueError(f"Unknown cache backend: {settings.cache_backend}")
+
+    return QueryCache(backend, enabled=settings.cache_enabled)
+
+
+query_cache = create_query_cache(settings)
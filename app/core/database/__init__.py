@@ -1,5 +1,12 @@
 from app.core.database.models import Base
-from app.core.database.database import SessionLocal, engine, get_db
+from app.core.database.database import (
+    AsyncSessionLocal,
+    SessionLocal,
+    async_engine,
+    engine,
+    get_async_db,
+    get_db,
+)
 
 
 # __all__ = ["Base", "SessionLocal"]
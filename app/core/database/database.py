@@ -1,8 +1,22 @@
-from sqlalchemy import create_engine
+from typing import Any, Dict
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from fastapi import Depends
+from app.core.config import Settings, settings
 from app.core.database.models import VehicleDatabase
+from app.core.database.slow_query import slow_query_log
+from app.core.metrics import instrument_engine
+
+
+# Async drivers used for each backend by the async engine
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
 
 
 def get_db():
@@ -13,9 +27,77 @@ def get_db():
         db.close()
 
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./sql_app.db"
+async def get_async_db():
+    """
+    Provide an AsyncSession, so the queries of the async endpoints do not block the event loop.
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def to_async_url(database_url: str) -> str:
+    """
+    Convert a synchronous database URL into the URL of its async driver (aiosqlite or asyncpg).
+    """
+    url = make_url(database_url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver for database backend: {backend}")
+    return url.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+
+def engine_options(database_url: str, settings: Settings) -> Dict[str, Any]:
+    """
+    Get the create_engine options for a database URL.
+
+    The pool settings apply to server databases (Postgres); SQLite keeps the default pool of its driver.
+    """
+    if make_url(database_url).get_backend_name() == "sqlite":
+        return {"connect_args": {"check_same_thread": False}}
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+    return {
+        "pool_size": settings.database_pool_size,
+        "max_overflow": settings.database_max_overflow,
+        "pool_timeout": settings.database_pool_timeout,
+        "pool_pre_ping": settings.database_pool_pre_ping,
+    }
+
+
+def set_sqlite_pragmas(engine: Engine, settings: Settings) -> None:
+    """
+    Apply the SQLite PRAGMAs of the settings on every new connection of the engine.
+
+    WAL journal mode lets readers run alongside the writer, and synchronous=NORMAL is safe in WAL mode
+    while only syncing at checkpoints. mmap and a larger page cache cut the reads going through the OS.
+    """
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={settings.sqlite_journal_mode}")
+        cursor.execute(f"PRAGMA synchronous={settings.sqlite_synchronous}")
+        cursor.execute(f"PRAGMA mmap_size={settings.sqlite_mmap_size}")
+        cursor.execute(f"PRAGMA cache_size={settings.sqlite_cache_size}")
+        cursor.execute(f"PRAGMA busy_timeout={settings.sqlite_busy_timeout}")
+        cursor.close()
+
+
+SQLALCHEMY_DATABASE_URL = settings.database_url
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **engine_options(SQLALCHEMY_DATABASE_URL, settings))
+set_sqlite_pragmas(engine, settings)
+instrument_engine(engine)
+slow_query_log.instrument(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+ASYNC_SQLALCHEMY_DATABASE_URL = to_async_url(SQLALCHEMY_DATABASE_URL)
+
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, **engine_options(ASYNC_SQLALCHEMY_DATABASE_URL, settings))
+set_sqlite_pragmas(async_engine.sync_engine, settings)
+instrument_engine(async_engine.sync_engine)
+slow_query_log.instrument(async_engine.sync_engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
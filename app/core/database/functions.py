@@ -0,0 +1,89 @@
+"""
+This module defines SQL functions compiled differently on each database backend, and the conversion
+of timestamps to their stored form.
+"""
+
+from datetime import datetime, timezone
+
+from sqlalchemy import Integer
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+
+
+def to_utc_naive(timestamp: datetime) -> datetime:
+    """
+    Convert a timestamp to a naive UTC datetime, as stored in the database.
+    """
+    if timestamp.tzinfo is not None:
+        return timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+class epoch_seconds(FunctionElement):
+    """
+    The number of seconds between the Unix epoch and a (naive, UTC) timestamp, as an integer.
+    """
+    type = Integer()
+    inherit_cache = True
+    name = "epoch_seconds"
+
+
+@compiles(epoch_seconds)
+def _compile_epoch_seconds(element, compiler, **kw):
+    return "CAST(EXTRACT(EPOCH FROM %s) AS BIGINT)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(epoch_seconds, "sqlite")
+def _compile_epoch_seconds_sqlite(element, compiler, **kw):
+    return "CAST(strftime('%%s', %s) AS INTEGER)" % compiler.process(element.clauses, **kw)
+
+
+class least(FunctionElement):
+    """
+    The smallest of two values, ignoring NULLs (as Postgres LEAST does).
+    """
+    inherit_cache = True
+    name = "least"
+
+
+class greatest(FunctionElement):
+    """
+    The largest of two values, ignoring NULLs (as Postgres GREATEST does).
+    """
+    inherit_cache = True
+    name = "greatest"
+
+
+@compiles(least)
+def _compile_least(element, compiler, **kw):
+    return "LEAST(%s)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(greatest)
+def _compile_greatest(element, compiler, **kw):
+    return "GREATEST(%s)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(least, "sqlite")
+def _compile_least_sqlite(element, compiler, **kw):
+    # The scalar min() of SQLite returns NULL as soon as one argument is NULL
+    a, b = [compiler.process(clause, **kw) for clause in element.clauses]
+    return f"min(coalesce({a}, {b}), coalesce({b}, {a}))"
+
+
+@compiles(greatest, "sqlite")
+def _compile_greatest_sqlite(element, compiler, **kw):
+    a, b = [compiler.process(clause, **kw) for clause in element.clauses]
+    return f"max(coalesce({a}, {b}), coalesce({b}, {a}))"
+
+
+def dialect_insert(dialect_name: str):
+    """
+    Get the `insert` construct of a backend, which supports `on_conflict_do_update` (upserts).
+    """
+    if dialect_name == "sqlite":
+        return sqlite.insert
+    if dialect_name == "postgresql":
+        return postgresql.insert
+    raise ValueError(f"Upserts are not supported on database backend: {dialect_name}")
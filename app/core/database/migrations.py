@@ -0,0 +1,138 @@
+"""
+This module defines the schema migrations applied to existing databases.
+
+`Base.metadata.create_all` creates the missing tables with their indexes, but never alters a table
+that already exists. Each migration brings an existing database in line with the models. Migrations
+are idempotent, so they are no-ops on a database freshly created from the current models.
+"""
+
+import datetime
+import logging
+from typing import Callable, List, Tuple
+
+from sqlalchemy import delete, func, insert, literal, select, text
+from sqlalchemy.engine import Connection, Engine
+
+from app.core.database.models import (
+    LatestVehicleStateDatabase,
+    SchemaMigrationDatabase,
+    TripDatabase,
+    TripSegmentationDatabase,
+    VehicleDatabase,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+def _get_index(table, name: str):
+    """
+    Get an index of a table by name.
+    """
+    return next(index for index in table.indexes if index.name == name)
+
+
+def _add_vehicle_id_timestamp_index(connection: Connection) -> None:
+    """
+    Add the composite (vehicle_id, timestamp) index, which makes the single-column vehicle_id index redundant.
+    """
+    # Not unique yet: the duplicates are only removed by a later migration
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_vehicle_data_vehicle_id_timestamp ON vehicle_data (vehicle_id, timestamp)"
+    ))
+    connection.execute(text("DROP INDEX IF EXISTS ix_vehicle_data_vehicle_id"))
+
+
+def _fill_latest_vehicle_state(connection: Connection) -> None:
+    """
+    Create the latest_vehicle_state table and fill it with the newest reading of every vehicle.
+    """
+    LatestVehicleStateDatabase.__table__.create(bind=connection, checkfirst=True)
+    connection.execute(LatestVehicleStateDatabase.__table__.delete())
+
+    fields = ["timestamp", "speed", "odometer", "soc", "elevation", "shift_state"]
+    vehicle = VehicleDatabase
+    ranked = (
+        select(
+            vehicle.vehicle_id,
+            *[getattr(vehicle, field) for field in fields],
+            func.row_number().over(
+                partition_by=vehicle.vehicle_id, order_by=[vehicle.timestamp.desc(), vehicle.id.desc()]
+            ).label("rank"),
+        )
+        .where(vehicle.timestamp.isnot(None))
+        .subquery()
+    )
+    newest = select(
+        ranked.c.vehicle_id,
+        *[ranked.c[field] for field in fields],
+        literal(datetime.datetime.utcnow()).label("updated_at"),
+    ).where(ranked.c.rank == 1)
+    connection.execute(
+        insert(LatestVehicleStateDatabase).from_select(["vehicle_id", *fields, "updated_at"], newest)
+    )
+
+
+def _unique_vehicle_id_timestamp(connection: Connection) -> None:
+    """
+    Remove the duplicate readings, keeping the first one of every (vehicle_id, timestamp), and make the
+    composite index unique.
+
+    The trips of the removed readings are segmented again on their next read; the rollups still count
+    them until they are rebuilt with scripts/rebuild_rollups.py.
+    """
+    vehicle = VehicleDatabase
+    first = (
+        select(func.min(vehicle.id))
+        .where(vehicle.timestamp.isnot(None))
+        .group_by(vehicle.vehicle_id, vehicle.timestamp)
+    )
+    removed = connection.execute(
+        delete(vehicle).where(vehicle.timestamp.isnot(None), vehicle.id.notin_(first))
+    ).rowcount
+
+    if removed:
+        connection.execute(delete(TripDatabase))
+        connection.execute(delete(TripSegmentationDatabase))
+        logger.warning(
+            "Removed %d duplicate readings: rebuild the rollups with scripts/rebuild_rollups.py", removed
+        )
+
+    connection.execute(text("DROP INDEX IF EXISTS ix_vehicle_data_vehicle_id_timestamp"))
+    _get_index(vehicle.__table__, "ix_vehicle_data_vehicle_id_timestamp").create(bind=connection)
+
+
+# Ordered list of (version, description, upgrade) migrations
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "Add composite (vehicle_id, timestamp) index", _add_vehicle_id_timestamp_index),
+    (2, "Fill the latest vehicle state table", _fill_latest_vehicle_state),
+    (3, "Make (vehicle_id, timestamp) unique", _unique_vehicle_id_timestamp),
+]
+
+
+def migrate(engine: Engine) -> List[int]:
+    """
+    Apply the pending migrations to the database, each one in its own transaction.
+
+    Args:
+        engine: The engine of the database to migrate.
+
+    Returns:
+        The versions of the migrations applied.
+    """
+    SchemaMigrationDatabase.__table__.create(bind=engine, checkfirst=True)
+
+    with engine.connect() as connection:
+        applied = set(connection.execute(select(SchemaMigrationDatabase.version)).scalars())
+
+    versions = []
+    for version, description, upgrade in MIGRATIONS:
+        if version in applied:
+            continue
+
+        with engine.begin() as connection:
+            upgrade(connection)
+            connection.execute(insert(SchemaMigrationDatabase).values(version=version, description=description))
+        versions.append(version)
+
+    return versions
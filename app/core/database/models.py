@@ -4,7 +4,7 @@ This module defines the database models.
 
 import datetime
 from enum import Enum
-from sqlalchemy import Column, Integer, String, Float, DateTime
+from sqlalchemy import Column, Integer, String, Float, DateTime, Index
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
@@ -12,9 +12,21 @@ Base = declarative_base()
 
 class VehicleDatabase(Base):
     __tablename__ = "vehicle_data"
+    __table_args__ = (
+        # Every query filters on vehicle_id then range-scans and sorts on timestamp.
+        # On Postgres the other columns are included so the index covers the whole row.
+        # A vehicle has a single reading per timestamp: the index is the conflict target of the inserts.
+        Index(
+            "ix_vehicle_data_vehicle_id_timestamp",
+            "vehicle_id",
+            "timestamp",
+            unique=True,
+            postgresql_include=["id", "speed", "odometer", "soc", "elevation", "shift_state"],
+        ),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    vehicle_id = Column(String, index=True, nullable=False)
+    vehicle_id = Column(String, nullable=False)
     timestamp = Column(DateTime, index=True)
     speed = Column(Float, nullable=True)
     odometer = Column(Float, nullable=True)
@@ -23,6 +35,134 @@ class VehicleDatabase(Base):
     shift_state = Column(String, nullable=True)
 
 
+class VehicleDataRollupDatabase(Base):
+    """
+    Aggregated vehicle data of a vehicle over a time bucket, at a fixed resolution.
+
+    The columns are mergeable partial aggregates (counts, sums, min/max and first/last odometer),
+    so rollups are updated incrementally as new rows are written.
+    """
+    __tablename__ = "vehicle_data_rollup"
+
+    vehicle_id = Column(String, primary_key=True)
+    # Width of the bucket in seconds
+    resolution = Column(Integer, primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True)
+    count = Column(Integer, nullable=False)
+    speed_count = Column(Integer, nullable=False)
+    speed_sum = Column(Float, nullable=False)
+    speed_min = Column(Float, nullable=True)
+    speed_max = Column(Float, nullable=True)
+    soc_count = Column(Integer, nullable=False)
+    soc_sum = Column(Float, nullable=False)
+    soc_min = Column(Float, nullable=True)
+    soc_max = Column(Float, nullable=True)
+    elevation_count = Column(Integer, nullable=False)
+    elevation_sum = Column(Float, nullable=False)
+    elevation_min = Column(Float, nullable=True)
+    elevation_max = Column(Float, nullable=True)
+    odometer_first_timestamp = Column(DateTime, nullable=True)
+    odometer_first = Column(Float, nullable=True)
+    odometer_last_timestamp = Column(DateTime, nullable=True)
+    odometer_last = Column(Float, nullable=True)
+
+
+class VehicleDataRollupShiftStateDatabase(Base):
+    """
+    Number of readings per shift state of a rollup bucket.
+    """
+    __tablename__ = "vehicle_data_rollup_shift_state"
+
+    vehicle_id = Column(String, primary_key=True)
+    resolution = Column(Integer, primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True)
+    shift_state = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False)
+
+
+class TripDatabase(Base):
+    """
+    A trip of a vehicle: a run of readings in a driving shift state, without gaps longer than the trip gap.
+    """
+    __tablename__ = "trip"
+    __table_args__ = (
+        Index("ix_trip_vehicle_id_start_timestamp", "vehicle_id", "start_timestamp"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    vehicle_id = Column(String, nullable=False)
+    start_timestamp = Column(DateTime, nullable=False)
+    end_timestamp = Column(DateTime, nullable=False)
+    count = Column(Integer, nullable=False)
+    start_odometer = Column(Float, nullable=True)
+    end_odometer = Column(Float, nullable=True)
+    distance = Column(Float, nullable=True)
+    start_soc = Column(Float, nullable=True)
+    end_soc = Column(Float, nullable=True)
+    soc_used = Column(Float, nullable=True)
+    max_speed = Column(Float, nullable=True)
+    avg_speed = Column(Float, nullable=True)
+    start_elevation = Column(Float, nullable=True)
+    end_elevation = Column(Float, nullable=True)
+    elevation_change = Column(Float, nullable=True)
+
+
+class TripSegmentationDatabase(Base):
+    """
+    Progress of the trip segmentation of a vehicle.
+
+    A vehicle without a row has never been segmented. Writes set `dirty_from` to the earliest new
+    timestamp; the trips from there on are segmented again on the next read.
+    """
+    __tablename__ = "trip_segmentation"
+
+    vehicle_id = Column(String, primary_key=True)
+    dirty_from = Column(DateTime, nullable=True)
+
+
+class LatestVehicleStateDatabase(Base):
+    """
+    The newest reading of every vehicle, upserted on every write.
+
+    `updated_at` is the (UTC) time the state last changed, so pollers can fetch only the vehicles
+    updated since their previous poll.
+    """
+    __tablename__ = "latest_vehicle_state"
+
+    vehicle_id = Column(String, primary_key=True)
+    timestamp = Column(DateTime, nullable=False)
+    speed = Column(Float, nullable=True)
+    odometer = Column(Float, nullable=True)
+    soc = Column(Float, nullable=True)
+    elevation = Column(Float, nullable=True)
+    shift_state = Column(String, nullable=True)
+    updated_at = Column(DateTime, nullable=False, index=True)
+
+
+class VehicleDataPartitionDatabase(Base):
+    """
+    A monthly partition of the vehicle data: a table with the columns and indexes of vehicle_data,
+    holding the readings from range_start (included) to range_end (excluded).
+
+    vehicle_data itself stays the default partition, holding the readings without a timestamp
+    and those written before their month had a partition.
+    """
+    __tablename__ = "vehicle_data_partition"
+
+    name = Column(String, primary_key=True)
+    range_start = Column(DateTime, nullable=False, unique=True)
+    range_end = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+
+class SchemaMigrationDatabase(Base):
+    __tablename__ = "schema_migrations"
+
+    version = Column(Integer, primary_key=True)
+    description = Column(String, nullable=False)
+    applied_at = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+
 class SortBy(str, Enum):
     ASC = "ASC"
     DESC = "DESC"
@@ -30,3 +170,42 @@ class SortBy(str, Enum):
 class ExportFormat(str, Enum):
     CSV = "CSV"
     JSON = "JSON"
+    # Newline-delimited JSON, one reading per line
+    NDJSON = "NDJSON"
+    # Columnar binary formats, with typed columns
+    ARROW = "ARROW"
+    PARQUET = "PARQUET"
+
+
+class BucketWidth(str, Enum):
+    ONE_MINUTE = "1m"
+    FIFTEEN_MINUTES = "15m"
+    ONE_HOUR = "1h"
+    ONE_DAY = "1d"
+
+    @property
+    def seconds(self) -> int:
+        return {"1m": 60, "15m": 900, "1h": 3600, "1d": 86400}[self.value]
+
+
+class FillStrategy(str, Enum):
+    # Last known value
+    FFILL = "ffill"
+    # Linear interpolation between the known values around, numeric fields only
+    LINEAR = "linear"
+    # Only a value read within the interval ending at the grid point
+    NONE = "none"
+
+
+class OverflowPolicy(str, Enum):
+    # Drop the oldest queued points of a live subscriber that falls behind
+    DROP_OLDEST = "drop_oldest"
+    # Close the subscription of a live subscriber that falls behind
+    CLOSE = "close"
+
+
+class Durability(str, Enum):
+    # Acknowledge a write-behind reading once it is queued, before it is committed
+    ENQUEUE = "enqueue"
+    # Acknowledge a write-behind reading once the batch holding it is committed
+    COMMIT = "commit"
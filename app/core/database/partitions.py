@@ -0,0 +1,222 @@
+"""
+This module defines the monthly partitions of the vehicle data, and the routing of queries to them.
+
+A partition is a table with the columns and indexes of vehicle_data, holding the readings of one month,
+and registered in vehicle_data_partition. Queries only read vehicle_data and the partitions overlapping
+their time range, and an expired month is dropped a whole table at a time.
+
+The ids of a partition start above a base derived from its month, so ids stay unique across the
+partitions and the partition of an id is known without a lookup.
+"""
+
+import threading
+from datetime import datetime
+from typing import List, Optional, Sequence
+
+from sqlalchemy import BigInteger, Column, Identity, Index, Integer, MetaData, Select, Table, select, text, union_all
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session, aliased
+
+from app.core.database.functions import dialect_insert, to_utc_naive
+from app.core.database.models import VehicleDatabase, VehicleDataPartitionDatabase
+
+
+# Low bits of the ids of a partition, numbering its rows; the high bits hold the month of the partition
+PARTITION_ID_BITS = 32
+
+# Columns covered by the (vehicle_id, timestamp) index on Postgres, as in vehicle_data
+INCLUDED_COLUMNS = [
+    column.name for column in VehicleDatabase.__table__.columns if column.name not in ("vehicle_id", "timestamp")
+]
+
+# The partition tables are defined on demand, apart from Base.metadata so create_all leaves them alone
+partition_metadata = MetaData()
+_partition_lock = threading.Lock()
+
+
+def month_start(timestamp: datetime) -> datetime:
+    """
+    Get the start of the month of a (naive UTC) timestamp, which is the start of its partition.
+    """
+    return to_utc_naive(timestamp).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(start: datetime, months: int) -> datetime:
+    """
+    Get the start of the month `months` after the month starting at `start` (before it if negative).
+    """
+    index = start.year * 12 + start.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(range_start: datetime) -> str:
+    """
+    Get the table name of the partition of a month, e.g. vehicle_data_2022_07.
+    """
+    return f"vehicle_data_{range_start.year:04d}_{range_start.month:02d}"
+
+
+def partition_id_base(range_start: datetime) -> int:
+    """
+    Get the base of the ids of the partition of a month, above every id of vehicle_data.
+    """
+    return (range_start.year * 12 + range_start.month - 1) << PARTITION_ID_BITS
+
+
+def partition_start_of_id(id: int) -> Optional[datetime]:
+    """
+    Get the month of the partition that assigned an id, or None for an id assigned by vehicle_data.
+    """
+    index = id >> PARTITION_ID_BITS
+    if index < 12:
+        return None
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_table(range_start: datetime) -> Table:
+    """
+    Get the table of the partition of a month, with the columns and indexes of vehicle_data.
+    """
+    name = partition_name(range_start)
+    with _partition_lock:
+        table = partition_metadata.tables.get(name)
+        if table is None:
+            table = Table(
+                name,
+                partition_metadata,
+                # SQLite ignores the identity: create_partition seeds its AUTOINCREMENT sequence instead
+                Column(
+                    "id",
+                    BigInteger().with_variant(Integer(), "sqlite"),
+                    Identity(start=partition_id_base(range_start) + 1),
+                    primary_key=True,
+                ),
+                *[
+                    Column(column.name, column.type, nullable=column.nullable)
+                    for column in VehicleDatabase.__table__.columns
+                    if column.name != "id"
+                ],
+                Index(
+                    f"ix_{name}_vehicle_id_timestamp",
+                    "vehicle_id",
+                    "timestamp",
+                    unique=True,
+                    postgresql_include=INCLUDED_COLUMNS,
+                ),
+                Index(f"ix_{name}_timestamp", "timestamp"),
+                sqlite_autoincrement=True,
+            )
+    return table
+
+
+def create_partition(connection: Connection, range_start: datetime) -> Table:
+    """
+    Create and register the partition of a month, if it does not exist yet, without committing.
+
+    Args:
+        connection: The connection of the transaction creating the partition.
+        range_start: The start of the month.
+
+    Returns:
+        The table of the partition.
+    """
+    table = partition_table(range_start)
+    table.create(bind=connection, checkfirst=True)
+
+    if connection.dialect.name == "sqlite":
+        # AUTOINCREMENT ids continue from sqlite_sequence, which starts them above the base of the partition
+        seeded = connection.execute(
+            text("SELECT 1 FROM sqlite_sequence WHERE name = :name"), {"name": table.name}
+        ).first()
+        if seeded is None:
+            connection.execute(
+                text("INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)"),
+                {"name": table.name, "seq": partition_id_base(range_start)},
+            )
+
+    insert = dialect_insert(connection.dialect.name)
+    connection.execute(
+        insert(VehicleDataPartitionDatabase)
+        .values(
+            name=table.name,
+            range_start=range_start,
+            range_end=add_months(range_start, 1),
+            created_at=datetime.utcnow(),
+        )
+        .on_conflict_do_nothing(index_elements=["name"])
+    )
+    return table
+
+
+def build_partitions_statement(
+    initial_timestamp: Optional[datetime] = None,
+    final_timestamp: Optional[datetime] = None,
+) -> Select:
+    """
+    Build the statement selecting the start of the partitions overlapping a time range, in order.
+    """
+    partition = VehicleDataPartitionDatabase
+    statement = select(partition.range_start).order_by(partition.range_start)
+    if initial_timestamp is not None:
+        statement = statement.where(partition.range_end > to_utc_naive(initial_timestamp))
+    if final_timestamp is not None:
+        statement = statement.where(partition.range_start <= to_utc_naive(final_timestamp))
+    return statement
+
+
+def partition_tables(
+    db: Session,
+    initial_timestamp: Optional[datetime] = None,
+    final_timestamp: Optional[datetime] = None,
+) -> List[Table]:
+    """
+    Get the tables that may hold readings of a time range: vehicle_data, then the overlapping partitions.
+    """
+    starts = db.execute(build_partitions_statement(initial_timestamp, final_timestamp)).scalars().all()
+    return [VehicleDatabase.__table__, *[partition_table(start) for start in starts]]
+
+
+def vehicle_data_source(tables: Sequence[Table]):
+    """
+    Get the entity selecting the readings of the given tables, used in place of VehicleDatabase.
+
+    For vehicle_data alone it is VehicleDatabase itself, so the queries are unchanged, and for a single
+    partition it is VehicleDatabase aliased to the partition. Otherwise it is
+    VehicleDatabase aliased to the UNION ALL of the tables: the database pushes the filters of a query
+    down into every table and serves them from its indexes, and merges the index scans of a sorted
+    query (MERGE UNION ALL on SQLite, Merge Append on Postgres). Rows are loaded as VehicleDatabase objects.
+    """
+    if len(tables) == 1:
+        if tables[0] is VehicleDatabase.__table__:
+            return VehicleDatabase
+        return aliased(VehicleDatabase, tables[0], adapt_on_names=True)
+
+    columns = [column.name for column in VehicleDatabase.__table__.columns]
+    partitions = union_all(*[select(*[table.c[column] for column in columns]) for table in tables])
+    return aliased(VehicleDatabase, partitions.subquery("vehicle_data_partitions"))
+
+
+def compact(engine: Engine) -> None:
+    """
+    Reclaim the space freed by dropped partitions and deleted readings, and refresh the planner statistics.
+
+    On SQLite, the first compaction rewrites the database with VACUUM and switches it to incremental
+    auto-vacuum, so the next ones only release its free pages. On Postgres, vehicle_data and every
+    partition are vacuumed one at a time. The statements run outside of a transaction.
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        if connection.dialect.name == "sqlite":
+            if connection.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+                connection.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+                connection.exec_driver_sql("VACUUM")
+            else:
+                # A single execute only frees one page: executescript runs the pragma to completion
+                cursor = connection.connection.cursor()
+                cursor.executescript("PRAGMA incremental_vacuum")
+                cursor.close()
+            connection.exec_driver_sql("PRAGMA optimize")
+            return
+
+        starts = connection.execute(build_partitions_statement()).scalars().all()
+        for table in [VehicleDatabase.__table__, *[partition_table(start) for start in starts]]:
+            connection.exec_driver_sql(f"VACUUM (ANALYZE) {table.name}")
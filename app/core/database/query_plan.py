@@ -0,0 +1,44 @@
+"""
+This module defines helpers to inspect the query plan chosen by the database.
+"""
+
+from typing import List
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Executable
+
+
+def explain_prefix(dialect_name: str) -> str:
+    """
+    Get the statement prefix asking the database for its query plan.
+    """
+    return "EXPLAIN QUERY PLAN " if dialect_name == "sqlite" else "EXPLAIN "
+
+
+def explain(db: Session, statement: Executable) -> List[str]:
+    """
+    Get the query plan of a statement, one line per plan step.
+
+    `EXPLAIN QUERY PLAN` is used on SQLite and `EXPLAIN` on other backends (Postgres).
+
+    Args:
+        db: The database session.
+        statement: The statement to explain, for example `query.statement`.
+
+    Returns:
+        The lines of the query plan.
+    """
+    dialect = db.get_bind().dialect
+
+    # Render with named parameters, so the typed values can be bound again to the EXPLAIN statement
+    compiled = statement.compile(dialect=type(dialect)(paramstyle="named"))
+    bind_types = {name: bind.type for bind, name in compiled.bind_names.items()}
+    plan_statement = text(explain_prefix(dialect.name) + str(compiled)).bindparams(
+        *[bindparam(name, value=value, type_=bind_types[name]) for name, value in compiled.params.items()]
+    )
+
+    rows = db.execute(plan_statement).all()
+
+    # SQLite returns (id, parent, notused, detail) rows, Postgres a single "QUERY PLAN" column
+    return [row[-1] for row in rows]
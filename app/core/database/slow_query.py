@@ -0,0 +1,274 @@
+"""
+This module defines the slow-query log.
+
+Every statement slower than the threshold is logged with its bound parameters, duration and row count.
+A statement is timed from its execution until its result is consumed, fetches included: on SQLite most
+of the work of a SELECT happens while its rows are fetched.
+The query plan of each distinct statement shape is captured once, the first time it is slow, so missing
+indexes and full scans show up without running EXPLAIN by hand.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional
+
+from sqlalchemy.engine import Connection, Engine
+
+from app.core.config import Settings, settings
+from app.core.database.query_plan import explain_prefix
+
+logger = logging.getLogger(__name__)
+
+
+def can_execute(conn: Connection) -> bool:
+    """
+    Tell whether a statement can run on a connection from here.
+
+    The connections of an async engine only run statements from the greenlet of an awaited call, not
+    e.g. when a result left unfinished by an async iterator is closed later.
+    """
+    if not conn.dialect.is_async:
+        return True
+    import greenlet
+
+    # The greenlets of awaited calls switch back to their driver to await the IO
+    return getattr(greenlet.getcurrent(), "driver", None) is not None
+
+
+class TimedCursor:
+    """
+    A DB-API cursor that times its statement until its result is consumed, and counts the rows fetched.
+
+    SQLAlchemy closes the cursor of a result once it is exhausted or closed (or right after the
+    execution of a statement returning no rows), which ends the measure.
+    """
+
+    def __init__(self, cursor: Any, log: "SlowQueryLog", connection: Connection):
+        self._cursor = cursor
+        self._log = log
+        self._connection = connection
+        self._start: Optional[float] = None
+        self._statement: Optional[str] = None
+        self._parameters: Any = None
+        self._executemany = False
+        self._fetched = 0
+
+    def execute(self, statement, parameters=None, *args, **kwargs):
+        self._started(statement, parameters, False)
+        if parameters is None:
+            return self._cursor.execute(statement, *args, **kwargs)
+        return self._cursor.execute(statement, parameters, *args, **kwargs)
+
+    def executemany(self, statement, parameters, *args, **kwargs):
+        self._started(statement, parameters, True)
+        return self._cursor.executemany(statement, parameters, *args, **kwargs)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._fetched += 1
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        self._fetched += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._fetched += len(rows)
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def close(self):
+        try:
+            # Only statements returning rows have a description; the others know their row count
+            if self._cursor.description is not None:
+                rows = self._fetched
+            else:
+                rows = self._cursor.rowcount if self._cursor.rowcount >= 0 else None
+        except Exception:
+            rows = None
+        self._cursor.close()
+        self._finished(rows)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def _started(self, statement: str, parameters: Any, executemany: bool) -> None:
+        # Statements executed in batches on the same cursor (e.g. insertmanyvalues) are timed together
+        if self._start is None:
+            self._start = time.perf_counter()
+        self._statement, self._parameters, self._executemany = statement, parameters, executemany
+
+    def _finished(self, rows: Optional[int]) -> None:
+        if self._start is None:
+            return
+        duration_ms = (time.perf_counter() - self._start) * 1000
+        self._start = None
+        if self._log.enabled and duration_ms >= self._log.threshold_ms:
+            self._log.record(
+                self._connection, self._statement, self._parameters, duration_ms, rows, self._executemany
+            )
+
+
+class SlowQueryLog:
+    """
+    Record the statements slower than `threshold_ms`, and the query plan of their shapes.
+
+    The shape of a statement is its SQL text: the values are bound parameters, so every query of
+    `get_vehicle_data` with the same filters shares a shape whatever the vehicle or range.
+    """
+
+    def __init__(
+        self,
+        threshold_ms: float = 500,
+        size: int = 100,
+        max_plans: int = 256,
+        capture_plans: bool = True,
+    ):
+        self.threshold_ms = threshold_ms
+        self.capture_plans = capture_plans
+        self.max_plans = max_plans
+
+        # Most recent slow queries, oldest first
+        self.queries: Deque[dict] = deque(maxlen=size)
+        # Statement shape -> its plan and slow executions, least recently slow first
+        self.plans: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold_ms > 0
+
+    def instrument(self, engine: Engine) -> None:
+        """
+        Time every statement executed by the engine. For an AsyncEngine, instrument its `sync_engine`.
+
+        The cursors of the engine are created as TimedCursor, by a subclass of the execution context of its dialect.
+        """
+        log = self
+        context_class = engine.dialect.execution_ctx_cls
+
+        class TimedExecutionContext(context_class):
+            def create_cursor(self):
+                return TimedCursor(super().create_cursor(), log, self.root_connection)
+
+        engine.dialect.execution_ctx_cls = TimedExecutionContext
+
+    def record(
+        self,
+        conn: Connection,
+        statement: str,
+        parameters: Any,
+        duration_ms: float,
+        rows: Optional[int],
+        executemany: bool,
+    ) -> None:
+        """
+        Log a slow statement, and capture its query plan if its shape has none yet.
+
+        Args:
+            rows: The number of rows fetched, or affected by a statement returning no rows, None if unknown.
+        """
+        query = {
+            "timestamp": datetime.utcnow(),
+            "statement": statement,
+            "parameters": None if executemany else parameters,
+            "executemany": executemany,
+            "duration_ms": duration_ms,
+            "rows": rows,
+        }
+        logger.warning(
+            "Slow query (%.1f ms, %s rows): %s; parameters: %r",
+            duration_ms, "unknown" if rows is None else rows, statement, query["parameters"],
+        )
+
+        with self._lock:
+            self.queries.append(query)
+            shape = self.plans.get(statement)
+            if shape is None:
+                shape = {"statement": statement, "plan": None, "count": 0, "max_duration_ms": 0.0}
+                self.plans[statement] = shape
+                if len(self.plans) > self.max_plans:
+                    self.plans.popitem(last=False)
+            else:
+                self.plans.move_to_end(statement)
+            shape["count"] += 1
+            shape["max_duration_ms"] = max(shape["max_duration_ms"], duration_ms)
+            needs_plan = shape["plan"] is None
+
+        # Without a plan, the shape gets one the next time it is slow
+        if needs_plan and self.capture_plans and not executemany and can_execute(conn):
+            plan = self.explain(conn, statement, parameters)
+            with self._lock:
+                shape["plan"] = plan
+
+    @staticmethod
+    def explain(conn: Connection, statement: str, parameters: Any) -> List[str]:
+        """
+        Get the query plan of a statement on the connection that ran it, with the same parameters.
+
+        Only SELECT statements are explained. Outside of SQLite, EXPLAIN runs in a savepoint rolled
+        back if it fails: on Postgres a failing statement would abort the transaction of the caller.
+        """
+        if not statement.lstrip().upper().startswith(("SELECT", "WITH")):
+            return []
+
+        savepoint = conn.dialect.name != "sqlite"
+        try:
+            plan_cursor = conn.connection.cursor()
+            try:
+                if savepoint:
+                    plan_cursor.execute("SAVEPOINT slow_query_explain")
+                try:
+                    plan_cursor.execute(explain_prefix(conn.dialect.name) + statement, parameters)
+                    # SQLite returns (id, parent, notused, detail) rows, Postgres a single "QUERY PLAN" column
+                    return [row[-1] for row in plan_cursor.fetchall()]
+                except Exception:
+                    if savepoint:
+                        plan_cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+                    raise
+                finally:
+                    if savepoint:
+                        plan_cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+            finally:
+                plan_cursor.close()
+        except Exception as e:
+            logger.warning("Could not explain slow query: %s", e)
+            return [f"EXPLAIN failed: {e}"]
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Get the recent slow queries, most recent first, and the plans of the slow statement shapes.
+        """
+        with self._lock:
+            return {
+                "threshold_ms": self.threshold_ms,
+                "queries": list(reversed(self.queries)),
+                "plans": [dict(shape) for shape in reversed(self.plans.values())],
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self.queries.clear()
+            self.plans.clear()
+
+
+def create_slow_query_log(settings: Settings) -> SlowQueryLog:
+    """
+    Create the slow-query log described by the settings.
+    """
+    return SlowQueryLog(
+        threshold_ms=settings.slow_query_threshold_ms,
+        size=settings.slow_query_log_size,
+        capture_plans=settings.slow_query_explain,
+    )
+
+
+slow_query_log = create_slow_query_log(settings)
@@ -0,0 +1,384 @@
+"""
+This module defines the hot tier: the recent telemetry of every vehicle, kept in memory.
+
+The points of a vehicle are stored in compact NumPy arrays, one per field, sorted by timestamp.
+A range query within the window of the hot tier is answered by binary search and slicing,
+without touching the database.
+
+The hot tier only sees the writes of its own process: it is meant for a single API worker that
+receives all the writes. With several workers, or when importing with scripts/import_data.py
+while the API runs, leave it disabled.
+"""
+
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Set
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from app.core.config import Settings, settings
+from app.core.database.models import SortBy
+from app.core.database.partitions import partition_tables, vehicle_data_source
+
+
+# Fields of the returned rows, in the order of the VehicleModel fields
+HOT_TIER_FIELDS = ["vehicle_id", "timestamp", "speed", "odometer", "elevation", "soc", "shift_state"]
+
+# Measures stored as float64 arrays, where NaN stands for NULL
+FLOAT_FIELDS = ["speed", "odometer", "elevation", "soc"]
+
+# Shift states are stored as codes into HotTier.shift_states, -1 for NULL
+NULL_CODE = -1
+
+# Id of the points added without their id, which cannot be paged with a cursor
+NULL_ID = -1
+
+INITIAL_CAPACITY = 256
+
+
+def to_datetime64(timestamp: datetime) -> np.datetime64:
+    """
+    Convert a timestamp to a naive UTC datetime64, as stored in the database.
+    """
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return np.datetime64(timestamp, "us")
+
+
+class VehicleSeries:
+    """
+    The recent points of a vehicle and their ids, in arrays sorted by timestamp with the insertion order kept for ties.
+
+    All the points of the vehicle from `covered_from` on are held (all of them when it is None).
+    Arrays are only ever replaced, never shifted in place, so slices taken by readers stay valid.
+    """
+
+    def __init__(self, covered_from: Optional[np.datetime64] = None):
+        self.covered_from = covered_from
+        self.size = 0
+        self.timestamps = np.empty(INITIAL_CAPACITY, dtype="datetime64[us]")
+        self.ids = np.empty(INITIAL_CAPACITY, dtype=np.int64)
+        self.floats = {name: np.empty(INITIAL_CAPACITY, dtype=np.float64) for name in FLOAT_FIELDS}
+        self.shift_states = np.empty(INITIAL_CAPACITY, dtype=np.int16)
+
+    @property
+    def nbytes(self) -> int:
+        return self.timestamps.nbytes + self.ids.nbytes + self.shift_states.nbytes + sum(array.nbytes for array in self.floats.values())
+
+    def extend(
+        self, timestamps: np.ndarray, ids: np.ndarray, floats: Dict[str, np.ndarray], shift_states: np.ndarray
+    ) -> None:
+        """
+        Add points, in any order.
+        """
+        order = np.argsort(timestamps, kind="stable")
+        timestamps, ids, shift_states = timestamps[order], ids[order], shift_states[order]
+        floats = {name: values[order] for name, values in floats.items()}
+        count = len(timestamps)
+
+        # Points newer than the newest one are appended, the others are merged in
+        if self.size and timestamps[0] < self.timestamps[self.size - 1]:
+            self._merge(timestamps, ids, floats, shift_states)
+            return
+
+        if self.size + count > len(self.timestamps):
+            self._resize(max(2 * len(self.timestamps), self.size + count))
+        end = self.size + count
+        self.timestamps[self.size:end] = timestamps
+        self.ids[self.size:end] = ids
+        for name in FLOAT_FIELDS:
+            self.floats[name][self.size:end] = floats[name]
+        self.shift_states[self.size:end] = shift_states
+        self.size = end
+
+    def trim(self, cutoff: np.datetime64) -> None:
+        """
+        Drop the points older than `cutoff`, once they are a quarter of the points.
+
+        Until then they are kept: they are still exact, only older than needed.
+        """
+        index = int(np.searchsorted(self.timestamps[:self.size], cutoff, side="left"))
+        if index == 0 or index < self.size // 4:
+            return
+
+        self.timestamps = self.timestamps[index:self.size].copy()
+        self.ids = self.ids[index:self.size].copy()
+        self.floats = {name: values[index:self.size].copy() for name, values in self.floats.items()}
+        self.shift_states = self.shift_states[index:self.size].copy()
+        self.size -= index
+        self.covered_from = cutoff if self.covered_from is None else max(self.covered_from, cutoff)
+
+    def _merge(
+        self, timestamps: np.ndarray, ids: np.ndarray, floats: Dict[str, np.ndarray], shift_states: np.ndarray
+    ) -> None:
+        # The current points come first, so a stable sort keeps them before new points with the same timestamp
+        merged = np.concatenate([self.timestamps[:self.size], timestamps])
+        order = np.argsort(merged, kind="stable")
+        self.timestamps = merged[order]
+        self.ids = np.concatenate([self.ids[:self.size], ids])[order]
+        self.floats = {
+            name: np.concatenate([self.floats[name][:self.size], floats[name]])[order] for name in FLOAT_FIELDS
+        }
+        self.shift_states = np.concatenate([self.shift_states[:self.size], shift_states])[order]
+        self.size = len(merged)
+
+    def _resize(self, capacity: int) -> None:
+        timestamps = np.empty(capacity, dtype="datetime64[us]")
+        timestamps[:self.size] = self.timestamps[:self.size]
+        self.timestamps = timestamps
+
+        ids = np.empty(capacity, dtype=np.int64)
+        ids[:self.size] = self.ids[:self.size]
+        self.ids = ids
+
+        for name in FLOAT_FIELDS:
+            values = np.empty(capacity, dtype=np.float64)
+            values[:self.size] = self.floats[name][:self.size]
+            self.floats[name] = values
+
+        shift_states = np.empty(capacity, dtype=np.int16)
+        shift_states[:self.size] = self.shift_states[:self.size]
+        self.shift_states = shift_states
+
+
+class HotTier:
+    """
+    The recent points of every vehicle, within `window` of the newest point of each vehicle.
+
+    When the arrays outgrow `max_bytes`, the least recently used vehicles are evicted; their queries
+    go to the database until the hot tier is loaded again.
+    """
+
+    def __init__(self, window: timedelta = timedelta(hours=6), max_bytes: int = 256 * 1024 * 1024, enabled: bool = True):
+        self.window = np.timedelta64(int(window.total_seconds() * 1_000_000), "us")
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        # Queries are only answered once the recent points of the database are loaded
+        self.loaded = False
+
+        self.series: "OrderedDict[str, VehicleSeries]" = OrderedDict()
+        self.evicted: Set[str] = set()
+        self.shift_states: List[str] = []
+        self._shift_state_codes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def load(self, db: Session, chunk_size: int = 10000) -> int:
+        """
+        Load the points within the window of every vehicle from the database.
+
+        Returns:
+            The number of points loaded.
+        """
+        vehicle = vehicle_data_source(partition_tables(db))
+        newest = db.execute(select(vehicle.vehicle_id, func.max(vehicle.timestamp)).group_by(vehicle.vehicle_id)).all()
+
+        with self._lock:
+            self.series.clear()
+            self.evicted.clear()
+
+        total = 0
+        for vehicle_id, newest_timestamp in newest:
+            cutoff = None if newest_timestamp is None else to_datetime64(newest_timestamp) - self.window
+            with self._lock:
+                self.series[vehicle_id] = VehicleSeries(covered_from=cutoff)
+
+            since = None if cutoff is None else cutoff.astype(datetime)
+            vehicle = vehicle_data_source(partition_tables(db, since))
+            statement = (
+                select(*[getattr(vehicle, field) for field in ["id", *HOT_TIER_FIELDS]])
+                .where(vehicle.vehicle_id == vehicle_id, vehicle.timestamp.isnot(None))
+                .order_by(vehicle.timestamp, vehicle.id)
+                .execution_options(yield_per=chunk_size)
+            )
+            if since is not None:
+                statement = statement.where(vehicle.timestamp >= since)
+
+            for rows in db.execute(statement).partitions():
+                rows = [dict(zip(["id", *HOT_TIER_FIELDS], row)) for row in rows]
+                total += len(rows)
+                with self._lock:
+                    self._add(vehicle_id, rows, create=False)
+
+        with self._lock:
+            self._evict()
+            self.loaded = True
+
+        return total
+
+    def add(self, rows: Iterable[dict], returned: Optional[Iterable[tuple]] = None) -> None:
+        """
+        Add newly written rows, as VehicleDatabase column values. Rows without a timestamp are ignored.
+
+        Args:
+            returned: The (id, vehicle_id, timestamp) of the rows returned by their INSERT, giving their
+                ids when the rows have none.
+        """
+        if not (self.enabled and self.loaded):
+            return
+
+        ids = {(vehicle_id, timestamp): id for id, vehicle_id, timestamp in returned or ()}
+        by_vehicle: Dict[str, List[dict]] = {}
+        for row in rows:
+            if row.get("timestamp") is not None:
+                if row.get("id") is None and ids:
+                    row = dict(row, id=ids.get((row["vehicle_id"], row["timestamp"])))
+                by_vehicle.setdefault(row["vehicle_id"], []).append(row)
+
+        with self._lock:
+            for vehicle_id, vehicle_rows in by_vehicle.items():
+                # A vehicle missing from the database at load time has all its points in the hot tier
+                self._add(vehicle_id, vehicle_rows, create=True)
+            self._evict()
+
+    def query(
+        self,
+        vehicle_id: str,
+        initial_timestamp: Optional[datetime] = None,
+        final_timestamp: Optional[datetime] = None,
+        sort_by: Optional[SortBy] = None,
+        limit: Optional[int] = 100,
+        skip: Optional[int] = 0,
+        with_ids: bool = False,
+    ) -> Optional[List[dict]]:
+        """
+        Get the rows of a vehicle in a range, like `get_vehicle_data_rows`, if the hot tier holds the whole range.
+
+        Args:
+            with_ids: Whether to add the id of each row, NULL_ID for the rows added without one, as used by cursors.
+
+        Returns:
+            The rows, in timestamp order (descending with SortBy.DESC), or None when the range has to
+            be read from the database: the range has no start, or starts before the points held.
+        """
+        if not (self.enabled and self.loaded) or vehicle_id is None or initial_timestamp is None:
+            return None
+
+        initial = to_datetime64(initial_timestamp)
+        with self._lock:
+            series = self.series.get(vehicle_id)
+            if series is None or (series.covered_from is not None and initial < series.covered_from):
+                self.misses += 1
+                return None
+            self.series.move_to_end(vehicle_id)
+            self.hits += 1
+
+            timestamps = series.timestamps[:series.size]
+            start = int(np.searchsorted(timestamps, initial, side="left"))
+            end = series.size
+            if final_timestamp is not None:
+                end = int(np.searchsorted(timestamps, to_datetime64(final_timestamp), side="right"))
+            if end <= start:
+                return []
+
+            # Apply the sort, skip and limit on the indices before converting anything
+            indices = range(start, end) if sort_by != SortBy.DESC else range(end - 1, start - 1, -1)
+            indices = indices[skip or 0:]
+            if limit is not None:
+                indices = indices[:limit]
+            if not indices:
+                return []
+            index = slice(indices.start, None if indices.stop < 0 else indices.stop, indices.step)
+
+            columns = {
+                "timestamp": timestamps[index].tolist(),
+                **{name: series.floats[name][index].tolist() for name in FLOAT_FIELDS},
+                "shift_state": series.shift_states[index].tolist(),
+            }
+            if with_ids:
+                columns["id"] = series.ids[index].tolist()
+            shift_states = self.shift_states
+
+        # NaN is the only value not equal to itself
+        for name in FLOAT_FIELDS:
+            columns[name] = [None if value != value else value for value in columns[name]]
+        columns["shift_state"] = [None if code == NULL_CODE else shift_states[code] for code in columns["shift_state"]]
+
+        fields = HOT_TIER_FIELDS + (["id"] if with_ids else [])
+        return [
+            dict(zip(fields, values))
+            for values in zip([vehicle_id] * len(columns["timestamp"]), *[columns[field] for field in fields[1:]])
+        ]
+
+    def clear(self) -> None:
+        with self._lock:
+            self.series.clear()
+            self.evicted.clear()
+            self.loaded = False
+
+    @property
+    def nbytes(self) -> int:
+        return sum(series.nbytes for series in self.series.values())
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "vehicles": len(self.series),
+                "points": sum(series.size for series in self.series.values()),
+                "bytes": self.nbytes,
+            }
+
+    def _add(self, vehicle_id: str, rows: List[dict], create: bool) -> None:
+        """
+        Add the rows of a vehicle. The lock must be held.
+        """
+        series = self.series.get(vehicle_id)
+        if series is None:
+            if not create or vehicle_id in self.evicted:
+                return
+            series = self.series[vehicle_id] = VehicleSeries()
+        self.series.move_to_end(vehicle_id)
+
+        series.extend(
+            np.array([to_datetime64(row["timestamp"]) for row in rows], dtype="datetime64[us]"),
+            np.array([NULL_ID if row.get("id") is None else row["id"] for row in rows], dtype=np.int64),
+            {
+                name: np.array([np.nan if row.get(name) is None else row[name] for row in rows], dtype=np.float64)
+                for name in FLOAT_FIELDS
+            },
+            np.array([self._shift_state_code(row.get("shift_state")) for row in rows], dtype=np.int16),
+        )
+        series.trim(series.timestamps[series.size - 1] - self.window)
+
+    def _shift_state_code(self, shift_state: Optional[str]) -> int:
+        if shift_state is None:
+            return NULL_CODE
+        code = self._shift_state_codes.get(shift_state)
+        if code is None:
+            code = self._shift_state_codes[shift_state] = len(self.shift_states)
+            self.shift_states.append(shift_state)
+        return code
+
+    def _evict(self) -> None:
+        """
+        Evict the least recently used vehicles until the arrays fit in the budget. The lock must be held.
+        """
+        total = self.nbytes
+        while total > self.max_bytes and self.series:
+            vehicle_id, series = self.series.popitem(last=False)
+            self.evicted.add(vehicle_id)
+            total -= series.nbytes
+            self.evictions += 1
+
+
+def create_hot_tier(settings: Settings) -> HotTier:
+    """
+    Create the hot tier described by the settings.
+    """
+    return HotTier(
+        window=timedelta(hours=settings.hot_tier_window_hours),
+        max_bytes=settings.hot_tier_max_bytes,
+        enabled=settings.hot_tier_enabled,
+    )
+
+
+hot_tier = create_hot_tier(settings)
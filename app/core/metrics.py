@@ -0,0 +1,356 @@
+"""
+This module defines the application metrics, exposed in the Prometheus text format.
+
+The metrics are kept in process: recording a value is a dictionary lookup and an addition under a lock,
+so the instrumentation costs little on the hot path. With several workers, each one has its own metrics.
+"""
+
+import bisect
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.routing import Match
+
+
+# Latency buckets in seconds, from sub-millisecond statements to slow exports
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels) + "}"
+
+
+class Registry:
+    """
+    The set of metrics rendered by the /metrics endpoint.
+    """
+
+    def __init__(self):
+        self.metrics: List["Metric"] = []
+
+    def register(self, metric: "Metric") -> None:
+        self.metrics.append(metric)
+
+    def render(self) -> str:
+        """
+        Render every metric in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class Metric(ABC):
+    """
+    Base of the metric types. A metric holds one child per combination of label values.
+    """
+
+    type = ""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        registry: Optional[Registry] = REGISTRY,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *labelvalues: str):
+        """
+        Get the child of the metric for the given label values, in the order of the label names.
+        """
+        child = self._children.get(labelvalues)
+        if child is None:
+            if len(labelvalues) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects the labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(labelvalues, self._new_child())
+        return child
+
+    @abstractmethod
+    def _new_child(self):
+        """
+        Create the child of a new combination of label values.
+        """
+
+    def _items(self):
+        with self._lock:
+            return [(list(zip(self.labelnames, labelvalues)), child) for labelvalues, child in self._children.items()]
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        """
+        Get the sample lines of every child, in the Prometheus text format.
+        """
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Counter(Metric):
+    """
+    A value that only goes up, e.g. a number of requests.
+    """
+
+    type = "counter"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1) -> None:
+        """
+        Increment the counter of a metric without labels.
+        """
+        self.labels().inc(amount)
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(labels)} {_format_value(child.value)}" for labels, child in self._items()]
+
+
+class Gauge(Counter):
+    """
+    A value that goes up and down, e.g. a number of requests in progress.
+    """
+
+    type = "gauge"
+
+    def dec(self, amount: float = 1) -> None:
+        """
+        Decrement the gauge of a metric without labels.
+        """
+        self.labels().dec(amount)
+
+    def set(self, value: float) -> None:
+        """
+        Set the gauge of a metric without labels.
+        """
+        self.labels().set(value)
+
+
+class _HistogramValue:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class Histogram(Metric):
+    """
+    The distribution of observed values (e.g. latencies) over fixed buckets.
+    """
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = HTTP_BUCKETS,
+        registry: Optional[Registry] = REGISTRY,
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        """
+        Observe a value of a metric without labels.
+        """
+        self.labels().observe(value)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for labels, child in self._items():
+            with child._lock:
+                counts, total = list(child.counts), child.sum
+
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                bucket_labels = _format_labels(labels + [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "Number of HTTP requests by route and status.", ["method", "route", "status"]
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Latency of the HTTP requests by route, until the last byte is sent.",
+    ["method", "route"],
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "Number of HTTP requests being served by route.", ["method", "route"]
+)
+SQL_STATEMENT_DURATION = Histogram(
+    "db_statement_duration_seconds", "Execution time of the SQL statements by operation.", ["operation"],
+    buckets=SQL_BUCKETS,
+)
+SQL_ROWS_WRITTEN = Counter(
+    "db_rows_written_total", "Number of rows inserted, updated or deleted by operation.", ["operation"]
+)
+ROWS_RETURNED = Counter(
+    "vehicle_data_rows_returned_total", "Number of vehicle data rows read from the database by the queries."
+)
+ROWS_EXPORTED = Counter(
+    "vehicle_data_rows_exported_total", "Number of vehicle data rows exported by format.", ["format"]
+)
+LIVE_SUBSCRIPTIONS = Gauge(
+    "live_subscriptions", "Number of open live telemetry subscriptions."
+)
+LIVE_POINTS_PUBLISHED = Counter(
+    "live_points_published_total", "Number of points queued to live telemetry subscribers."
+)
+LIVE_POINTS_DROPPED = Counter(
+    "live_points_dropped_total", "Number of points dropped from the queues of slow live telemetry subscribers."
+)
+WRITE_BEHIND_QUEUE_DEPTH = Gauge(
+    "write_behind_queue_depth", "Number of readings queued by the write-behind buffer, waiting to be committed."
+)
+WRITE_BEHIND_FLUSH_DURATION = Histogram(
+    "write_behind_flush_duration_seconds", "Time to write and commit a batch of the write-behind buffer.",
+    buckets=SQL_BUCKETS,
+)
+WRITE_BEHIND_LATENCY = Histogram(
+    "write_behind_latency_seconds", "Time from queueing a reading in the write-behind buffer to its commit.",
+    buckets=SQL_BUCKETS,
+)
+WRITE_BEHIND_ROWS = Counter(
+    "write_behind_rows_total", "Number of readings flushed by the write-behind buffer by outcome.", ["outcome"]
+)
+
+
+def _operation(statement: str) -> str:
+    """
+    Get the operation of a SQL statement (SELECT, INSERT...), its first keyword.
+    """
+    words = statement.split(None, 1)
+    return words[0].upper() if words else ""
+
+
+def instrument_engine(engine: Engine) -> None:
+    """
+    Time every statement executed by the engine, and count the rows it writes.
+
+    For an AsyncEngine, instrument its `sync_engine`.
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._metrics_start
+        operation = _operation(statement)
+        SQL_STATEMENT_DURATION.labels(operation).observe(elapsed)
+
+        # The DB-API only gives the row count of writes; rows read are counted as they are fetched
+        if operation in ("INSERT", "UPDATE", "DELETE") and cursor.rowcount > 0:
+            SQL_ROWS_WRITTEN.labels(operation).inc(cursor.rowcount)
+
+
+def route_template(scope: dict) -> str:
+    """
+    Get the path template of the route matching a request (e.g. /api/v1/vehicle_data/{id}/).
+
+    Requests matching no route share a single label, so the number of label values stays bounded.
+    """
+    app = scope.get("app")
+    for route in getattr(app, "routes", ()):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording the latency, the status and the number in progress of the HTTP requests per route.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = route_template(scope)
+        in_progress = HTTP_REQUESTS_IN_PROGRESS.labels(method, route)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_progress.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_REQUEST_DURATION.labels(method, route).observe(time.perf_counter() - start)
+            HTTP_REQUESTS.labels(method, route, str(status)).inc()
+            in_progress.dec()
@@ -0,0 +1,231 @@
+"""
+This module defines the in-process fan-out of new vehicle data to live subscribers.
+
+Writers publish the rows they committed, and every subscriber of a vehicle gets them queued. Each
+subscriber has its own bounded queue: a subscriber that falls behind loses its oldest points (or its
+subscription), it never slows down the writers or the other subscribers.
+
+The broker only sees the writes of its own process: with several API workers, a subscriber only
+gets the points written through its worker, and writes from scripts/import_data.py are not pushed.
+"""
+
+import asyncio
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from app.core.config import Settings, settings
+from app.core.database.models import OverflowPolicy
+from app.core.metrics import LIVE_POINTS_DROPPED, LIVE_POINTS_PUBLISHED, LIVE_SUBSCRIPTIONS
+
+
+# Fields of the pushed points, in the order of the VehicleModel fields
+POINT_FIELDS = ["vehicle_id", "timestamp", "speed", "odometer", "elevation", "soc", "shift_state"]
+
+
+def _to_point(row: dict) -> dict:
+    """
+    Get the pushed point of a row, with its timestamp as a naive UTC datetime, as stored in the database.
+    """
+    point = {field: row.get(field) for field in POINT_FIELDS}
+    timestamp = point["timestamp"]
+    if isinstance(timestamp, datetime) and timestamp.tzinfo is not None:
+        point["timestamp"] = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return point
+
+
+class Subscription:
+    """
+    The queue of new points of a subscriber, consumed by the event loop it was created on.
+
+    Points are pushed from any thread, and the consumer is woken at most once per batch.
+    """
+
+    def __init__(self, vehicle_ids: Iterable[str], max_queue: int, overflow: OverflowPolicy):
+        self.vehicle_ids = frozenset(vehicle_ids)
+        self.max_queue = max_queue
+        self.overflow = overflow
+        # Points dropped since the last batch, reported with the next one
+        self.dropped = 0
+        self.closed = False
+        # Whether the subscription was closed because the subscriber fell behind
+        self.overflowed = False
+
+        self._queue: deque = deque(maxlen=max_queue)
+        self._lock = threading.Lock()
+        self._loop = asyncio.get_running_loop()
+        self._ready = asyncio.Event()
+        self._woken = False
+
+    def push(self, points: List[dict]) -> None:
+        """
+        Queue new points, from any thread.
+        """
+        with self._lock:
+            if self.closed:
+                return
+            excess = len(self._queue) + len(points) - self.max_queue
+            if excess > 0 and self.overflow == OverflowPolicy.CLOSE:
+                self._queue.clear()
+                self.closed = self.overflowed = True
+            else:
+                # The deque drops its oldest points beyond max_queue
+                self._queue.extend(points)
+                if excess > 0:
+                    self.dropped += excess
+                    LIVE_POINTS_DROPPED.inc(excess)
+            wake, self._woken = not self._woken, True
+
+        if wake:
+            self._wake()
+
+    def close(self) -> None:
+        """
+        Close the subscription: the consumer gets the points still queued, then None.
+        """
+        with self._lock:
+            self.closed = True
+            self._woken = True
+        self._wake()
+
+    def _wake(self) -> None:
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+
+        if running is self._loop:
+            self._ready.set()
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:
+            # The event loop of the subscriber is closed
+            pass
+
+    async def next_batch(self, max_batch: int, linger: float = 0) -> Optional[Tuple[List[dict], int]]:
+        """
+        Wait for the next batch of points.
+
+        Args:
+            max_batch: The maximum number of points of the batch.
+            linger: How long to wait, once a point arrived, for more points to batch with it (seconds).
+
+        Returns:
+            The points of the batch and the number of points dropped before them, or None once the
+            subscription is closed and drained.
+        """
+        while True:
+            with self._lock:
+                if self._queue or self.closed:
+                    break
+                self._ready.clear()
+                self._woken = False
+            await self._ready.wait()
+
+        # Let a burst of writes accumulate, instead of sending one message per write
+        if linger > 0 and not self.closed and len(self._queue) < max_batch:
+            await asyncio.sleep(linger)
+
+        with self._lock:
+            if not self._queue and self.closed:
+                return None
+            points = [self._queue.popleft() for _ in range(min(max_batch, len(self._queue)))]
+            dropped, self.dropped = self.dropped, 0
+        return points, dropped
+
+
+class Broker:
+    """
+    Fan out the rows written in this process to the subscribers of their vehicle.
+    """
+
+    def __init__(
+        self,
+        max_queue: int = 10000,
+        overflow: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+    ):
+        """
+        Args:
+            max_queue: The maximum number of points queued per subscriber.
+            overflow: What to do with a subscriber whose queue is full.
+        """
+        self.max_queue = max_queue
+        self.overflow = OverflowPolicy(overflow)
+        # Subscriptions per vehicle ID
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._subscriptions: Set[Subscription] = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, vehicle_ids: Iterable[str]) -> Subscription:
+        """
+        Subscribe to the new points of vehicles, from a coroutine running on the consumer's event loop.
+        """
+        subscription = Subscription(vehicle_ids, self.max_queue, self.overflow)
+        with self._lock:
+            self._subscriptions.add(subscription)
+            for vehicle_id in subscription.vehicle_ids:
+                self._subscribers.setdefault(vehicle_id, set()).add(subscription)
+        LIVE_SUBSCRIPTIONS.inc()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """
+        Remove a subscription, and close it.
+        """
+        subscription.close()
+        with self._lock:
+            if subscription not in self._subscriptions:
+                return
+            self._subscriptions.discard(subscription)
+            for vehicle_id in subscription.vehicle_ids:
+                subscribers = self._subscribers[vehicle_id]
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[vehicle_id]
+        LIVE_SUBSCRIPTIONS.dec()
+
+    def publish(self, rows: Iterable[dict]) -> None:
+        """
+        Queue committed rows of vehicle data to the subscribers of their vehicle.
+
+        Args:
+            rows: Dictionaries of VehicleDatabase column values.
+        """
+        # Writers pay a single check while nobody is subscribed
+        if not self._subscribers:
+            return
+
+        points: Dict[str, List[dict]] = {}
+        for row in rows:
+            if row["vehicle_id"] in self._subscribers:
+                points.setdefault(row["vehicle_id"], []).append(_to_point(row))
+        if not points:
+            return
+
+        with self._lock:
+            targets = [(list(self._subscribers.get(vehicle_id, ())), batch) for vehicle_id, batch in points.items()]
+
+        # Every subscriber shares the same point dictionaries, which are only read
+        for subscribers, batch in targets:
+            for subscription in subscribers:
+                subscription.push(batch)
+                LIVE_POINTS_PUBLISHED.inc(len(batch))
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get the number of subscriptions and of subscribed vehicles.
+        """
+        with self._lock:
+            return {"subscriptions": len(self._subscriptions), "vehicles": len(self._subscribers)}
+
+
+def create_broker(settings: Settings) -> Broker:
+    """
+    Create the broker described by the settings.
+    """
+    return Broker(max_queue=settings.live_queue_size, overflow=settings.live_overflow)
+
+
+broker = create_broker(settings)
@@ -0,0 +1,227 @@
+"""
+This module generates synthetic fleet telemetry, shaped after the sample CSV files in data/.
+
+The generator is lazy and seeded: N vehicles x M points are produced chunk by chunk, so tens of
+millions of rows never have to fit in memory, and two runs with the same seed give the same rows.
+"""
+
+import csv
+import glob
+import os
+import random
+import statistics
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional
+
+# Format of the timestamps of the data/ CSV files
+CSV_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+CSV_FIELDS = ["timestamp", "speed", "odometer", "soc", "elevation", "shift_state"]
+
+
+@dataclass
+class FleetProfile:
+    """
+    The shape of the telemetry of a vehicle: sampling interval, value ranges and missing values.
+    """
+    # Median seconds between two readings
+    interval: float = 5.0
+    # Share of the readings without each column
+    null_rates: Dict[str, float] = field(default_factory=lambda: {"speed": 0.25, "shift_state": 0.25})
+    # Frequency of each shift state among the readings that have one
+    shift_states: Dict[str, float] = field(default_factory=lambda: {"D": 0.8, "P": 0.15, "R": 0.05})
+    speed_mean: float = 40.0
+    speed_stdev: float = 20.0
+    speed_max: float = 130.0
+    soc_min: float = 20.0
+    soc_max: float = 95.0
+    elevation_min: float = 0.0
+    elevation_max: float = 100.0
+    odometer_min: float = 30000.0
+    odometer_max: float = 50000.0
+    start: datetime = datetime(2022, 7, 12, 16, 0, 0)
+
+    @classmethod
+    def from_csv_files(cls, paths: List[str]) -> "FleetProfile":
+        """
+        Derive a profile from CSV files in the format of data/*.csv.
+        """
+        intervals, speeds, socs, elevations, odometers, timestamps = [], [], [], [], [], []
+        nulls = {name: 0 for name in CSV_FIELDS}
+        shift_states: Dict[str, int] = {}
+        count = 0
+
+        for path in paths:
+            with open(path, "r") as csv_file:
+                rows = list(csv.DictReader(csv_file))
+            count += len(rows)
+
+            for row in rows:
+                for name in CSV_FIELDS:
+                    if row[name] == "NULL":
+                        nulls[name] += 1
+                if row["speed"] != "NULL":
+                    speeds.append(float(row["speed"]))
+                if row["soc"] != "NULL":
+                    socs.append(float(row["soc"]))
+                if row["elevation"] != "NULL":
+                    elevations.append(float(row["elevation"]))
+                if row["odometer"] != "NULL":
+                    odometers.append(float(row["odometer"]))
+                if row["shift_state"] != "NULL":
+                    shift_states[row["shift_state"]] = shift_states.get(row["shift_state"], 0) + 1
+
+            # The files are not in time order
+            times = sorted(
+                datetime.strptime(row["timestamp"], CSV_TIMESTAMP_FORMAT) for row in rows if row["timestamp"] != "NULL"
+            )
+            timestamps.extend(times)
+            intervals.extend((later - earlier).total_seconds() for earlier, later in zip(times, times[1:]))
+
+        if not count:
+            return cls()
+
+        total_shift_states = sum(shift_states.values())
+        return cls(
+            interval=max(statistics.median(intervals), 0.1) if intervals else cls.interval,
+            null_rates={name: nulls[name] / count for name in CSV_FIELDS if nulls[name]},
+            shift_states={state: n / total_shift_states for state, n in shift_states.items()} or cls().shift_states,
+            speed_mean=statistics.mean(speeds) if speeds else cls.speed_mean,
+            speed_stdev=statistics.pstdev(speeds) if len(speeds) > 1 else cls.speed_stdev,
+            speed_max=max(speeds) if speeds else cls.speed_max,
+            soc_min=min(socs) if socs else cls.soc_min,
+            soc_max=max(socs) if socs else cls.soc_max,
+            elevation_min=min(elevations) if elevations else cls.elevation_min,
+            elevation_max=max(elevations) if elevations else cls.elevation_max,
+            odometer_min=min(odometers) if odometers else cls.odometer_min,
+            odometer_max=max(odometers) if odometers else cls.odometer_max,
+            start=min(timestamps) if timestamps else cls.start,
+        )
+
+    @classmethod
+    def from_directory(cls, directory: str = "data") -> "FleetProfile":
+        """
+        Derive a profile from the CSV files of a directory, or use the defaults if there are none.
+        """
+        return cls.from_csv_files(sorted(glob.glob(os.path.join(directory, "*.csv"))))
+
+
+class FleetGenerator:
+    """
+    Generate the telemetry of `vehicles` vehicles with `points` readings each.
+
+    Every vehicle follows a random walk: it alternates between driving and parked sessions, its
+    odometer grows with the distance driven, its soc drains while driving and its elevation drifts.
+    """
+
+    def __init__(self, vehicles: int, points: int, profile: Optional[FleetProfile] = None, seed: int = 0):
+        self.vehicles = vehicles
+        self.points = points
+        self.profile = profile or FleetProfile()
+        self.seed = seed
+
+    @property
+    def total(self) -> int:
+        return self.vehicles * self.points
+
+    def vehicle_ids(self) -> List[str]:
+        """
+        Get the IDs of the generated vehicles, stable for a seed.
+        """
+        rng = random.Random(self.seed)
+        return [str(uuid.UUID(int=rng.getrandbits(128), version=4)) for _ in range(self.vehicles)]
+
+    def vehicle_rows(self, vehicle_id: str, index: int = 0) -> Iterator[dict]:
+        """
+        Generate the readings of a vehicle, in time order, as VehicleDatabase column values.
+        """
+        profile = self.profile
+        rng = random.Random(f"{self.seed}:{index}")
+        states = list(profile.shift_states)
+        weights = list(profile.shift_states.values())
+
+        timestamp = profile.start + timedelta(seconds=rng.uniform(0, profile.interval * 10))
+        odometer = rng.uniform(profile.odometer_min, profile.odometer_max)
+        soc = rng.uniform((profile.soc_min + profile.soc_max) / 2, profile.soc_max)
+        elevation = rng.uniform(profile.elevation_min, profile.elevation_max)
+        shift_state = rng.choices(states, weights)[0]
+        speed = 0.0
+
+        for _ in range(self.points):
+            interval = rng.expovariate(1 / profile.interval)
+            timestamp += timedelta(seconds=interval)
+
+            # Shift states last for a while: change with a small probability at every reading
+            if rng.random() < 0.02:
+                shift_state = rng.choices(states, weights)[0]
+
+            if shift_state in ("D", "R"):
+                speed = min(max(rng.gauss(profile.speed_mean, profile.speed_stdev), 0.0), profile.speed_max)
+                distance = speed * interval / 3600
+                odometer += distance
+                soc = max(soc - distance * 0.2, profile.soc_min)
+            else:
+                speed = 0.0
+                # Parked vehicles charge back up
+                soc = min(soc + rng.random() * 0.05, profile.soc_max)
+            elevation = min(max(elevation + rng.gauss(0, 0.5), profile.elevation_min), profile.elevation_max)
+
+            yield {
+                "vehicle_id": vehicle_id,
+                "timestamp": timestamp,
+                "speed": None if self._is_null(rng, "speed") else round(speed),
+                "odometer": None if self._is_null(rng, "odometer") else round(odometer, 1),
+                "soc": None if self._is_null(rng, "soc") else round(soc),
+                "elevation": None if self._is_null(rng, "elevation") else round(elevation),
+                "shift_state": None if self._is_null(rng, "shift_state") else shift_state,
+            }
+
+    def rows(self) -> Iterator[dict]:
+        """
+        Generate the readings of the whole fleet, vehicle after vehicle.
+        """
+        for index, vehicle_id in enumerate(self.vehicle_ids()):
+            yield from self.vehicle_rows(vehicle_id, index)
+
+    def chunks(self, chunk_size: int = 5000) -> Iterator[List[dict]]:
+        """
+        Generate the readings of the whole fleet, `chunk_size` at a time.
+        """
+        chunk = []
+        for row in self.rows():
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def write_csv_files(self, directory: str) -> List[str]:
+        """
+        Write one CSV file per vehicle in the format of data/*.csv, as read by scripts/import_data.py.
+
+        Returns:
+            The paths of the written files.
+        """
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+
+        for index, vehicle_id in enumerate(self.vehicle_ids()):
+            path = os.path.join(directory, f"{vehicle_id}.csv")
+            with open(path, "w", newline="") as csv_file:
+                writer = csv.writer(csv_file)
+                writer.writerow(CSV_FIELDS)
+                for row in self.vehicle_rows(vehicle_id, index):
+                    writer.writerow(
+                        [
+                            row["timestamp"].strftime(CSV_TIMESTAMP_FORMAT)[:-3],
+                            *("NULL" if row[name] is None else row[name] for name in CSV_FIELDS[1:]),
+                        ]
+                    )
+            paths.append(path)
+
+        return paths
+
+    def _is_null(self, rng: random.Random, name: str) -> bool:
+        return rng.random() < self.profile.null_rates.get(name, 0)
@@ -0,0 +1,308 @@
+"""
+Service-level benchmark suite.
+
+Generates a synthetic fleet, then times the importer, the ingest path, the read queries of
+VehicleDataService (range, sort, pagination) and ExporterService. The results are written as JSON,
+and can be compared with the results of a previous run:
+
+    python benchmarks/suite.py --vehicles 10 --points 100000 --output results.json
+    python benchmarks/suite.py --vehicles 10 --points 100000 --compare results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import sqlalchemy
+from sqlalchemy import create_engine, delete
+from sqlalchemy.orm import sessionmaker
+
+from app.api.services.exporter_service import ExporterService
+from app.api.services.vehicle_data_service import VehicleDataService
+from app.core.cache import query_cache
+from app.core.config import settings
+from app.core.database.database import engine_options, set_sqlite_pragmas
+from app.core.database.models import Base, ExportFormat, SortBy, VehicleDatabase
+from benchmarks.fleet import FleetGenerator, FleetProfile
+from scripts.import_data import drop_data, import_files
+
+
+class BenchmarkSuite:
+    """
+    Run the benchmarks against a database and collect their timings.
+    """
+
+    def __init__(self, session_factory: Callable, fleet: FleetGenerator, repeat: int = 3, workers: int = 1):
+        self.session_factory = session_factory
+        self.fleet = fleet
+        self.repeat = repeat
+        self.workers = workers
+        self.results: Dict[str, dict] = {}
+
+    def measure(self, name: str, function: Callable[[], int], repeat: Optional[int] = None) -> dict:
+        """
+        Time `function`, which returns the number of rows it handled, and record the result.
+
+        The best of `repeat` runs is the reference timing, as the least disturbed by other processes.
+        """
+        timings, rows = [], 0
+        for _ in range(repeat or self.repeat):
+            start = time.perf_counter()
+            rows = function()
+            timings.append(time.perf_counter() - start)
+
+        best = min(timings)
+        result = {
+            "seconds": best,
+            "median_seconds": statistics.median(timings),
+            "runs": len(timings),
+            "rows": rows,
+            "rows_per_second": rows / best if best > 0 else None,
+        }
+        self.results[name] = result
+        print(f"{name:<40} {best:>10.4f}s {rows:>12} rows")
+        return result
+
+    def run_import(self, directory: str) -> None:
+        """
+        Time scripts/import_data.py on the fleet written as CSV files.
+        """
+        paths = self.fleet.write_csv_files(directory)
+
+        def run() -> int:
+            drop_data(self.session_factory)
+            return import_files(paths, workers=self.workers, session_factory=self.session_factory)
+
+        # Every run drops and reimports the whole fleet
+        self.measure("import.csv_files", run, repeat=1)
+
+    def run_ingest(self) -> None:
+        """
+        Time the ingest paths of VehicleDataService on a vehicle that is not part of the fleet.
+        """
+        generator = FleetGenerator(1, min(self.fleet.points, 50000), self.fleet.profile, seed=self.fleet.seed + 1)
+        rows = list(generator.rows())
+        vehicle_id = rows[0]["vehicle_id"]
+
+        def clear() -> None:
+            db = self.session_factory()
+            db.execute(delete(VehicleDatabase).where(VehicleDatabase.vehicle_id == vehicle_id))
+            db.commit()
+            db.close()
+
+        def bulk() -> int:
+            clear()
+            db = self.session_factory()
+            service = VehicleDataService(db)
+            inserted = sum(service.add_vehicle_data_bulk(rows[i:i + 5000]) for i in range(0, len(rows), 5000))
+            db.close()
+            return inserted
+
+        def single() -> int:
+            clear()
+            count = min(len(rows), 1000)
+            for row in rows[:count]:
+                # add_vehicle_data closes its session after every write
+                VehicleDataService(self.session_factory()).add_vehicle_data(VehicleDatabase(**row))
+            return count
+
+        self.measure("ingest.bulk_5000", bulk, repeat=1)
+        self.measure("ingest.single_row", single, repeat=1)
+        clear()
+
+    def run_queries(self) -> None:
+        """
+        Time VehicleDataService.get_vehicle_data and its paginated variants on a vehicle of the fleet.
+        """
+        vehicle_id = self.fleet.vehicle_ids()[0]
+        db = self.session_factory()
+        service = VehicleDataService(db)
+
+        # A window of about 10% of the readings of the vehicle, in the middle of its history
+        span = timedelta(seconds=self.fleet.profile.interval * self.fleet.points)
+        initial_timestamp = self.fleet.profile.start + span * 0.45
+        final_timestamp = self.fleet.profile.start + span * 0.55
+
+        def query(**kwargs) -> Callable[[], int]:
+            return lambda: len(service.get_vehicle_data(vehicle_id=vehicle_id, **kwargs))
+
+        self.measure("query.range", query(initial_timestamp=initial_timestamp, final_timestamp=final_timestamp, limit=None))
+        self.measure("query.range_rows", lambda: len(service.get_vehicle_data_rows(
+            vehicle_id=vehicle_id, initial_timestamp=initial_timestamp, final_timestamp=final_timestamp, limit=None
+        )))
+        self.measure("query.sort_asc_100", query(sort_by=SortBy.ASC, limit=100))
+        self.measure("query.sort_desc_100", query(sort_by=SortBy.DESC, limit=100))
+        self.measure("query.deep_offset_100", query(sort_by=SortBy.ASC, limit=100, skip=self.fleet.points * 9 // 10))
+
+        def walk_pages(pages: int = 50) -> int:
+            total, cursor = 0, None
+            for _ in range(pages):
+                vehicles, cursor = service.get_vehicle_data_page(
+                    vehicle_id=vehicle_id, sort_by=SortBy.ASC, limit=100, cursor=cursor
+                )
+                total += len(vehicles)
+                if not cursor:
+                    break
+            return total
+
+        self.measure("query.cursor_50_pages", walk_pages)
+        db.close()
+
+    def run_exports(self) -> None:
+        """
+        Time ExporterService on all the readings of a vehicle of the fleet, read from a server-side cursor.
+        """
+        vehicle_id = self.fleet.vehicle_ids()[0]
+        sizes: Dict[ExportFormat, int] = {}
+
+        for export_format in ExportFormat:
+            def export() -> int:
+                db = self.session_factory()
+                vehicle_data = VehicleDataService(db).stream_vehicle_data(vehicle_id=vehicle_id, sort_by=SortBy.ASC)
+                sizes[export_format] = len(ExporterService.export(vehicle_data, export_format))
+                db.close()
+                return self.fleet.points
+
+            result = self.measure(f"export.{export_format.value.lower()}", export)
+            result["bytes"] = sizes[export_format]
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float) -> List[str]:
+    """
+    Print the timings of a run next to a baseline run.
+
+    Returns:
+        The names of the benchmarks more than `threshold` times slower than the baseline.
+    """
+    regressions = []
+    print(f"\n{'benchmark':<40} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result["seconds"] / baseline[name]["seconds"] if baseline[name]["seconds"] else float("inf")
+        flag = " REGRESSION" if ratio > threshold else ""
+        print(f"{name:<40} {baseline[name]['seconds']:>9.4f}s {result['seconds']:>9.4f}s {ratio:>6.2f}x{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """
+    Parse the command line arguments of the benchmark suite.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the vehicle data services on a synthetic fleet.")
+    parser.add_argument("--vehicles", type=int, default=3, help="Number of vehicles of the fleet.")
+    parser.add_argument("--points", type=int, default=10000, help="Number of readings per vehicle.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the fleet generator.")
+    parser.add_argument("--profile-directory", default="data", help="CSV files the fleet is shaped after.")
+    parser.add_argument("--database-url", help="Database to run on, by default a temporary SQLite file.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per benchmark, the best one is kept.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="CSV parser processes of the importer.")
+    parser.add_argument(
+        "--benchmarks", nargs="+", default=["import", "ingest", "query", "export"],
+        choices=["import", "ingest", "query", "export"], help="Benchmarks to run.",
+    )
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--compare", help="Compare the results with those of this JSON file.")
+    parser.add_argument("--threshold", type=float, default=1.2, help="Slowdown ratio reported as a regression.")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+
+    # Measure the database, not the result cache
+    cache_enabled, query_cache.enabled = query_cache.enabled, False
+    try:
+        return run(args)
+    finally:
+        query_cache.enabled = cache_enabled
+
+
+def run(args: argparse.Namespace) -> int:
+    """
+    Run the benchmarks selected by the command line arguments, and report their results.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        database_url = args.database_url or f"sqlite:///{os.path.join(directory, 'benchmark.db')}"
+        engine = create_engine(database_url, **engine_options(database_url, settings))
+        set_sqlite_pragmas(engine, settings)
+        Base.metadata.create_all(bind=engine)
+        session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+        fleet = FleetGenerator(
+            args.vehicles, args.points, FleetProfile.from_directory(args.profile_directory), seed=args.seed
+        )
+        suite = BenchmarkSuite(session_factory, fleet, repeat=args.repeat, workers=args.workers)
+
+        print(f"Fleet of {args.vehicles} vehicles x {args.points} readings on {engine.dialect.name}")
+        if "import" in args.benchmarks:
+            suite.run_import(os.path.join(directory, "csv"))
+        else:
+            # The other benchmarks need the fleet in the database
+            drop_data(session_factory)
+            db = session_factory()
+            service = VehicleDataService(db)
+            for chunk in fleet.chunks():
+                service.add_vehicle_data_bulk(chunk)
+            db.close()
+        if "ingest" in args.benchmarks:
+            suite.run_ingest()
+        if "query" in args.benchmarks:
+            suite.run_queries()
+        if "export" in args.benchmarks:
+            suite.run_exports()
+
+        engine.dispose()
+
+    report = {
+        "meta": {
+            "date": datetime.utcnow().isoformat(),
+            "revision": git_revision(),
+            "vehicles": args.vehicles,
+            "points": args.points,
+            "rows": fleet.total,
+            "seed": args.seed,
+            "database": engine.dialect.name,
+            "python": platform.python_version(),
+            "sqlalchemy": sqlalchemy.__version__,
+            "platform": platform.platform(),
+        },
+        "results": suite.results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+    if args.compare:
+        with open(args.compare, "r") as baseline_file:
+            baseline = json.load(baseline_file)
+        if compare(suite.results, baseline["results"], args.threshold):
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,14 +7,37 @@ import os
 from fastapi import FastAPI, HTTPException
 from sqlalchemy.orm import Session
 
-from app.api.endpoints import vehicle_data_router
-from app.core.database import SessionLocal, engine
+from app.api.endpoints import (
+    cache_router,
+    debug_router,
+    latest_state_router,
+    live_router,
+    metrics_router,
+    trips_router,
+    vehicle_data_router,
+)
+from app.api.services.partition_service import PartitionService
+from app.api.services.write_buffer import write_buffer
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal, SessionLocal, async_engine, engine
+from app.core.database.migrations import migrate
 from app.core.database.models import Base
+from app.core.hot_tier import hot_tier
+from app.core.metrics import MetricsMiddleware
 
 
 app = FastAPI()
 
 app.include_router(vehicle_data_router)
+app.include_router(trips_router)
+app.include_router(latest_state_router)
+app.include_router(live_router)
+app.include_router(cache_router)
+app.include_router(metrics_router)
+app.include_router(debug_router)
+
+# Record the latency, status and concurrency of every request per route
+app.add_middleware(MetricsMiddleware)
 
 
 @app.on_event("startup")
@@ -22,11 +45,37 @@ async def startup():
     # Initialize database connection
     Base.metadata.create_all(bind=engine)
 
+    # Bring existing tables in line with the models
+    migrate(engine)
+
+    # Create the partitions of the current and coming months
+    if settings.partitioning_enabled:
+        db = SessionLocal()
+        try:
+            PartitionService(db).premake(settings.partition_premake_months)
+        finally:
+            db.close()
+
+    # Load the recent points of every vehicle in memory
+    if settings.hot_tier_enabled:
+        db = SessionLocal()
+        try:
+            hot_tier.load(db)
+        finally:
+            db.close()
+
+    # Commit the readings of POST /api/v1/vehicle_data/ in background batches, if enabled
+    write_buffer.start(AsyncSessionLocal)
+
 
 @app.on_event("shutdown")
 async def shutdown():
+    # Commit the readings still queued by the write-behind buffer
+    await write_buffer.stop()
+
     # Close database connection
     SessionLocal.close_all()
+    await async_engine.dispose()
 
 @app.get("/")
 async def read_root():
@@ -0,0 +1,97 @@
+import argparse
+import asyncio
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+import sys
+from typing import Callable, List
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from app.api.models.vehicle_data import VehicleModel
+from app.api.services.vehicle_data_service import VehicleDataService
+from app.core.cache import query_cache
+from app.core.database.models import Base, VehicleDatabase
+
+
+VEHICLE_ID = "f212b271-f033-444c-a445-560511f95e9c"
+
+
+def populate(session_factory: Callable, count: int) -> None:
+    """
+    Insert `count` synthetic readings of a single vehicle, one second apart.
+    """
+    start = datetime(2022, 7, 12)
+    rows = [
+        {
+            "vehicle_id": VEHICLE_ID,
+            "timestamp": start + timedelta(seconds=i),
+            "speed": float(i % 120),
+            "odometer": 1000 + i * 0.01,
+            "soc": float(80 - i % 40),
+            "elevation": float(100 + i % 50),
+            "shift_state": "D",
+        }
+        for i in range(count)
+    ]
+    db = session_factory()
+    db.execute(insert(VehicleDatabase), rows)
+    db.commit()
+    db.close()
+
+
+def model_path(db, count: int) -> bytes:
+    """
+    The response_model path: ORM objects, one VehicleModel per row, jsonable_encoder and json.dumps.
+    """
+    vehicles = VehicleDataService(db).get_vehicle_data(vehicle_id=VEHICLE_ID, limit=count)
+    field = create_response_field(name="Response", type_=List[VehicleModel])
+    content = asyncio.run(serialize_response(field=field, response_content=vehicles))
+    return JSONResponse(content).body
+
+
+def row_path(db, count: int) -> bytes:
+    """
+    The row read path: plain column tuples serialised by orjson.
+    """
+    rows = VehicleDataService(db).get_vehicle_data_rows(vehicle_id=VEHICLE_ID, limit=count)
+    return ORJSONResponse(rows).body
+
+
+def best_of(repeat: int, function: Callable, *args) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the read paths of GET /api/v1/vehicle_data/.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000], help="Numbers of rows returned.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measure, the best one is kept.")
+    args = parser.parse_args()
+
+    # The cache would serve every run after the first one
+    query_cache.enabled = False
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine)
+    populate(session_factory, max(args.sizes))
+
+    db = session_factory()
+    assert model_path(db, 10) == row_path(db, 10)
+
+    print(f"{'rows':>8} {'response_model':>15} {'orjson rows':>12} {'speedup':>8}")
+    for count in args.sizes:
+        model_time = best_of(args.repeat, model_path, db, count)
+        row_time = best_of(args.repeat, row_path, db, count)
+        print(f"{count:>8} {model_time:>14.3f}s {row_time:>11.3f}s {model_time / row_time:>7.1f}x")
+    db.close()
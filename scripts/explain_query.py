@@ -0,0 +1,32 @@
+import argparse
+from datetime import datetime
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from app.api.services.vehicle_data_service import VehicleDataService
+from app.core.database import SessionLocal
+from app.core.database.models import SortBy
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print the query plan of get_vehicle_data.")
+    parser.add_argument("--vehicle-id", default="f212b271-f033-444c-a445-560511f95e9c")
+    parser.add_argument("--initial-timestamp", type=datetime.fromisoformat)
+    parser.add_argument("--final-timestamp", type=datetime.fromisoformat)
+    parser.add_argument("--sort-by", type=SortBy, default=SortBy.ASC)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    vehicle_data_service = VehicleDataService(db=db)
+    plan = vehicle_data_service.explain_vehicle_data(
+        vehicle_id=args.vehicle_id,
+        initial_timestamp=args.initial_timestamp,
+        final_timestamp=args.final_timestamp,
+        sort_by=args.sort_by,
+    )
+    db.close()
+
+    # Print the query plan, one step per line
+    for line in plan:
+        print(line)
@@ -1,68 +1,264 @@
+import argparse
 import csv
+import multiprocessing
 import os
+import queue
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
 import sys
-from typing import List
+from typing import Callable, Iterator, List, Optional
 sys.path.append(str(Path(__file__).resolve().parent.parent))
 
-from app.api.models.vehicle_data import VehicleModel
+from sqlalchemy.orm import Session
+
+from app.api.services.partition_service import PartitionService
 from app.api.services.vehicle_data_service import VehicleDataService
 from app.core.database import SessionLocal
-from app.core.database.models import VehicleDatabase
+from app.core.database.models import (
+    LatestVehicleStateDatabase,
+    TripDatabase,
+    TripSegmentationDatabase,
+    VehicleDatabase,
+    VehicleDataRollupDatabase,
+    VehicleDataRollupShiftStateDatabase,
+)
+
+
+# Number of rows written per transaction
+DEFAULT_BATCH_SIZE = 5000
+
+# Number of processes parsing CSV files in parallel
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+# Queue shared with the parser processes, and event telling them to stop, set by _init_parser
+_chunk_queue = None
+_stop_parsing = None
 
 
-def import_data(csv_file_path: str) -> None:
+def parse_row(row: dict, vehicle_id: str) -> dict:
     """
-    Import vehicle data from a CSV file and add it to the database.
+    Convert a raw CSV row into the column values of a VehicleDatabase row.
 
     Args:
-        csv_file_path: The path to the CSV file containing the vehicle data.
+        row: The CSV row as returned by csv.DictReader.
+        vehicle_id: The ID of the vehicle the row belongs to.
 
     Returns:
-        None.
+        A dictionary of VehicleDatabase column values.
     """
-    # Create a database session and a vehicle data service
-    db = SessionLocal()
-    vehicle_data_service = VehicleDataService(db=db)
+    return {
+        "vehicle_id": vehicle_id,
+        "timestamp": None
+        if row["timestamp"] == "NULL"
+        else datetime.strptime(row["timestamp"], "%Y-%m-%d %H:%M:%S.%f"),
+        "speed": None if row["speed"] == "NULL" else float(row["speed"]),
+        "odometer": None if row["odometer"] == "NULL" else float(row["odometer"]),
+        "soc": None if row["soc"] == "NULL" else int(row["soc"]),
+        "elevation": None if row["elevation"] == "NULL" else float(row["elevation"]),
+        "shift_state": None if row["shift_state"] == "NULL" else row["shift_state"],
+    }
 
+
+def read_csv_chunks(csv_file_path: str, chunk_size: int = DEFAULT_BATCH_SIZE) -> Iterator[List[dict]]:
+    """
+    Stream a CSV file as chunks of parsed rows, so a file never has to fit in memory.
+
+    Args:
+        csv_file_path: The path to the CSV file containing the vehicle data.
+        chunk_size: The maximum number of rows per chunk.
+
+    Returns:
+        An iterator over lists of VehicleDatabase column values.
+    """
     # Get the basename of the CSV file (without the extension) to use as the vehicle ID
     basename = os.path.basename(os.path.splitext(csv_file_path)[0])
 
-    # Open the CSV file and read its contents
     with open(csv_file_path, "r") as csv_file:
         reader = csv.DictReader(csv_file)
 
-        # Parse each row of the CSV file into a VehicleModel object and add it to the database
+        chunk = []
         for row in reader:
-            vehicle = VehicleModel(
-                vehicle_id=basename,
-                timestamp=None
-                if row["timestamp"] == "NULL"
-                else datetime.strptime(row["timestamp"], "%Y-%m-%d %H:%M:%S.%f"),
-                speed=None if row["speed"] == "NULL" else float(row["speed"]),
-                odometer=None if row["odometer"] == "NULL" else float(row["odometer"]),
-                soc=None if row["soc"] == "NULL" else int(row["soc"]),
-                elevation=None if row["elevation"] == "NULL" else float(row["elevation"]),
-                shift_state=None if row["shift_state"] == "NULL" else row["shift_state"],
-            )
-            vehicle_db = VehicleDatabase(**vehicle.dict())
-            vehicle_data_service.add_vehicle_data(vehicle_database=vehicle_db)
+            chunk.append(parse_row(row, basename))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+
+        if chunk:
+            yield chunk
+
+
+def _init_parser(chunk_queue, stop_parsing) -> None:
+    """
+    Store the queue shared with the writer and the stop event in a parser process.
+    """
+    global _chunk_queue, _stop_parsing
+    _chunk_queue = chunk_queue
+    _stop_parsing = stop_parsing
+    # The writer reads every chunk unless it failed, in which case the chunks left are dropped on exit
+    chunk_queue.cancel_join_thread()
+
+
+def _parse_into_queue(csv_file_path: str, chunk_size: int) -> None:
+    """
+    Parse a CSV file in a parser process and hand its chunks to the writer, until the writer stops the parsers.
+
+    A None sentinel is always sent, so the writer knows when the file is finished.
+    """
+    try:
+        for chunk in read_csv_chunks(csv_file_path, chunk_size):
+            if _stop_parsing.is_set():
+                return
+            _chunk_queue.put(chunk)
+    finally:
+        _chunk_queue.put(None)
+
+
+def _stop_parsers(futures: list, chunk_queue, stop_parsing) -> None:
+    """
+    Stop the parser processes after a writer error.
+
+    The queue is drained until every parser is done, as a parser blocked on the full queue would
+    keep the executor from shutting down.
+    """
+    stop_parsing.set()
+    for future in futures:
+        future.cancel()
+    while not all(future.done() for future in futures):
+        try:
+            chunk_queue.get(timeout=0.1)
+        except queue.Empty:
+            pass
+
+
+def import_files(
+    csv_file_paths: List[str],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    workers: int = DEFAULT_WORKERS,
+    session_factory: Callable[[], Session] = SessionLocal,
+) -> int:
+    """
+    Bulk import vehicle data from several CSV files.
+
+    The files are parsed in parallel by up to `workers` processes, while a single writer
+    in this process inserts the chunks with one executemany INSERT and one commit per batch.
+
+    Args:
+        csv_file_paths: The paths to the CSV files containing the vehicle data.
+        batch_size: The number of rows written per transaction.
+        workers: The number of parser processes. With 1 or less the files are parsed in this process.
+        session_factory: The factory used to create the writer's database session.
+
+    Returns:
+        The number of rows imported, without the readings already stored.
+    """
+    start = time.perf_counter()
+    db = session_factory()
+    vehicle_data_service = VehicleDataService(db=db)
+    total = 0
+    read = 0
+
+    try:
+        if workers <= 1 or len(csv_file_paths) <= 1:
+            for csv_file_path in csv_file_paths:
+                for chunk in read_csv_chunks(csv_file_path, batch_size):
+                    read += len(chunk)
+                    total += vehicle_data_service.add_vehicle_data_bulk(chunk)
+        else:
+            context = multiprocessing.get_context()
+            # Bound the queue so the parsers cannot run too far ahead of the writer
+            chunk_queue = context.Queue(maxsize=workers * 2)
+            stop_parsing = context.Event()
+
+            with ProcessPoolExecutor(
+                max_workers=min(workers, len(csv_file_paths)),
+                mp_context=context,
+                initializer=_init_parser,
+                initargs=(chunk_queue, stop_parsing),
+            ) as executor:
+                futures = [executor.submit(_parse_into_queue, path, batch_size) for path in csv_file_paths]
+
+                try:
+                    pending = len(futures)
+                    while pending:
+                        try:
+                            chunk = chunk_queue.get(timeout=1)
+                        except queue.Empty:
+                            # A parser process that died without sending its sentinel would hang the writer
+                            for future in futures:
+                                if future.done() and future.exception() is not None:
+                                    raise future.exception()
+                            continue
+
+                        if chunk is None:
+                            pending -= 1
+                            continue
+
+                        read += len(chunk)
+                        total += vehicle_data_service.add_vehicle_data_bulk(chunk)
+                except BaseException:
+                    _stop_parsers(futures, chunk_queue, stop_parsing)
+                    raise
+
+                # Surface any parsing error
+                for future in futures:
+                    future.result()
+    finally:
+        db.close()
+
+    # Print the ingest rate
+    elapsed = time.perf_counter() - start
+    rows_per_second = total / elapsed if elapsed > 0 else 0
+    print(
+        f"Imported {total} rows in {elapsed:.2f}s ({rows_per_second:.0f} rows/s), "
+        f"skipped {read - total} already stored"
+    )
+
+    return total
+
+
+def import_data(
+    csv_file_path: str,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    session_factory: Callable[[], Session] = SessionLocal,
+) -> int:
+    """
+    Import vehicle data from a CSV file and add it to the database.
+
+    Args:
+        csv_file_path: The path to the CSV file containing the vehicle data.
+        batch_size: The number of rows written per transaction.
+        session_factory: The factory used to create the database session.
+
+    Returns:
+        The number of rows imported.
+    """
+    total = import_files([csv_file_path], batch_size=batch_size, workers=1, session_factory=session_factory)
 
     # Print a success message
+    basename = os.path.basename(os.path.splitext(csv_file_path)[0])
     print(f"Data imported successfully for {basename}")
 
+    return total
 
-def drop_data() -> None:
+
+def drop_data(session_factory: Callable[[], Session] = SessionLocal) -> None:
     """
     Drop all vehicle data from the database.
 
     Returns:
         None.
     """
-    # Create a database session and delete all VehicleDatabase objects
-    db = SessionLocal()
+    # Create a database session and delete all VehicleDatabase objects and partitions, their rollups, trips and states
+    db = session_factory()
+    PartitionService(db).drop_partitions()
     db.query(VehicleDatabase).delete()
+    db.query(VehicleDataRollupDatabase).delete()
+    db.query(VehicleDataRollupShiftStateDatabase).delete()
+    db.query(TripDatabase).delete()
+    db.query(TripSegmentationDatabase).delete()
+    db.query(LatestVehicleStateDatabase).delete()
     db.commit()
     db.close()
 
@@ -70,19 +266,34 @@ def drop_data() -> None:
     print("Data dropped successfully!")
 
 
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """
+    Parse the command line arguments of the import script.
+    """
+    parser = argparse.ArgumentParser(description="Bulk import vehicle data from CSV files.")
+    parser.add_argument("--directory", default="data", help="Directory containing the CSV files.")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Rows written per transaction.")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Number of CSV parser processes.")
+    parser.add_argument(
+        "--drop", action="store_true", help="Drop all the data first. Without it, readings already stored are skipped."
+    )
+    return parser.parse_args(argv)
+
+
 if __name__ == "__main__":
-    # Get a list of all CSV files in the 'data' directory
-    directory = "data"
+    args = parse_args()
+
+    # Get a list of all CSV files in the data directory
+    directory = args.directory
     csv_files: List[str] = [
-        file
-        for file in os.listdir(directory)
+        os.path.join(directory, file)
+        for file in sorted(os.listdir(directory))
         if os.path.isfile(os.path.join(directory, file)) and file.endswith(".csv")
     ]
 
-    # Drop all existing data from the database
-    # Comment if you don't want to drop the data
-    drop_data()
+    # Readings already stored are skipped, so files can be imported again without dropping the data
+    if args.drop:
+        drop_data()
 
-    # Import the data from each CSV file into the database
-    for csv_file in csv_files:
-        import_data(f"{directory}/{csv_file}")
+    # Import the data from every CSV file into the database
+    import_files(csv_files, batch_size=args.batch_size, workers=args.workers)
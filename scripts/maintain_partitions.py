@@ -0,0 +1,53 @@
+import argparse
+import time
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from app.api.services.partition_service import PartitionService, retention_cutoff
+from app.core.config import settings
+from app.core.database import SessionLocal, engine
+from app.core.database.partitions import compact
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create, expire and compact the monthly partitions of vehicle data.")
+    parser.add_argument(
+        "--move-legacy", action="store_true", help="Move the readings of vehicle_data into their monthly partitions."
+    )
+    parser.add_argument(
+        "--retention-months", type=int, default=settings.retention_months,
+        help="Months of readings kept, counting the current month (0 keeps everything).",
+    )
+    parser.add_argument("--compact", action="store_true", help="Reclaim the space of the deleted readings.")
+    parser.add_argument("--chunk-size", type=int, default=10000, help="Readings moved or deleted per transaction.")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    db = SessionLocal()
+    partition_service = PartitionService(db)
+
+    # Create the partitions of the coming months, so the writes do not have to
+    if settings.partitioning_enabled:
+        names = partition_service.premake(settings.partition_premake_months)
+        print(f"Partitions ready: {', '.join(names)}")
+
+    if args.move_legacy:
+        moved = partition_service.move_legacy(chunk_size=args.chunk_size)
+        print(f"Moved {moved} readings from vehicle_data to their partitions")
+
+    if args.retention_months > 0:
+        cutoff = retention_cutoff(args.retention_months)
+        dropped, deleted = partition_service.apply_retention(cutoff, chunk_size=args.chunk_size)
+        print(
+            f"Expired the readings before {cutoff:%Y-%m-%d}: dropped {len(dropped)} partitions, "
+            f"deleted {deleted} readings from vehicle_data"
+        )
+    db.close()
+
+    if args.compact:
+        compact(engine)
+        print("Database compacted")
+
+    # Print a success message
+    print(f"Partitions maintained in {time.perf_counter() - start:.2f}s")
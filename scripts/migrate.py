@@ -0,0 +1,19 @@
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from app.core.database import engine
+from app.core.database.migrations import migrate
+from app.core.database.models import Base
+
+
+if __name__ == "__main__":
+    # Create the missing tables, then alter the existing ones
+    Base.metadata.create_all(bind=engine)
+    versions = migrate(engine)
+
+    # Print the applied migrations
+    if versions:
+        print(f"Applied migrations: {', '.join(str(version) for version in versions)}")
+    else:
+        print("The database is up to date")
@@ -0,0 +1,23 @@
+import argparse
+import time
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from app.api.services.rollup_service import RollupService
+from app.core.database import SessionLocal
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the vehicle data rollups from the raw rows.")
+    parser.add_argument("--vehicle-id", help="Only rebuild the rollups of this vehicle.")
+    parser.add_argument("--chunk-size", type=int, default=10000, help="Raw rows aggregated at a time.")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    db = SessionLocal()
+    total = RollupService(db).rebuild(vehicle_id=args.vehicle_id, chunk_size=args.chunk_size)
+    db.close()
+
+    # Print a success message
+    print(f"Rollups rebuilt from {total} rows in {time.perf_counter() - start:.2f}s")
@@ -1,6 +1,8 @@
 from fastapi.testclient import TestClient
 import pytest
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
 from app.api.endpoints.vehicle_data import add_vehicle_data
 from main import app
 from app.core.database import SessionLocal, engine
@@ -9,7 +11,8 @@ from app.api.models.vehicle_data import VehicleModel
 from sqlalchemy.orm import sessionmaker
 from unittest.mock import MagicMock
 from sqlalchemy.ext.declarative import declarative_base
-from app.core.database import SessionLocal, get_db
+from app.core.database import SessionLocal, get_async_db, get_db
+from app.core.cache import query_cache
 from app.core.database.models import Base, SortBy, VehicleDatabase
 from datetime import datetime, timedelta
 
@@ -19,6 +22,10 @@ engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base.metadata.create_all(bind=engine)
 
+# The TestClient runs every request in its own event loop, so async connections are not pooled
+async_engine = create_async_engine("sqlite+aiosqlite:///./test.db", poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 def override_get_db():
     try:
         db = TestingSessionLocal()
@@ -26,7 +33,12 @@ def override_get_db():
     finally:
         db.close()
 
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_async_db] = override_get_async_db
 
 client = TestClient(app)
 
@@ -34,8 +46,10 @@ client = TestClient(app)
 @pytest.fixture()
 def test_db():
     Base.metadata.create_all(bind=engine)
+    query_cache.clear()
     yield
     Base.metadata.drop_all(bind=engine)
+    query_cache.clear()
 
 @pytest.fixture
 def add_vehicle_id(test_db):
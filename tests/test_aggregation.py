@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+
+from app.api.services.vehicle_data_service import VehicleDataService
+from tests.conftest import TestingSessionLocal, client
+
+
+def test_get_vehicle_data_aggregates(test_db):
+    """
+    GIVEN readings spread over two hours
+    WHEN they are aggregated in 1h buckets
+    THEN each bucket holds the statistics of its readings
+    """
+    db = TestingSessionLocal()
+    start = datetime(2032, 1, 1, 10, 0, 0)
+    readings = [
+        # (minutes after start, speed, odometer, soc, shift_state)
+        (0, None, None, 80, "P"),
+        (10, 20, 100.0, 79, "D"),
+        (20, 40, 101.0, 78, "D"),
+        (70, 60, 105.0, 75, "D"),
+        (80, 0, None, 74, "P"),
+        (90, 0, 107.0, 73, "P"),
+    ]
+    rows = [
+        {
+            "vehicle_id": "my_vehicle_id",
+            "timestamp": start + timedelta(minutes=minutes),
+            "speed": speed,
+            "odometer": odometer,
+            "soc": soc,
+            "elevation": 100,
+            "shift_state": shift_state,
+        }
+        for minutes, speed, odometer, soc, shift_state in readings
+    ]
+    rows.append({"vehicle_id": "other_vehicle_id", "timestamp": start, "speed": 500})
+    VehicleDataService(db=db).add_vehicle_data_bulk(rows)
+    db.close()
+
+    response = client.get("/api/v1/vehicle_data/aggregate/?vehicle_id=my_vehicle_id&bucket=1h")
+
+    assert response.status_code == 200
+    first, second = response.json()
+    assert first == {
+        "bucket_start": "2032-01-01T10:00:00",
+        "count": 3,
+        "speed_min": 20.0,
+        "speed_avg": 30.0,
+        "speed_max": 40.0,
+        "soc_min": 78.0,
+        "soc_avg": 79.0,
+        "soc_max": 80.0,
+        "elevation_min": 100.0,
+        "elevation_avg": 100.0,
+        "elevation_max": 100.0,
+        "odometer_first": 100.0,
+        "odometer_last": 101.0,
+        "shift_state": "D",
+    }
+    assert second["bucket_start"] == "2032-01-01T11:00:00"
+    assert second["count"] == 3
+    assert second["odometer_first"] == 105.0
+    assert second["odometer_last"] == 107.0
+    assert second["shift_state"] == "P"
+
+    response = client.get(
+        "/api/v1/vehicle_data/aggregate/?vehicle_id=my_vehicle_id&bucket=1d&initial-timestamp=2032-01-01T11:00:00"
+    )
+    assert [bucket["count"] for bucket in response.json()] == [3]
+
+
+def test_get_vehicle_data_aggregates_invalid_bucket(test_db):
+    response = client.get("/api/v1/vehicle_data/aggregate/?vehicle_id=my_vehicle_id&bucket=2h")
+    assert response.status_code == 422
@@ -0,0 +1,50 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.api.services.async_vehicle_data_service import AsyncVehicleDataService
+from app.core.database.database import to_async_url
+from app.core.database.models import SortBy, VehicleDatabase
+from tests.conftest import TestingAsyncSessionLocal
+
+
+def test_to_async_url():
+    assert to_async_url("sqlite:///./sql_app.db") == "sqlite+aiosqlite:///./sql_app.db"
+    assert to_async_url("postgresql+psycopg2://user:pass@db/volteras") == "postgresql+asyncpg://user:pass@db/volteras"
+
+
+@pytest.mark.asyncio
+async def test_async_vehicle_data_service(test_db):
+    """
+    GIVEN readings added through the async service
+    WHEN they are read back by concurrent sessions and streamed
+    THEN every query returns them in order
+    """
+    async with TestingAsyncSessionLocal() as db:
+        timestamp = datetime(2032, 1, 1)
+        rows = [{"vehicle_id": "my_vehicle_id", "timestamp": timestamp + timedelta(days=i), "speed": i} for i in range(5)]
+        assert await AsyncVehicleDataService(db=db).add_vehicle_data_bulk(rows) == 5
+
+    async def read_speeds():
+        async with TestingAsyncSessionLocal() as db:
+            vehicles = await AsyncVehicleDataService(db=db).get_vehicle_data(
+                vehicle_id="my_vehicle_id", sort_by=SortBy.DESC, limit=10
+            )
+            return [vehicle.speed for vehicle in vehicles]
+
+    results = await asyncio.gather(*[read_speeds() for _ in range(5)])
+    assert results == [[4, 3, 2, 1, 0]] * 5
+
+    async with TestingAsyncSessionLocal() as db:
+        vehicle_data_service = AsyncVehicleDataService(db=db)
+        streamed = [
+            vehicle.speed
+            async for vehicle in vehicle_data_service.stream_vehicle_data(
+                vehicle_id="my_vehicle_id", sort_by=SortBy.ASC, chunk_size=2
+            )
+        ]
+        assert streamed == [0, 1, 2, 3, 4]
+
+        vehicle = await vehicle_data_service.add_vehicle_data(VehicleDatabase(vehicle_id="my_vehicle_id"))
+        assert (await vehicle_data_service.get_vehicle_data_by_id(vehicle.id)).vehicle_id == "my_vehicle_id"
@@ -0,0 +1,87 @@
+import orjson
+import pytest
+
+from app.api.services.ingest_service import MAX_BATCH_BYTES, MAX_BATCH_SIZE, BatchTooLargeError, IngestService
+from tests.conftest import client
+
+
+def test_add_vehicle_data_batch_json_array(test_db):
+    """
+    GIVEN a JSON array with two valid readings and an invalid one
+    WHEN it is posted to the batch endpoint
+    THEN the valid readings are inserted and the invalid one is reported
+    """
+    readings = [
+        {"vehicle_id": "my_vehicle_id", "timestamp": "2032-01-01T00:00:00", "speed": 50},
+        {"vehicle_id": "my_vehicle_id", "timestamp": "not a timestamp"},
+        {"vehicle_id": "my_vehicle_id", "timestamp": "2032-01-02T00:00:00", "soc": 80},
+    ]
+
+    response = client.post("/api/v1/vehicle_data/batch/", json=readings)
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["received"] == 3
+    assert data["inserted"] == 2
+    assert data["rejected"] == 1
+    assert [item["status"] for item in data["items"]] == ["created", "rejected", "created"]
+    assert data["items"][1]["errors"][0]["loc"] == ["timestamp"]
+
+    response = client.get("/api/v1/vehicle_data/?vehicle_id=my_vehicle_id&limit=10")
+    assert len(response.json()) == 2
+
+
+def test_add_vehicle_data_batch_ndjson(test_db):
+    body = b"\n".join(
+        orjson.dumps({"vehicle_id": "my_vehicle_id", "timestamp": f"2032-01-0{i + 1}T00:00:00"}) for i in range(3)
+    )
+
+    response = client.post(
+        "/api/v1/vehicle_data/batch/",
+        content=body,
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+
+    assert response.status_code == 200
+    assert response.json()["inserted"] == 3
+
+
+def test_add_vehicle_data_batch_rejects_invalid_body(test_db):
+    response = client.post("/api/v1/vehicle_data/batch/", content=b'{"vehicle_id": "my_vehicle_id"}')
+    assert response.status_code == 400
+
+    response = client.post(
+        "/api/v1/vehicle_data/batch/",
+        json=[{"vehicle_id": "my_vehicle_id"}] * (MAX_BATCH_SIZE + 1),
+    )
+    assert response.status_code == 413
+
+
+def test_add_vehicle_data_batch_refuses_large_bodies_before_reading_them(test_db):
+    response = client.post(
+        "/api/v1/vehicle_data/batch/",
+        content=b"[]",
+        headers={"Content-Type": "application/json", "Content-Length": str(MAX_BATCH_BYTES + 1)},
+    )
+    assert response.status_code == 413
+
+
+@pytest.mark.asyncio
+async def test_read_body_stops_at_the_byte_limit():
+    chunks_read = []
+
+    async def chunks():
+        # Sent without Content-Length, e.g. with the chunked transfer encoding
+        for _ in range(20):
+            chunks_read.append(None)
+            yield b" " * (MAX_BATCH_BYTES // 10)
+
+    with pytest.raises(BatchTooLargeError):
+        await IngestService.read_body(chunks())
+    assert len(chunks_read) == 11
+
+    async def small():
+        yield b"[{}, "
+        yield b"{}]"
+
+    assert await IngestService.read_body(small(), content_length="8") == b"[{}, {}]"
@@ -0,0 +1,51 @@
+import json
+
+from benchmarks.fleet import FleetGenerator, FleetProfile
+from benchmarks.suite import main
+from scripts.import_data import read_csv_chunks
+
+
+def test_fleet_profile_from_data_directory():
+    profile = FleetProfile.from_directory("data")
+
+    assert profile.interval > 0
+    assert set(profile.shift_states) == {"D", "P", "R"}
+    assert 0 < profile.null_rates["speed"] < 1
+    assert profile.soc_min <= profile.soc_max
+
+
+def test_fleet_generator_is_seeded_and_ordered():
+    fleet = FleetGenerator(vehicles=3, points=100, seed=42)
+
+    rows = list(fleet.rows())
+    assert len(rows) == fleet.total == 300
+    assert rows == list(FleetGenerator(vehicles=3, points=100, seed=42).rows())
+    assert rows != list(FleetGenerator(vehicles=3, points=100, seed=43).rows())
+    assert len({row["vehicle_id"] for row in rows}) == 3
+
+    timestamps = [row["timestamp"] for row in rows[:100]]
+    assert timestamps == sorted(timestamps)
+    assert [len(chunk) for chunk in fleet.chunks(chunk_size=128)] == [128, 128, 44]
+
+
+def test_fleet_csv_files_are_importable(tmp_path):
+    fleet = FleetGenerator(vehicles=2, points=10, seed=1)
+
+    paths = fleet.write_csv_files(str(tmp_path))
+
+    rows = [row for path in paths for chunk in read_csv_chunks(path) for row in chunk]
+    generated = list(fleet.rows())
+    assert [row["vehicle_id"] for row in rows] == [row["vehicle_id"] for row in generated]
+    assert [row["soc"] for row in rows] == [row["soc"] for row in generated]
+
+
+def test_benchmark_suite_writes_results(tmp_path):
+    output = tmp_path / "results.json"
+
+    assert main(["--vehicles", "2", "--points", "50", "--repeat", "1", "--workers", "1", "--output", str(output)]) == 0
+
+    report = json.loads(output.read_text())
+    assert report["meta"]["rows"] == 100
+    assert report["results"]["query.sort_asc_100"]["rows"] == 50
+    assert report["results"]["export.parquet"]["bytes"] > 0
+    assert main(["--vehicles", "2", "--points", "50", "--repeat", "1", "--benchmarks", "query", "--compare", str(output), "--threshold", "1000"]) == 0
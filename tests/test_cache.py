@@ -0,0 +1,209 @@
+import time
+from datetime import datetime
+
+import pytest
+
+from app.api.models.vehicle_data import VehicleModel
+from app.api.services.vehicle_data_service import VehicleDataService
+from app.core.cache import CacheBackend, MemoryCacheBackend, QueryCache, make_key, query_cache
+from app.core.database.models import VehicleDatabase
+from tests.conftest import TestingSessionLocal, client
+
+
+def test_make_key_normalises_parameters():
+    assert make_key("my_vehicle_id", skip=None) == make_key("my_vehicle_id", skip=0)
+    assert make_key("my_vehicle_id", limit=3) != make_key("my_vehicle_id", limit=4)
+
+
+def test_memory_backend_lru_eviction():
+    backend = MemoryCacheBackend(max_entries=2)
+    backend.set("a", 1, "one")
+    backend.set("a", 2, "two")
+    assert backend.get("a", 1) == "one"
+
+    # Entry 2 is now the least recently used
+    backend.set("b", 3, "three")
+    assert backend.get("a", 2) is None
+    assert backend.get("a", 1) == "one"
+    assert backend.get("b", 3) == "three"
+    assert backend.stats()["evictions"] == 1
+
+
+def test_memory_backend_byte_limit():
+    backend = MemoryCacheBackend(max_bytes=200)
+    backend.set("a", 1, "x" * 100)
+    backend.set("a", 2, "y" * 100)
+    assert backend.get("a", 1) is None
+    assert backend.stats()["bytes"] <= 200
+
+    # A value larger than the whole cache is not stored
+    backend.set("a", 3, "z" * 1000)
+    assert backend.get("a", 3) is None
+
+
+def test_memory_backend_ttl():
+    backend = MemoryCacheBackend(ttl=0.01)
+    backend.set("a", 1, "one")
+    time.sleep(0.02)
+    assert backend.get("a", 1) is None
+    assert backend.stats()["expirations"] == 1
+
+
+def test_memory_backend_invalidates_one_vehicle():
+    backend = MemoryCacheBackend()
+    backend.set("a", 1, "one")
+    backend.set("b", 1, "one")
+    backend.invalidate("a")
+    assert backend.get("a", 1) is None
+    assert backend.get("b", 1) == "one"
+
+
+def test_memory_backend_drops_values_of_an_older_version():
+    backend = MemoryCacheBackend()
+    version = backend.version("a")
+    backend.invalidate("a")
+    backend.set("a", 1, "stale", version)
+    assert backend.get("a", 1) is None
+
+    version = backend.version("a")
+    backend.clear()
+    backend.set("a", 1, "stale", version)
+    assert backend.get("a", 1) is None
+
+    backend.set("a", 1, "one", backend.version("a"))
+    assert backend.get("a", 1) == "one"
+
+
+def test_disabled_cache_stores_nothing():
+    cache = QueryCache(MemoryCacheBackend(), enabled=False)
+    cache.set("a", 1, "one")
+    assert cache.get("a", 1) is None
+
+
+def test_get_vehicle_data_is_cached_until_a_write(test_db):
+    """
+    GIVEN a vehicle data query served once
+    WHEN it is repeated, then after a write to the vehicle
+    THEN the repeat is a cache hit, and the write makes the next query read the new row
+    """
+    vehicle_data_service = VehicleDataService(db=TestingSessionLocal())
+    vehicle_data_service.add_vehicle_data_bulk(
+        [{"vehicle_id": "my_vehicle_id", "timestamp": datetime(2032, 1, 1), "speed": 10}]
+    )
+    params = {"vehicle_id": "my_vehicle_id", "limit": 10}
+
+    before = query_cache.stats()
+    first = client.get("/api/v1/vehicle_data/", params=params)
+    second = client.get("/api/v1/vehicle_data/", params=params)
+    after = query_cache.stats()
+    assert first.json() == second.json()
+    assert after["hits"] - before["hits"] == 1
+    assert after["misses"] - before["misses"] == 1
+
+    # A write to another vehicle keeps the entry
+    client.post("/api/v1/vehicle_data/", json={"vehicle_id": "other_vehicle_id", "speed": 1})
+    assert len(client.get("/api/v1/vehicle_data/", params=params).json()) == 1
+    assert query_cache.stats()["hits"] - after["hits"] == 1
+
+    client.post(
+        "/api/v1/vehicle_data/",
+        json=VehicleModel(vehicle_id="my_vehicle_id", timestamp="2032-01-01T00:01:00", speed=20)._json(),
+    )
+    assert len(client.get("/api/v1/vehicle_data/", params=params).json()) == 2
+
+    stats = client.get("/api/v1/cache/stats/").json()
+    assert stats["invalidations"] >= 2
+
+
+def test_cached_rows_are_detached_vehicles(test_db):
+    vehicle_data_service = VehicleDataService(db=TestingSessionLocal())
+    vehicle_data_service.add_vehicle_data_bulk([{"vehicle_id": "my_vehicle_id", "speed": 10}])
+
+    vehicle_data_service.get_vehicle_data(vehicle_id="my_vehicle_id")
+    cached = vehicle_data_service.get_vehicle_data(vehicle_id="my_vehicle_id")
+    assert isinstance(cached[0], VehicleDatabase)
+    assert cached[0].speed == 10 and cached[0].id is not None
+
+
+def test_write_during_a_query_keeps_its_result_out_of_the_cache(test_db, monkeypatch):
+    """
+    GIVEN a query that misses the cache
+    WHEN a write to the vehicle invalidates it after the query ran, but before its result is cached
+    THEN the result is not cached, and the next query reads the new row
+    """
+    db = TestingSessionLocal()
+    vehicle_data_service = VehicleDataService(db=db)
+    vehicle_data_service.add_vehicle_data_bulk([{"vehicle_id": "my_vehicle_id", "timestamp": datetime(2032, 1, 1)}])
+
+    execute = db.execute
+
+    def execute_then_write(statement, *args, **kwargs):
+        # The partition lookup runs first
+        if "vehicle_data_partition" in str(statement):
+            return execute(statement, *args, **kwargs)
+
+        result = execute(statement, *args, **kwargs).freeze()
+        monkeypatch.setattr(db, "execute", execute)
+        VehicleDataService(db=TestingSessionLocal()).add_vehicle_data_bulk(
+            [{"vehicle_id": "my_vehicle_id", "timestamp": datetime(2032, 1, 2)}]
+        )
+        return result()
+
+    monkeypatch.setattr(db, "execute", execute_then_write)
+    assert len(vehicle_data_service.get_vehicle_data(vehicle_id="my_vehicle_id")) == 1
+    assert len(vehicle_data_service.get_vehicle_data(vehicle_id="my_vehicle_id")) == 2
+
+
+def test_cache_backends_implement_the_whole_interface():
+    class PartialBackend(CacheBackend):
+        def get(self, vehicle_id, key):
+            return None
+
+    with pytest.raises(TypeError):
+        PartialBackend()
+    assert isinstance(MemoryCacheBackend(), CacheBackend)
+
+
+def test_sorted_pages_are_cached_until_a_write(test_db):
+    """
+    GIVEN a sorted query, on one vehicle and on a set of vehicles, served once
+    WHEN it is repeated, then after a write to one of the vehicles
+    THEN the repeat is a cache hit with the same next cursor, and the write makes the next query read the new row
+    """
+    VehicleDataService(db=TestingSessionLocal()).add_vehicle_data_bulk([
+        {"vehicle_id": vehicle_id, "timestamp": datetime(2032, 1, 1, 0, minute), "speed": minute}
+        for vehicle_id in ("my_vehicle_id", "other_vehicle_id")
+        for minute in range(5)
+    ])
+
+    for vehicle_id in ("my_vehicle_id", ["other_vehicle_id", "my_vehicle_id"]):
+        params = {"vehicle_id": vehicle_id, "sort-by": "DESC"}
+        before = query_cache.stats()
+        first = client.get("/api/v1/vehicle_data/", params=params)
+        second = client.get("/api/v1/vehicle_data/", params=params)
+        after = query_cache.stats()
+        assert first.json() == second.json()
+        assert first.headers["X-Next-Cursor"] == second.headers["X-Next-Cursor"]
+        assert after["hits"] - before["hits"] == 1
+        assert after["misses"] - before["misses"] == 1
+
+    client.post(
+        "/api/v1/vehicle_data/",
+        json=VehicleModel(vehicle_id="my_vehicle_id", timestamp="2032-01-01T01:00:00", speed=60)._json(),
+    )
+    for vehicle_id in ("my_vehicle_id", ["other_vehicle_id", "my_vehicle_id"]):
+        rows = client.get("/api/v1/vehicle_data/", params={"vehicle_id": vehicle_id, "sort-by": "DESC"}).json()
+        assert rows[0]["speed"] == 60
+
+
+def test_query_cache_keys_vehicle_sets_on_their_versions():
+    cache = QueryCache(MemoryCacheBackend())
+    version = cache.version(["a", "b"])
+    cache.set(["b", "a"], 1, "one", version)
+    assert cache.get(["a", "b", "a"], 1) == "one"
+
+    cache.backend.invalidate("b")
+    assert cache.get(["a", "b"], 1) is None
+    # A result read before the write is not stored
+    cache.set(["a", "b"], 1, "one", version)
+    assert cache.get(["a", "b"], 1) is None
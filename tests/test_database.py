@@ -0,0 +1,24 @@
+from sqlalchemy import create_engine, text
+
+from app.core.config import Settings
+from app.core.database.database import engine_options, set_sqlite_pragmas
+
+
+def test_engine_options_for_postgres():
+    settings = Settings(database_pool_size=20, database_max_overflow=5, database_pool_timeout=3)
+
+    options = engine_options("postgresql://user:password@db/volteras", settings)
+
+    assert options == {"pool_size": 20, "max_overflow": 5, "pool_timeout": 3, "pool_pre_ping": True}
+    assert engine_options("sqlite:///./sql_app.db", settings) == {"connect_args": {"check_same_thread": False}}
+
+
+def test_sqlite_pragmas_applied_on_connect(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'pragmas.db'}")
+    set_sqlite_pragmas(engine, Settings())
+
+    with engine.connect() as connection:
+        assert connection.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        # synchronous=NORMAL is reported as 1
+        assert connection.execute(text("PRAGMA synchronous")).scalar() == 1
+        assert connection.execute(text("PRAGMA cache_size")).scalar() == -65536
@@ -0,0 +1,179 @@
+import io
+import json
+import threading
+from datetime import datetime, timedelta
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from app.api.services.exporter_service import ARROW_SCHEMA, ArrowEncoder, ExporterService, _ColumnarEncoder
+from app.core.database.models import ExportFormat, VehicleDatabase
+from tests.conftest import TestingSessionLocal, client
+
+
+def add_vehicles(count: int) -> None:
+    """
+    Add `count` readings for "my_vehicle_id", one day apart.
+    """
+    db = TestingSessionLocal()
+    timestamp = datetime(2032, 1, 1, 0, 0, 0)
+    db.add_all(
+        VehicleDatabase(
+            vehicle_id="my_vehicle_id",
+            timestamp=timestamp + timedelta(days=i),
+            speed=50 + i,
+            shift_state="D",
+        )
+        for i in range(count)
+    )
+    db.commit()
+    db.close()
+
+
+def test_export_csv(test_db):
+    add_vehicles(3)
+
+    response = client.get("/api/v1/vehicle_data/?vehicle_id=my_vehicle_id&export-format=CSV&sort-by=ASC&limit=10")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert response.text.splitlines() == [
+        "vehicle_id,timestamp,speed,odometer,elevation,soc,shift_state",
+        "my_vehicle_id,2032-01-01T00:00:00,50.0,,,,D",
+        "my_vehicle_id,2032-01-02T00:00:00,51.0,,,,D",
+        "my_vehicle_id,2032-01-03T00:00:00,52.0,,,,D",
+    ]
+
+
+def test_export_json(test_db):
+    add_vehicles(3)
+
+    response = client.get("/api/v1/vehicle_data/?vehicle_id=my_vehicle_id&export-format=JSON&sort-by=DESC&limit=10")
+
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data) == 3
+    assert data[0] == {
+        "vehicle_id": "my_vehicle_id",
+        "timestamp": "2032-01-03T00:00:00",
+        "speed": 52.0,
+        "odometer": None,
+        "elevation": None,
+        "soc": None,
+        "shift_state": "D",
+    }
+
+
+def test_export_stream_is_chunked():
+    """
+    GIVEN 5 rows
+    WHEN they are streamed as JSON in chunks of 2 rows
+    THEN the array is emitted in several chunks and still decodes as a whole
+    """
+    rows = [VehicleDatabase(vehicle_id="my_vehicle_id", speed=i) for i in range(5)]
+
+    chunks = list(ExporterService.stream(rows, ExportFormat.JSON, chunk_size=2))
+
+    assert len(chunks) == 5
+    assert chunks[0] == "["
+    assert ExporterService.export([], ExportFormat.JSON) == "[]"
+    assert "".join(chunks).count("my_vehicle_id") == 5
+
+
+def test_export_arrow(test_db):
+    add_vehicles(3)
+
+    response = client.get("/api/v1/vehicle_data/?vehicle_id=my_vehicle_id&export-format=ARROW&sort-by=ASC&limit=10")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/vnd.apache.arrow.stream"
+    table = pa.ipc.open_stream(response.content).read_all()
+    assert table.schema == ARROW_SCHEMA
+    assert table.column("speed").to_pylist() == [50.0, 51.0, 52.0]
+    assert table.column("timestamp").to_pylist()[0] == datetime(2032, 1, 1)
+    assert table.column("shift_state").to_pylist() == ["D", "D", "D"]
+
+
+def test_export_parquet(test_db):
+    add_vehicles(3)
+
+    response = client.get("/api/v1/vehicle_data/?vehicle_id=my_vehicle_id&export-format=PARQUET&sort-by=DESC&limit=10")
+
+    assert response.status_code == 200
+    assert response.headers["content-disposition"] == "attachment; filename=vehicle_data.parquet"
+    table = pq.read_table(io.BytesIO(response.content))
+    assert table.column("speed").to_pylist() == [52.0, 51.0, 50.0]
+    assert pa.types.is_dictionary(table.schema.field("shift_state").type)
+
+
+def test_export_columnar_in_several_batches():
+    rows = [VehicleDatabase(vehicle_id="my_vehicle_id", speed=i, shift_state="DP"[i % 2]) for i in range(5)]
+
+    arrow = ExporterService.export(rows, ExportFormat.ARROW)
+    parquet = list(ExporterService.stream(rows, ExportFormat.PARQUET, chunk_size=2))
+
+    batches = list(pa.ipc.open_stream(arrow))
+    assert len(batches) == 1
+    assert batches[0].column(6).to_pylist() == ["D", "P", "D", "P", "D"]
+    assert pq.ParquetFile(io.BytesIO(b"".join(parquet))).metadata.num_row_groups == 3
+    assert pq.read_table(io.BytesIO(ExporterService.export([], ExportFormat.PARQUET))).num_rows == 0
+
+
+def test_export_ndjson(test_db):
+    add_vehicles(3)
+
+    response = client.get("/api/v1/vehicle_data/?vehicle_id=my_vehicle_id&export-format=NDJSON&sort-by=ASC&limit=10")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = response.text.splitlines()
+    assert len(lines) == 3
+    assert json.loads(lines[2])["timestamp"] == "2032-01-03T00:00:00"
+
+
+def test_list_streams_ndjson_when_accepted(test_db):
+    add_vehicles(3)
+
+    with client.stream(
+        "GET",
+        "/api/v1/vehicle_data/?vehicle_id=my_vehicle_id&sort-by=DESC&limit=10",
+        headers={"Accept": "application/x-ndjson"},
+    ) as response:
+        assert response.headers["content-type"] == "application/x-ndjson"
+        assert "content-disposition" not in response.headers
+        speeds = [json.loads(line)["speed"] for line in response.iter_lines()]
+
+    assert speeds == [52.0, 51.0, 50.0]
+
+
+def test_ndjson_stream_has_one_row_per_line():
+    rows = [VehicleDatabase(vehicle_id="my_vehicle_id", speed=i) for i in range(5)]
+
+    chunks = list(ExporterService.stream(rows, ExportFormat.NDJSON, chunk_size=2))
+
+    assert len(chunks) == 3
+    assert all(chunk.endswith("\n") for chunk in chunks)
+    assert ExporterService.export([], ExportFormat.NDJSON) == ""
+
+
+@pytest.mark.asyncio
+async def test_async_columnar_export_encodes_off_the_event_loop(monkeypatch):
+    async def rows():
+        for i in range(3):
+            yield VehicleDatabase(vehicle_id="my_vehicle_id", speed=i)
+
+    threads = []
+    encode = ArrowEncoder.encode
+
+    def record_thread(self, chunk):
+        threads.append(threading.get_ident())
+        return encode(self, chunk)
+
+    monkeypatch.setattr(ArrowEncoder, "encode", record_thread)
+    chunks = [chunk async for chunk in ExporterService.astream(rows(), ExportFormat.ARROW, chunk_size=2)]
+
+    assert len(threads) == 2 and threading.get_ident() not in threads
+    assert pa.ipc.open_stream(b"".join(chunks)).read_all().num_rows == 3
+    with pytest.raises(TypeError):
+        _ColumnarEncoder()
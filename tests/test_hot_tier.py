@@ -0,0 +1,151 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.api.services.vehicle_data_service import VehicleDataService
+from app.core.database.models import SortBy
+from app.core.hot_tier import HotTier, hot_tier
+from tests.conftest import TestingSessionLocal, client
+
+
+START = datetime(2032, 1, 1)
+
+
+def make_rows(vehicle_id, count, start=START, step=timedelta(minutes=1)):
+    return [
+        {
+            "vehicle_id": vehicle_id,
+            "timestamp": start + i * step,
+            "speed": float(i) if i % 3 else None,
+            "odometer": 1000.0 + i,
+            "soc": 50.0,
+            "elevation": 10.0,
+            "shift_state": "D" if i % 2 else None,
+        }
+        for i in range(count)
+    ]
+
+
+@pytest.fixture
+def loaded_hot_tier(test_db):
+    # The global hot tier, enabled and loaded on the test database
+    db = TestingSessionLocal()
+    VehicleDataService(db).add_vehicle_data_bulk(make_rows("hot_vehicle", 600))
+    enabled, hot_tier.enabled = hot_tier.enabled, True
+    hot_tier.load(db)
+    db.close()
+    yield hot_tier
+    hot_tier.clear()
+    hot_tier.enabled = enabled
+
+
+def test_unloaded_hot_tier_answers_nothing():
+    tier = HotTier()
+    tier.add(make_rows("a", 10))
+    assert tier.query("a", START) is None
+
+
+def test_query_matches_the_database(loaded_hot_tier):
+    db = TestingSessionLocal()
+    service = VehicleDataService(db)
+    initial = START + timedelta(hours=8)
+
+    for sort_by in (None, SortBy.ASC, SortBy.DESC):
+        for limit, skip in ((100, 0), (10, 5), (None, 0), (5, 1000)):
+            expected = service.get_vehicle_data(
+                vehicle_id="hot_vehicle", initial_timestamp=initial, final_timestamp=START + timedelta(hours=9),
+                sort_by=sort_by, limit=limit, skip=skip,
+            )
+            rows = loaded_hot_tier.query(
+                "hot_vehicle", initial, START + timedelta(hours=9), sort_by=sort_by, limit=limit, skip=skip
+            )
+            assert [row["timestamp"] for row in rows] == [vehicle.timestamp for vehicle in expected]
+            assert [row["speed"] for row in rows] == [vehicle.speed for vehicle in expected]
+            assert [row["shift_state"] for row in rows] == [vehicle.shift_state for vehicle in expected]
+    db.close()
+
+
+def test_ranges_before_the_window_go_to_the_database(loaded_hot_tier):
+    # 600 minutes of data, the last 6 hours are in memory
+    assert loaded_hot_tier.query("hot_vehicle", START) is None
+    assert loaded_hot_tier.query("hot_vehicle", None) is None
+    assert loaded_hot_tier.query("unknown_vehicle", START) is None
+    assert loaded_hot_tier.query("hot_vehicle", START + timedelta(hours=5)) is not None
+
+
+def test_writes_reach_the_hot_tier(loaded_hot_tier):
+    db = TestingSessionLocal()
+    VehicleDataService(db).add_vehicle_data_bulk(make_rows("hot_vehicle", 10, start=START + timedelta(hours=20)))
+    db.close()
+
+    rows = loaded_hot_tier.query("hot_vehicle", START + timedelta(hours=20))
+    assert len(rows) == 10
+
+    # The window moved on with the newest point
+    assert loaded_hot_tier.query("hot_vehicle", START + timedelta(hours=5)) is None
+
+
+def test_endpoint_serves_the_hot_tier(loaded_hot_tier):
+    response = client.get(
+        "/api/v1/vehicle_data/",
+        params={"vehicle_id": "hot_vehicle", "initial-timestamp": "2032-01-01T09:00:00Z", "limit": 3},
+    )
+    assert response.status_code == 200
+    assert [row["timestamp"] for row in response.json()] == [
+        "2032-01-01T09:00:00", "2032-01-01T09:01:00", "2032-01-01T09:02:00"
+    ]
+    assert loaded_hot_tier.stats()["hits"] >= 1
+
+
+def test_out_of_order_points_are_merged():
+    tier = HotTier()
+    tier.loaded = True
+    tier.add(make_rows("a", 5, start=START + timedelta(minutes=10)))
+    tier.add(make_rows("a", 5, start=START))
+
+    rows = tier.query("a", START)
+    assert [row["timestamp"] for row in rows] == sorted(row["timestamp"] for row in rows)
+    assert len(rows) == 10
+
+
+def test_memory_budget_evicts_least_recently_used_vehicles():
+    tier = HotTier(max_bytes=15000)
+    tier.loaded = True
+    tier.add(make_rows("a", 10))
+    tier.add(make_rows("b", 10))
+    assert tier.query("a", START) is None
+    assert tier.stats()["evictions"] == 1
+
+    # An evicted vehicle is not rebuilt from its new points only
+    tier.add(make_rows("a", 1, start=START + timedelta(hours=1)))
+    assert tier.query("a", START + timedelta(hours=1)) is None
+    assert tier.query("b", START) is not None
+
+
+def test_sorted_pages_are_served_from_the_hot_tier(loaded_hot_tier):
+    """
+    GIVEN a vehicle with its last hours in memory
+    WHEN an in-window range is paged in both sort orders, by the endpoint and with the hot tier disabled
+    THEN the pages come from the hot tier, with the rows and cursors of the database pages
+    """
+    params = {"vehicle_id": "hot_vehicle", "initial-timestamp": "2032-01-01T09:50:00Z", "limit": 3}
+
+    def read_pages(sort_by):
+        pages = []
+        cursor = {}
+        while True:
+            response = client.get("/api/v1/vehicle_data/", params={**params, "sort-by": sort_by, **cursor})
+            pages.append((response.json(), response.headers.get("X-Next-Cursor")))
+            if "X-Next-Cursor" not in response.headers:
+                return pages
+            cursor = {"cursor": response.headers["X-Next-Cursor"]}
+
+    for sort_by in ("ASC", "DESC"):
+        hits = loaded_hot_tier.stats()["hits"]
+        served = read_pages(sort_by)
+        assert loaded_hot_tier.stats()["hits"] - hits == len(served) == 4
+
+        loaded_hot_tier.enabled = False
+        expected = read_pages(sort_by)
+        loaded_hot_tier.enabled = True
+        assert served == expected
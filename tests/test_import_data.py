@@ -0,0 +1,96 @@
+import threading
+from datetime import datetime
+
+import pytest
+
+from app.api.services.vehicle_data_service import VehicleDataService
+from app.core.database.models import VehicleDatabase
+from scripts.import_data import import_data, import_files, read_csv_chunks
+from tests.conftest import TestingSessionLocal
+
+
+CSV_HEADER = "timestamp,speed,odometer,soc,elevation,shift_state\n"
+
+
+def write_csv(path, rows: int) -> str:
+    """
+    Write a CSV file in the format of the data/ directory with the given number of rows.
+    """
+    with open(path, "w") as csv_file:
+        csv_file.write(CSV_HEADER)
+        for i in range(rows):
+            speed = "NULL" if i % 2 else str(i)
+            csv_file.write(f"2022-07-12 16:{i // 60:02d}:{i % 60:02d}.5,{speed},40800.6,58,92,D\n")
+    return str(path)
+
+
+def test_read_csv_chunks(tmp_path):
+    """
+    GIVEN a CSV file with 5 rows
+    WHEN it is streamed in chunks of 2 rows
+    THEN the chunks hold 2, 2 and 1 parsed rows
+    """
+    csv_file_path = write_csv(tmp_path / "my_vehicle_id.csv", 5)
+
+    chunks = list(read_csv_chunks(csv_file_path, chunk_size=2))
+
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert chunks[0][0] == {
+        "vehicle_id": "my_vehicle_id",
+        "timestamp": datetime(2022, 7, 12, 16, 0, 0, 500000),
+        "speed": 0.0,
+        "odometer": 40800.6,
+        "soc": 58,
+        "elevation": 92.0,
+        "shift_state": "D",
+    }
+    assert chunks[0][1]["speed"] is None
+
+
+def test_import_data_in_batches(test_db, tmp_path):
+    csv_file_path = write_csv(tmp_path / "my_vehicle_id.csv", 25)
+
+    total = import_data(csv_file_path, batch_size=10, session_factory=TestingSessionLocal)
+
+    db = TestingSessionLocal()
+    assert total == 25
+    assert db.query(VehicleDatabase).filter_by(vehicle_id="my_vehicle_id").count() == 25
+    db.close()
+
+
+def test_import_files_with_parallel_parsers(test_db, tmp_path):
+    csv_file_paths = [write_csv(tmp_path / f"vehicle_{i}.csv", 30) for i in range(3)]
+
+    total = import_files(csv_file_paths, batch_size=7, workers=2, session_factory=TestingSessionLocal)
+
+    db = TestingSessionLocal()
+    assert total == 90
+    for i in range(3):
+        assert db.query(VehicleDatabase).filter_by(vehicle_id=f"vehicle_{i}").count() == 30
+    db.close()
+
+
+def test_import_files_stops_the_parsers_when_the_writer_fails(test_db, tmp_path, monkeypatch):
+    """
+    GIVEN parsers with more chunks than the queue holds
+    WHEN the writer fails on the first chunk
+    THEN the parsers are stopped and the error is raised, instead of the parsers blocking on the full queue
+    """
+    csv_file_paths = [write_csv(tmp_path / f"vehicle_{i}.csv", 200) for i in range(3)]
+
+    def fail(self, rows):
+        raise RuntimeError("writer failed")
+
+    monkeypatch.setattr(VehicleDataService, "add_vehicle_data_bulk", fail)
+    errors = []
+
+    def run():
+        with pytest.raises(RuntimeError, match="writer failed") as error:
+            import_files(csv_file_paths, batch_size=1, workers=2, session_factory=TestingSessionLocal)
+        errors.append(error)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout=30)
+    assert not thread.is_alive()
+    assert len(errors) == 1
@@ -0,0 +1,97 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert, select, update
+
+from app.api.services.latest_state_service import LatestStateService
+from app.api.services.vehicle_data_service import VehicleDataService
+from app.core.config import settings
+from app.core.database.migrations import migrate
+from app.core.database.models import LatestVehicleStateDatabase, VehicleDatabase
+from tests.conftest import TestingSessionLocal, client
+
+
+START = datetime(2032, 1, 1)
+
+
+def reading(vehicle_id, minutes, speed):
+    return {"vehicle_id": vehicle_id, "timestamp": START + timedelta(minutes=minutes), "speed": speed}
+
+
+def test_latest_state_keeps_the_newest_reading(test_db):
+    db = TestingSessionLocal()
+    service = VehicleDataService(db)
+    service.add_vehicle_data_bulk([reading("a", 1, 10.0), reading("a", 5, 50.0), reading("b", 2, 20.0)])
+    # History backfilled after the newest reading does not replace it
+    service.add_vehicle_data_bulk([reading("a", 3, 30.0), reading("b", 4, 40.0)])
+    service.add_vehicle_data(VehicleDatabase(vehicle_id="c", timestamp=START, speed=0.0))
+
+    states = LatestStateService(db).get_latest()
+    assert [(state["vehicle_id"], state["timestamp"], state["speed"]) for state in states] == [
+        ("a", START + timedelta(minutes=5), 50.0),
+        ("b", START + timedelta(minutes=4), 40.0),
+        ("c", START, 0.0),
+    ]
+    db.close()
+
+
+def test_latest_state_endpoint_since(test_db, monkeypatch):
+    monkeypatch.setattr(settings, "latest_state_since_overlap_seconds", 0)
+    db = TestingSessionLocal()
+    service = VehicleDataService(db)
+    service.add_vehicle_data_bulk([reading("a", 1, 10.0), reading("b", 1, 20.0)])
+
+    response = client.get("/api/v1/vehicles/latest")
+    assert response.status_code == 200
+    states = response.json()
+    assert [state["vehicle_id"] for state in states] == ["a", "b"]
+    since = max(state["updated_at"] for state in states)
+
+    # Only the vehicle with a newer reading changed since the previous poll
+    service.add_vehicle_data_bulk([reading("a", 0, 0.0), reading("b", 2, 25.0)])
+    db.close()
+    states = client.get("/api/v1/vehicles/latest", params={"since": since}).json()
+    assert [(state["vehicle_id"], state["speed"]) for state in states] == [("b", 25.0)]
+
+    states = client.get("/api/v1/vehicles/latest", params={"vehicle_id": ["a"]}).json()
+    assert [(state["vehicle_id"], state["speed"]) for state in states] == [("a", 10.0)]
+
+
+def test_polls_since_overlap_the_states_committed_late(test_db):
+    """
+    GIVEN a state whose write started before the newest `updated_at` of a poll, but committed after it
+    WHEN the next poll passes that `updated_at` as since
+    THEN the state is returned, along with the states of the overlap
+    """
+    db = TestingSessionLocal()
+    service = VehicleDataService(db)
+    service.add_vehicle_data_bulk([reading("a", 1, 10.0)])
+    since = LatestStateService(db).get_latest()[0]["updated_at"]
+
+    service.add_vehicle_data_bulk([reading("b", 1, 20.0)])
+    state = LatestVehicleStateDatabase
+    db.execute(update(state).where(state.vehicle_id == "b").values(updated_at=since - timedelta(seconds=1)))
+    db.commit()
+
+    assert [row["vehicle_id"] for row in LatestStateService(db).get_latest(since=since)] == ["a", "b"]
+    no_overlap = LatestStateService(db, since_overlap=timedelta(0)).get_latest(since=since)
+    assert no_overlap == []
+    db.close()
+
+
+def test_migration_fills_latest_state(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    VehicleDatabase.__table__.create(bind=engine)
+    with engine.begin() as connection:
+        connection.execute(insert(VehicleDatabase), [
+            reading("a", 1, 10.0), reading("a", 2, 20.0), reading("b", 1, 30.0),
+            {"vehicle_id": "b", "timestamp": None, "speed": 40.0},
+        ])
+
+    migrate(engine)
+
+    with engine.connect() as connection:
+        states = connection.execute(
+            select(LatestVehicleStateDatabase.vehicle_id, LatestVehicleStateDatabase.speed)
+            .order_by(LatestVehicleStateDatabase.vehicle_id)
+        ).all()
+    assert states == [("a", 20.0), ("b", 30.0)]
@@ -0,0 +1,111 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import orjson
+import pytest
+
+from app.api.endpoints.live import live_events
+from app.core.database.models import OverflowPolicy
+from app.core.pubsub import Broker, broker
+from tests.conftest import client
+
+
+START = datetime(2032, 1, 1)
+
+
+def reading(vehicle_id, seconds, speed=0.0):
+    return {"vehicle_id": vehicle_id, "timestamp": START + timedelta(seconds=seconds), "speed": speed}
+
+
+@pytest.mark.asyncio
+async def test_broker_fans_out_to_the_subscribers_of_a_vehicle():
+    live = Broker(max_queue=100)
+    subscription_a = live.subscribe(["a"])
+    subscription_ab = live.subscribe(["a", "b"])
+
+    live.publish([reading("a", 0), reading("b", 1), reading("c", 2)])
+    # Bursts are batched: the second write joins the first one's batch
+    live.publish([reading("a", 3, speed=30.0)])
+
+    points, dropped = await subscription_a.next_batch(max_batch=10)
+    assert [(point["vehicle_id"], point["speed"]) for point in points] == [("a", 0.0), ("a", 30.0)]
+    assert dropped == 0
+    points, _ = await subscription_ab.next_batch(max_batch=10)
+    assert sorted(point["vehicle_id"] for point in points) == ["a", "a", "b"]
+
+    # Points are pushed from writer threads too, with naive UTC timestamps
+    aware = START.replace(tzinfo=timezone(timedelta(hours=2)))
+    await asyncio.to_thread(live.publish, [{"vehicle_id": "a", "timestamp": aware}])
+    points, _ = await asyncio.wait_for(subscription_a.next_batch(max_batch=10), timeout=1)
+    assert points[0]["timestamp"] == START - timedelta(hours=2)
+
+    live.unsubscribe(subscription_a)
+    assert await subscription_a.next_batch(max_batch=10) is None
+    assert live.stats() == {"subscriptions": 1, "vehicles": 2}
+    live.unsubscribe(subscription_ab)
+    assert live.stats() == {"subscriptions": 0, "vehicles": 0}
+
+
+@pytest.mark.asyncio
+async def test_slow_subscribers_overflow():
+    live = Broker(max_queue=5)
+    subscription = live.subscribe(["a"])
+    live.publish([reading("a", i) for i in range(8)])
+    live.publish([reading("a", 8)])
+
+    # The oldest points are dropped, and the batch reports how many
+    points, dropped = await subscription.next_batch(max_batch=3)
+    assert [point["timestamp"] for point in points] == [START + timedelta(seconds=i) for i in (4, 5, 6)]
+    assert dropped == 4
+    points, dropped = await subscription.next_batch(max_batch=3)
+    assert len(points) == 2
+    assert dropped == 0
+
+    live = Broker(max_queue=5, overflow=OverflowPolicy.CLOSE)
+    subscription = live.subscribe(["a"])
+    live.publish([reading("a", i) for i in range(8)])
+    assert await subscription.next_batch(max_batch=10) is None
+    assert subscription.overflowed
+
+
+@pytest.mark.asyncio
+async def test_live_server_sent_events():
+    events = live_events(["sse_vehicle"])
+    event = asyncio.ensure_future(events.__anext__())
+    # Let the stream subscribe before writing
+    await asyncio.sleep(0)
+    broker.publish([reading("sse_vehicle", 0, speed=12.0), reading("other_vehicle", 0)])
+
+    message = await asyncio.wait_for(event, timeout=1)
+    assert message.startswith(b"data: ") and message.endswith(b"\n\n")
+    batch = orjson.loads(message[len(b"data: "):])
+    assert batch == {
+        "points": [{
+            "vehicle_id": "sse_vehicle", "timestamp": "2032-01-01T00:00:00", "speed": 12.0, "odometer": None,
+            "elevation": None, "soc": None, "shift_state": None,
+        }],
+        "dropped": 0,
+    }
+
+    await events.aclose()
+    assert broker.stats()["subscriptions"] == 0
+
+
+def test_live_websocket(test_db):
+    with client.websocket_connect("/api/v1/vehicles/live?vehicle_id=ws_vehicle&vehicle_id=other") as websocket:
+        response = client.post(
+            "/api/v1/vehicle_data/", json={"vehicle_id": "ws_vehicle", "timestamp": "2032-01-01T00:00:00", "speed": 42}
+        )
+        assert response.status_code == 200
+        client.post(
+            "/api/v1/vehicle_data/batch/",
+            json=[{"vehicle_id": "other", "timestamp": "2032-01-01T00:00:01"}, {"vehicle_id": "ignored"}],
+        )
+
+        batch = websocket.receive_json()
+        points = batch["points"]
+        if len(points) < 2:
+            points += websocket.receive_json()["points"]
+        assert [(point["vehicle_id"], point["speed"]) for point in points] == [("ws_vehicle", 42.0), ("other", None)]
+
+    assert broker.stats()["subscriptions"] == 0
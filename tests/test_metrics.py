@@ -0,0 +1,88 @@
+import pytest
+from sqlalchemy import create_engine, text
+
+from app.api.services.exporter_service import ExporterService
+from app.core.database.models import ExportFormat, VehicleDatabase
+from app.core.metrics import (
+    ROWS_EXPORTED,
+    SQL_ROWS_WRITTEN,
+    SQL_STATEMENT_DURATION,
+    Counter,
+    Histogram,
+    Metric,
+    Registry,
+    instrument_engine,
+)
+from tests.conftest import client
+
+
+def test_registry_renders_prometheus_text():
+    registry = Registry()
+    counter = Counter("things_total", "Number of things.", ["kind"], registry=registry)
+    histogram = Histogram("thing_seconds", "Duration of things.", buckets=(0.1, 1), registry=registry)
+
+    counter.labels('a"b').inc(2)
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    assert registry.render().splitlines() == [
+        "# HELP things_total Number of things.",
+        "# TYPE things_total counter",
+        'things_total{kind="a\\"b"} 2',
+        "# HELP thing_seconds Duration of things.",
+        "# TYPE thing_seconds histogram",
+        'thing_seconds_bucket{le="0.1"} 1',
+        'thing_seconds_bucket{le="1"} 2',
+        'thing_seconds_bucket{le="+Inf"} 3',
+        "thing_seconds_sum 5.55",
+        "thing_seconds_count 3",
+    ]
+
+
+def test_metric_types_implement_children_and_samples():
+    class Incomplete(Metric):
+        def _new_child(self):
+            return None
+
+    with pytest.raises(TypeError):
+        Incomplete("incomplete", "A metric without samples.", registry=None)
+
+
+def test_metrics_endpoint_records_requests_per_route(test_db):
+    client.get("/api/v1/vehicle_data/123456/")
+    client.get("/api/v1/vehicle_data/654321/")
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    lines = response.text.splitlines()
+    assert 'http_requests_total{method="GET",route="/api/v1/vehicle_data/{id}/",status="404"} 2' in lines
+    assert any(line.startswith('http_request_duration_seconds_count{method="GET",route="/api/v1/vehicle_data/{id}/"}') for line in lines)
+    assert 'http_requests_in_progress{method="GET",route="/metrics"} 1' in lines
+
+
+def test_instrumented_engine_times_statements():
+    engine = create_engine("sqlite://")
+    instrument_engine(engine)
+    selects = SQL_STATEMENT_DURATION.labels("SELECT")
+    inserts = SQL_ROWS_WRITTEN.labels("INSERT")
+    before = (sum(selects.counts), inserts.value)
+
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE t (x INTEGER)"))
+        connection.execute(text("INSERT INTO t VALUES (:x)"), [{"x": 1}, {"x": 2}])
+        connection.execute(text("SELECT * FROM t")).all()
+
+    assert sum(selects.counts) - before[0] == 1
+    assert inserts.value - before[1] == 2
+
+
+def test_export_counts_rows_exported():
+    exported = ROWS_EXPORTED.labels(ExportFormat.CSV.value)
+    before = exported.value
+
+    ExporterService.export([VehicleDatabase(vehicle_id="my_vehicle_id")] * 3, ExportFormat.CSV)
+
+    assert exported.value - before == 3
@@ -0,0 +1,48 @@
+from datetime import datetime
+
+from sqlalchemy import create_engine, inspect, text
+
+from app.api.services.vehicle_data_service import VehicleDataService
+from app.core.database.migrations import MIGRATIONS, migrate
+from app.core.database.models import SortBy
+from tests.conftest import TestingSessionLocal
+
+
+def test_migrate_existing_database(tmp_path):
+    """
+    GIVEN a database created before the composite index existed
+    WHEN it is migrated twice
+    THEN the composite index replaces the vehicle_id index, and the second run is a no-op
+    """
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as connection:
+        connection.execute(text(
+            "CREATE TABLE vehicle_data (id INTEGER PRIMARY KEY, vehicle_id VARCHAR NOT NULL, timestamp DATETIME, "
+            "speed FLOAT, odometer FLOAT, soc FLOAT, elevation FLOAT, shift_state VARCHAR)"
+        ))
+        connection.execute(text("CREATE INDEX ix_vehicle_data_vehicle_id ON vehicle_data (vehicle_id)"))
+
+    assert migrate(engine) == [version for version, _, _ in MIGRATIONS]
+    assert migrate(engine) == []
+
+    indexes = {index["name"] for index in inspect(engine).get_indexes("vehicle_data")}
+    assert "ix_vehicle_data_vehicle_id_timestamp" in indexes
+    assert "ix_vehicle_data_vehicle_id" not in indexes
+
+
+def test_get_vehicle_data_uses_composite_index(test_db):
+    """
+    The range filter and the sort of get_vehicle_data are both served by the composite index.
+    """
+    vehicle_data_service = VehicleDataService(db=TestingSessionLocal())
+
+    for sort_by in [SortBy.ASC, SortBy.DESC]:
+        plan = vehicle_data_service.explain_vehicle_data(
+            vehicle_id="my_vehicle_id",
+            initial_timestamp=datetime(2032, 1, 1),
+            final_timestamp=datetime(2032, 2, 1),
+            sort_by=sort_by,
+        )
+
+        assert any("ix_vehicle_data_vehicle_id_timestamp" in line for line in plan)
+        assert not any("TEMP B-TREE" in line for line in plan)
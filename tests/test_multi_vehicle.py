@@ -0,0 +1,91 @@
+import csv
+import io
+from datetime import datetime, timedelta
+
+from app.api.services import vehicle_data_service as vehicle_data_module
+from app.api.services.vehicle_data_service import VehicleDataService
+from app.core.database.models import SortBy
+from tests.conftest import TestingSessionLocal, client
+
+
+START = datetime(2032, 1, 1)
+
+
+def add_fleet():
+    # Three vehicles with interleaved readings, every vehicle one second apart from the others
+    rows = [
+        {"vehicle_id": vehicle_id, "timestamp": START + timedelta(seconds=3 * i + offset), "speed": float(i)}
+        for offset, vehicle_id in enumerate(["a", "b", "c"])
+        for i in range(10)
+    ]
+    db = TestingSessionLocal()
+    VehicleDataService(db).add_vehicle_data_bulk(rows)
+    db.close()
+    return sorted(rows, key=lambda row: row["timestamp"])
+
+
+def test_merged_vehicles_are_ordered_by_timestamp(test_db):
+    rows = add_fleet()
+    db = TestingSessionLocal()
+    service = VehicleDataService(db)
+
+    vehicles = service.get_vehicle_data(vehicle_id=["a", "c"], limit=None)
+    expected = [(row["vehicle_id"], row["timestamp"]) for row in rows if row["vehicle_id"] != "b"]
+    assert [(vehicle.vehicle_id, vehicle.timestamp) for vehicle in vehicles] == expected
+
+    vehicles = service.get_vehicle_data(vehicle_id=["a", "c"], sort_by=SortBy.DESC, limit=3, skip=1)
+    assert [(vehicle.vehicle_id, vehicle.timestamp) for vehicle in vehicles] == expected[::-1][1:4]
+
+    # All vehicles
+    rows_all = service.get_vehicle_data_rows(vehicle_id=None, limit=None)
+    assert [row["timestamp"] for row in rows_all] == [row["timestamp"] for row in rows]
+    db.close()
+
+
+def test_merged_vehicles_use_the_vehicle_timestamp_index(test_db):
+    db = TestingSessionLocal()
+    plan = "\n".join(VehicleDataService(db).explain_vehicle_data(vehicle_id=["a", "b"], sort_by=SortBy.ASC))
+    assert "MERGE (UNION ALL)" in plan
+    assert "ix_vehicle_data_vehicle_id_timestamp" in plan
+    assert "TEMP B-TREE" not in plan
+    db.close()
+
+
+def test_large_vehicle_sets_are_filtered_with_in(test_db, monkeypatch):
+    rows = add_fleet()
+    monkeypatch.setattr(vehicle_data_module, "MAX_MERGED_VEHICLES", 1)
+    db = TestingSessionLocal()
+    vehicles = VehicleDataService(db).get_vehicle_data(vehicle_id=["a", "b", "c"], limit=None)
+    assert [vehicle.timestamp for vehicle in vehicles] == [row["timestamp"] for row in rows]
+    db.close()
+
+
+def test_endpoint_pages_through_merged_vehicles(test_db):
+    rows = add_fleet()
+    expected = [row["timestamp"].isoformat() for row in rows if row["vehicle_id"] in ("a", "b")]
+
+    timestamps, cursor = [], None
+    while True:
+        params = {"vehicle_id": ["a", "b"], "limit": 6}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/api/v1/vehicle_data/", params=params)
+        assert response.status_code == 200
+        timestamps.extend(row["timestamp"] for row in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+
+    assert timestamps == expected
+
+
+def test_endpoint_exports_merged_vehicles(test_db):
+    rows = add_fleet()
+    response = client.get(
+        "/api/v1/vehicle_data/", params={"vehicle_id": ["b", "c"], "export-format": "CSV", "limit": 100}
+    )
+    assert response.status_code == 200
+    exported = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row["timestamp"] for row in exported] == [
+        row["timestamp"].isoformat() for row in rows if row["vehicle_id"] in ("b", "c")
+    ]
@@ -0,0 +1,168 @@
+import json
+from datetime import datetime, timedelta
+
+from app.api.services.async_vehicle_data_service import AsyncVehicleDataService
+from app.api.services.vehicle_data_service import VehicleDataService
+from app.core.database.models import SortBy, VehicleDatabase
+from tests.conftest import TestingSessionLocal, client
+
+
+def add_vehicles(count: int, vehicle_ids=("my_vehicle_id",)) -> None:
+    """
+    Add `count` readings, spread over the vehicles in turn, the vehicles sharing each timestamp.
+    """
+    db = TestingSessionLocal()
+    timestamp = datetime(2032, 1, 1, 0, 0, 0)
+    db.add_all(
+        VehicleDatabase(
+            vehicle_id=vehicle_ids[i % len(vehicle_ids)],
+            timestamp=timestamp + timedelta(days=i // len(vehicle_ids)),
+            speed=i,
+        )
+        for i in range(count)
+    )
+    db.commit()
+    db.close()
+
+
+def test_get_vehicle_data_page_follows_cursor(test_db):
+    """
+    GIVEN 7 readings of two vehicles, with duplicate timestamps
+    WHEN they are paged 3 at a time with cursors in both sort orders
+    THEN every reading is returned exactly once, in order
+    """
+    add_vehicles(7, vehicle_ids=("my_vehicle_id", "other_vehicle_id"))
+    vehicle_data_service = VehicleDataService(db=TestingSessionLocal())
+
+    for sort_by in [SortBy.ASC, SortBy.DESC]:
+        speeds = []
+        cursor = None
+        pages = 0
+        while True:
+            vehicles, cursor = vehicle_data_service.get_vehicle_data_page(
+                vehicle_id=["my_vehicle_id", "other_vehicle_id"], sort_by=sort_by, limit=3, cursor=cursor
+            )
+            speeds += [vehicle.speed for vehicle in vehicles]
+            pages += 1
+            if cursor is None:
+                break
+
+        expected = list(range(7))
+        assert speeds == (expected if sort_by == SortBy.ASC else expected[::-1])
+        assert pages == 3
+
+
+def test_get_vehicle_data_next_cursor_header(test_db):
+    add_vehicles(4)
+
+    response = client.get("/api/v1/vehicle_data/?vehicle_id=my_vehicle_id&sort-by=DESC&limit=3")
+    assert response.status_code == 200
+    assert [vehicle["speed"] for vehicle in response.json()] == [3, 2, 1]
+
+    next_cursor = response.headers["X-Next-Cursor"]
+    response = client.get(f"/api/v1/vehicle_data/?vehicle_id=my_vehicle_id&sort-by=DESC&limit=3&cursor={next_cursor}")
+    assert [vehicle["speed"] for vehicle in response.json()] == [0]
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_ndjson_and_export_pages_follow_the_cursor(test_db):
+    """
+    GIVEN 4 readings paged 3 at a time
+    WHEN the pages are read as NDJSON, then the page after the cursor is exported
+    THEN the NDJSON pages carry the next cursor, and both formats read the rows after it
+    """
+    add_vehicles(4)
+    params = {"vehicle_id": "my_vehicle_id", "sort-by": "DESC", "limit": 3}
+    ndjson = {"Accept": "application/x-ndjson"}
+
+    response = client.get("/api/v1/vehicle_data/", params=params, headers=ndjson)
+    assert [json.loads(line)["speed"] for line in response.text.splitlines()] == [3, 2, 1]
+    next_cursor = response.headers["X-Next-Cursor"]
+
+    response = client.get("/api/v1/vehicle_data/", params={**params, "cursor": next_cursor}, headers=ndjson)
+    assert [json.loads(line)["speed"] for line in response.text.splitlines()] == [0]
+    assert "X-Next-Cursor" not in response.headers
+
+    response = client.get("/api/v1/vehicle_data/", params={**params, "cursor": next_cursor, "export-format": "CSV"})
+    assert response.text.splitlines()[1:] == ["my_vehicle_id,2032-01-01T00:00:00,0.0,,,,"]
+
+
+def test_get_vehicle_data_invalid_cursor(test_db):
+    response = client.get("/api/v1/vehicle_data/?vehicle_id=my_vehicle_id&cursor=invalid")
+    assert response.status_code == 400
+
+
+def test_pages_keep_the_readings_without_timestamp(test_db):
+    """
+    GIVEN readings of two vehicles, some without timestamp
+    WHEN they are paged in both sort orders, or sorted in a single page
+    THEN the readings without timestamp come first in ascending order and last in descending order
+    """
+    add_vehicles(4, vehicle_ids=("my_vehicle_id", "other_vehicle_id"))
+    db = TestingSessionLocal()
+    db.add_all(VehicleDatabase(vehicle_id=vehicle_id, speed=speed) for vehicle_id, speed in [
+        ("my_vehicle_id", 10), ("other_vehicle_id", 11), ("my_vehicle_id", 12)
+    ])
+    db.commit()
+    db.close()
+
+    for vehicle_ids, expected in [
+        (["my_vehicle_id"], [10, 12, 0, 2]),
+        (["my_vehicle_id", "other_vehicle_id"], [10, 11, 12, 0, 1, 2, 3]),
+    ]:
+        params = [("vehicle_id", vehicle_id) for vehicle_id in vehicle_ids]
+        response = client.get("/api/v1/vehicle_data/", params=params + [("sort-by", "ASC"), ("limit", 10)])
+        assert [vehicle["speed"] for vehicle in response.json()] == expected
+
+        for sort_by, order in [("ASC", expected), ("DESC", expected[::-1])]:
+            for limit in [1, 2, 3]:
+                speeds = []
+                cursor = []
+                while True:
+                    response = client.get(
+                        "/api/v1/vehicle_data/", params=params + [("sort-by", sort_by), ("limit", limit)] + cursor
+                    )
+                    speeds += [vehicle["speed"] for vehicle in response.json()]
+                    if "X-Next-Cursor" not in response.headers:
+                        break
+                    cursor = [("cursor", response.headers["X-Next-Cursor"])]
+                assert speeds == order
+
+    # A time range leaves them out
+    response = client.get(
+        "/api/v1/vehicle_data/",
+        params={"vehicle_id": "my_vehicle_id", "sort-by": "DESC", "initial-timestamp": "2032-01-01T00:00:00"},
+    )
+    assert [vehicle["speed"] for vehicle in response.json()] == [2, 0]
+
+
+def test_ndjson_pages_are_streamed_with_the_next_cursor(test_db, monkeypatch):
+    """
+    GIVEN readings of two vehicles, some without timestamp
+    WHEN they are paged as NDJSON
+    THEN the pages and cursors are those of the JSON pages, and no page is read whole before it is sent
+    """
+    add_vehicles(5, vehicle_ids=("my_vehicle_id", "other_vehicle_id"))
+    db = TestingSessionLocal()
+    db.add_all([
+        VehicleDatabase(vehicle_id="my_vehicle_id", speed=10), VehicleDatabase(vehicle_id="other_vehicle_id", speed=11)
+    ])
+    db.commit()
+    db.close()
+
+    async def read_page(*args, **kwargs):
+        raise AssertionError("The page is read before the response starts")
+
+    monkeypatch.setattr(AsyncVehicleDataService, "get_vehicle_data_page", read_page)
+    params = [("vehicle_id", "my_vehicle_id"), ("vehicle_id", "other_vehicle_id"), ("limit", 2)]
+    for sort_by in ["ASC", "DESC"]:
+        cursor = []
+        while True:
+            page_params = params + [("sort-by", sort_by)] + cursor
+            ndjson = client.get("/api/v1/vehicle_data/", params=page_params, headers={"Accept": "application/x-ndjson"})
+            page = client.get("/api/v1/vehicle_data/", params=page_params)
+            assert [json.loads(line) for line in ndjson.text.splitlines()] == page.json()
+            assert ndjson.headers.get("X-Next-Cursor") == page.headers.get("X-Next-Cursor")
+            if "X-Next-Cursor" not in page.headers:
+                break
+            cursor = [("cursor", page.headers["X-Next-Cursor"])]
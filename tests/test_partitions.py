@@ -0,0 +1,230 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, func, inspect, select, text
+
+from app.api.services.async_vehicle_data_service import AsyncVehicleDataService
+from app.api.services.latest_state_service import LatestStateService
+from app.api.services.partition_service import PartitionService, retention_cutoff
+from app.api.services.trip_service import TripService
+from app.api.services.vehicle_data_service import VehicleDataService
+from app.core.config import settings
+from app.core.database.models import (
+    SortBy,
+    TripDatabase,
+    VehicleDatabase,
+    VehicleDataPartitionDatabase,
+    VehicleDataRollupDatabase,
+)
+from app.core.database.partitions import compact, partition_id_base
+from tests.conftest import TestingAsyncSessionLocal, TestingSessionLocal, client, engine
+
+
+# Six readings 6 hours apart, from the end of January into February
+START = datetime(2032, 1, 31, 12)
+
+
+def readings(start=START, count=6, step=timedelta(hours=6), vehicle_id="partitioned_vehicle", shift_state=None):
+    return [
+        {"vehicle_id": vehicle_id, "timestamp": start + step * i, "speed": float(i), "shift_state": shift_state}
+        for i in range(count)
+    ]
+
+
+def partition_names(db):
+    return db.execute(select(VehicleDataPartitionDatabase.name).order_by(VehicleDataPartitionDatabase.name)).scalars().all()
+
+
+def legacy_count(db):
+    return db.scalar(select(func.count()).select_from(VehicleDatabase))
+
+
+@pytest.fixture
+def partitioned(test_db, monkeypatch):
+    monkeypatch.setattr(settings, "partitioning_enabled", True)
+    yield
+    # The partition tables are not part of Base.metadata, so test_db does not drop them
+    db = TestingSessionLocal()
+    PartitionService(db).drop_partitions()
+    db.close()
+
+
+def test_readings_are_written_to_the_partition_of_their_month(partitioned):
+    """
+    GIVEN partitioning enabled
+    WHEN readings of two months and a reading without timestamp are written
+    THEN each month gets its partition, and the reads only touch the partitions of their range
+    """
+    db = TestingSessionLocal()
+    vehicle_data_service = VehicleDataService(db=db)
+    rows = readings() + [{"vehicle_id": "partitioned_vehicle", "timestamp": None}]
+    assert vehicle_data_service.add_vehicle_data_bulk(rows) == 7
+
+    assert partition_names(db) == ["vehicle_data_2032_01", "vehicle_data_2032_02"]
+    assert legacy_count(db) == 1
+
+    vehicles = vehicle_data_service.get_vehicle_data(
+        vehicle_id="partitioned_vehicle", initial_timestamp=START, sort_by=SortBy.ASC, limit=10
+    )
+    assert [vehicle.timestamp for vehicle in vehicles] == [row["timestamp"] for row in readings()]
+    # The ids of a partition start at the base of its month, so they are unique across partitions
+    assert all(vehicle.id > partition_id_base(datetime(2032, 1, 1)) for vehicle in vehicles)
+    assert vehicle_data_service.get_vehicle_data_by_id(vehicles[3].id).timestamp == vehicles[3].timestamp
+
+    plan = vehicle_data_service.explain_vehicle_data(
+        vehicle_id="partitioned_vehicle",
+        initial_timestamp=datetime(2032, 2, 1),
+        final_timestamp=datetime(2032, 2, 2),
+        sort_by=SortBy.DESC,
+    )
+    assert any("ix_vehicle_data_2032_02_vehicle_id_timestamp" in line for line in plan)
+    assert not any("vehicle_data_2032_01" in line for line in plan)
+
+    # A retried batch is skipped in every partition
+    assert vehicle_data_service.add_vehicle_data_bulk(readings()) == 0
+    db.close()
+
+
+def test_endpoints_read_across_partitions(partitioned):
+    for row in readings():
+        response = client.post(
+            "/api/v1/vehicle_data/",
+            json={"vehicle_id": row["vehicle_id"], "timestamp": row["timestamp"].isoformat(), "speed": row["speed"]},
+        )
+        assert response.status_code == 200
+
+    # Cursor pages go through the partition boundary
+    timestamps = []
+    url = "/api/v1/vehicle_data/?vehicle_id=partitioned_vehicle&sort-by=ASC&limit=4"
+    response = client.get(url)
+    timestamps += [row["timestamp"] for row in response.json()]
+    response = client.get(f"{url}&cursor={response.headers['X-Next-Cursor']}")
+    timestamps += [row["timestamp"] for row in response.json()]
+    assert "X-Next-Cursor" not in response.headers
+    assert timestamps == [row["timestamp"].isoformat() for row in readings()]
+
+    response = client.get("/api/v1/vehicle_data/aggregate/?vehicle_id=partitioned_vehicle&bucket=1d")
+    assert [aggregate["count"] for aggregate in response.json()] == [2, 4]
+
+
+@pytest.mark.asyncio
+async def test_async_writes_are_partitioned(partitioned):
+    async with TestingAsyncSessionLocal() as db:
+        vehicle_data_service = AsyncVehicleDataService(db=db)
+        assert await vehicle_data_service.add_vehicle_data_bulk(readings()) == 6
+
+        vehicle = await vehicle_data_service.add_vehicle_data(VehicleDatabase(**readings()[0]))
+        assert vehicle.id > partition_id_base(datetime(2032, 1, 1))
+        assert (await vehicle_data_service.get_vehicle_data_by_id(vehicle.id)).timestamp == START
+
+
+def test_retention_drops_expired_partitions_and_derived_state(partitioned, monkeypatch):
+    """
+    GIVEN trips in January, across the end of January and in March, and a December reading in vehicle_data
+    WHEN the readings before February are expired
+    THEN the January partition is dropped, and the rollups, trips and latest states follow
+    """
+    db = TestingSessionLocal()
+    vehicle_data_service = VehicleDataService(db=db)
+    minute = timedelta(minutes=1)
+    vehicle_data_service.add_vehicle_data_bulk(
+        readings(datetime(2032, 1, 10), 5, minute, shift_state="D")
+        + readings(datetime(2032, 1, 31, 23, 58), 5, minute, shift_state="D")
+        + readings(datetime(2032, 3, 10), 5, minute, shift_state="D")
+        + readings(datetime(2032, 1, 10), 5, minute, vehicle_id="expired_vehicle")
+    )
+    monkeypatch.setattr(settings, "partitioning_enabled", False)
+    vehicle_data_service.add_vehicle_data_bulk(readings(datetime(2031, 12, 31), 1))
+    assert len(TripService(db).get_trips("partitioned_vehicle")) == 3
+
+    dropped, deleted = PartitionService(db).apply_retention(datetime(2032, 2, 15))
+
+    assert dropped == ["vehicle_data_2032_01"]
+    assert deleted == 1
+    assert "vehicle_data_2032_01" not in inspect(engine).get_table_names()
+    assert db.scalar(select(func.min(VehicleDataRollupDatabase.bucket_start))) >= datetime(2032, 2, 1)
+    assert [state["vehicle_id"] for state in LatestStateService(db).get_latest()] == ["partitioned_vehicle"]
+
+    # The trip across the cutoff is segmented again from its remaining readings
+    trips = TripService(db).get_trips("partitioned_vehicle")
+    assert [(trip.start_timestamp, trip.count) for trip in trips] == [
+        (datetime(2032, 2, 1), 3), (datetime(2032, 3, 10), 5)
+    ]
+    assert db.scalar(select(func.count()).select_from(TripDatabase)) == 2
+    db.close()
+
+
+def test_retention_cutoff():
+    assert retention_cutoff(3, now=datetime(2032, 5, 15, 12)) == datetime(2032, 2, 1)
+    assert retention_cutoff(1, now=datetime(2032, 1, 1)) == datetime(2031, 12, 1)
+
+
+def test_move_legacy_readings_into_partitions(test_db):
+    """
+    GIVEN readings written to vehicle_data before partitioning
+    WHEN they are moved to partitions
+    THEN they keep their ids, and only the readings without timestamp stay in vehicle_data
+    """
+    db = TestingSessionLocal()
+    vehicle_data_service = VehicleDataService(db=db)
+    vehicle_data_service.add_vehicle_data_bulk(readings() + [{"vehicle_id": "partitioned_vehicle", "timestamp": None}])
+    before = [
+        (vehicle.id, vehicle.timestamp)
+        for vehicle in vehicle_data_service.get_vehicle_data(vehicle_id="partitioned_vehicle", sort_by=SortBy.ASC)
+    ]
+
+    try:
+        assert PartitionService(db).move_legacy(chunk_size=4) == 6
+        assert partition_names(db) == ["vehicle_data_2032_01", "vehicle_data_2032_02"]
+        assert legacy_count(db) == 1
+
+        after = [
+            (vehicle.id, vehicle.timestamp)
+            for vehicle in vehicle_data_service.get_vehicle_data(vehicle_id="partitioned_vehicle", sort_by=SortBy.ASC)
+        ]
+        assert after == before
+        assert vehicle_data_service.get_vehicle_data_by_id(before[-1][0]).timestamp == before[-1][1]
+    finally:
+        PartitionService(db).drop_partitions()
+        db.close()
+
+
+def test_legacy_readings_written_again_are_duplicates(test_db, monkeypatch):
+    """
+    GIVEN readings written to vehicle_data before partitioning
+    WHEN they are written again once partitioning is enabled
+    THEN they are reported as duplicates instead of being stored again in their partition
+    """
+    db = TestingSessionLocal()
+    vehicle_data_service = VehicleDataService(db=db)
+    vehicle_data_service.add_vehicle_data_bulk(readings(count=2))
+
+    monkeypatch.setattr(settings, "partitioning_enabled", True)
+    try:
+        assert vehicle_data_service.insert_vehicle_data(readings(count=3)) == [False, False, True]
+        assert legacy_count(db) == 2
+        assert len(vehicle_data_service.get_vehicle_data(vehicle_id="partitioned_vehicle", limit=10)) == 3
+    finally:
+        PartitionService(db).drop_partitions()
+        db.close()
+
+
+def test_compact_reclaims_free_pages(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'compact.db'}")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE readings (value BLOB)"))
+        connection.execute(text(
+            "INSERT INTO readings WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 1000) "
+            "SELECT randomblob(1000) FROM n"
+        ))
+
+    # The first compaction switches the database to incremental auto-vacuum
+    compact(engine)
+    with engine.begin() as connection:
+        assert connection.execute(text("PRAGMA auto_vacuum")).scalar() == 2
+        connection.execute(text("DELETE FROM readings"))
+        assert connection.execute(text("PRAGMA freelist_count")).scalar() > 0
+
+    compact(engine)
+    with engine.connect() as connection:
+        assert connection.execute(text("PRAGMA freelist_count")).scalar() == 0
@@ -0,0 +1,221 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import orjson
+import pytest
+
+from app.api.services.resample_service import RESAMPLED_FIELDS, ResampleService, Resampler, columns_to_points
+from app.api.services.vehicle_data_service import VehicleDataService
+from app.core.config import settings
+from app.core.database.models import FillStrategy
+from tests.conftest import TestingAsyncSessionLocal, TestingSessionLocal, client
+
+
+START = datetime(2032, 1, 1)
+
+FILLS = {
+    "speed": FillStrategy.LINEAR,
+    "odometer": FillStrategy.FFILL,
+    "elevation": FillStrategy.NONE,
+    "soc": FillStrategy.LINEAR,
+    "shift_state": FillStrategy.FFILL,
+}
+
+
+def make_readings(count, seed=0):
+    # Irregular readings, 1 to 90 seconds apart, with missing values
+    random = np.random.default_rng(seed)
+    offsets = np.cumsum(random.integers(1, 90, count))
+    return [
+        {
+            "vehicle_id": "resampled_vehicle",
+            "timestamp": START + timedelta(seconds=int(offset)),
+            "speed": None if random.random() < 0.3 else float(random.integers(0, 120)),
+            "odometer": 1000.0 + i,
+            "elevation": float(i),
+            "soc": None if random.random() < 0.5 else 80.0 - i / 10,
+            "shift_state": None if random.random() < 0.3 else "D",
+        }
+        for i, offset in enumerate(offsets)
+    ]
+
+
+def to_columns(chunk):
+    values = {
+        field: np.array([row[field] for row in chunk], dtype=object if field == "shift_state" else np.float64)
+        for field in RESAMPLED_FIELDS
+    }
+    return np.array([row["timestamp"] for row in chunk], dtype="datetime64[us]"), values
+
+
+def resample(readings, step, chunk_size, **kwargs):
+    resampler = Resampler(step, FILLS, chunk_size=7, **kwargs)
+    points = []
+    for i in range(0, len(readings), chunk_size):
+        timestamps, values = to_columns(readings[i:i + chunk_size])
+        for columns in resampler.feed(timestamps, values):
+            points.extend(columns_to_points("resampled_vehicle", columns))
+    for columns in resampler.finish():
+        points.extend(columns_to_points("resampled_vehicle", columns))
+    return points
+
+
+def test_streamed_resampling_matches_single_pass():
+    readings = make_readings(500)
+    step = timedelta(seconds=30)
+    expected = resample(readings, step, chunk_size=len(readings))
+    assert resample(readings, step, chunk_size=13) == expected
+    assert resample(readings, step, chunk_size=1) == expected
+
+    # The grid starts at the first reading rounded up, and ends at the last reading
+    assert timedelta(0) <= expected[0].timestamp - readings[0]["timestamp"] < step
+    assert (expected[0].timestamp - START) % step == timedelta(0)
+    assert timedelta(0) <= readings[-1]["timestamp"] - expected[-1].timestamp < step
+    assert all(b.timestamp - a.timestamp == step for a, b in zip(expected, expected[1:]))
+
+
+def test_fill_strategies():
+    readings = [
+        {"timestamp": START, "speed": 0.0, "odometer": 10.0, "elevation": 1.0, "soc": None, "shift_state": "P"},
+        {"timestamp": START + timedelta(seconds=40), "speed": 40.0, "odometer": None, "elevation": 2.0, "soc": 50.0,
+         "shift_state": None},
+    ]
+    points = resample(readings, timedelta(seconds=10), chunk_size=1)
+
+    assert [point.speed for point in points] == [0.0, 10.0, 20.0, 30.0, 40.0]
+    assert [point.odometer for point in points] == [10.0] * 5
+    assert [point.elevation for point in points] == [1.0, None, None, None, 2.0]
+    # No value before the first known one, and no extrapolation
+    assert [point.soc for point in points] == [None, None, None, None, 50.0]
+    assert [point.shift_state for point in points] == ["P"] * 5
+
+
+def test_resample_endpoint(test_db):
+    db = TestingSessionLocal()
+    VehicleDataService(db).add_vehicle_data_bulk([
+        {"vehicle_id": "resampled_vehicle", "timestamp": START + timedelta(minutes=i), "speed": 10.0 * i,
+         "odometer": 100.0 + i, "elevation": 5.0, "soc": None, "shift_state": "D"}
+        for i in range(0, 10, 2)
+    ])
+    db.close()
+
+    params = {
+        "vehicle_id": "resampled_vehicle",
+        "interval": 30,
+        "initial-timestamp": "2032-01-01T00:01:00",
+        "final-timestamp": "2032-01-01T00:03:00",
+    }
+    response = client.get("/api/v1/vehicle_data/resample/", params=params)
+    assert response.status_code == 200
+    points = response.json()
+    assert [point["timestamp"] for point in points] == [
+        "2032-01-01T00:01:00", "2032-01-01T00:01:30", "2032-01-01T00:02:00", "2032-01-01T00:02:30",
+        "2032-01-01T00:03:00",
+    ]
+    # The readings just outside the range fill its edges
+    assert [point["speed"] for point in points] == pytest.approx([10.0, 15.0, 20.0, 25.0, 30.0])
+    assert [point["shift_state"] for point in points] == ["D"] * 5
+
+    response = client.get(
+        "/api/v1/vehicle_data/resample/", params=dict(params, **{"speed-fill": "none"}),
+        headers={"Accept": "application/x-ndjson"},
+    )
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    points = [orjson.loads(line) for line in response.text.splitlines()]
+    assert [point["speed"] for point in points] == [None, None, 20.0, None, None]
+
+    response = client.get("/api/v1/vehicle_data/resample/", params=dict(params, **{"shift-state-fill": "linear"}))
+    assert response.status_code == 400
+
+
+def test_run_of_nulls_does_not_hold_back_interpolation():
+    """
+    GIVEN readings whose linearly filled speed is NULL after the first one
+    WHEN they are fed in chunks, with the next known speed given ahead
+    THEN the grid points are produced as the chunks are fed, and only the last readings are kept
+    """
+    readings = [
+        {"timestamp": START + timedelta(seconds=i), "speed": 0.0 if i == 0 else None, "odometer": float(i),
+         "elevation": None, "soc": None, "shift_state": None}
+        for i in range(20000)
+    ]
+    resampler = Resampler(timedelta(seconds=10), FILLS)
+    resampler.set_upcoming("speed", None)
+    resampler.set_upcoming("soc", None)
+
+    produced = 0
+    for i in range(0, len(readings), 1000):
+        timestamps, values = to_columns(readings[i:i + 1000])
+        produced += sum(len(columns["timestamp"]) for columns in resampler.feed(timestamps, values))
+        assert produced >= (i + 1000) // 10 - 1
+        assert sum(len(chunk[0]) for chunk in resampler.chunks) <= 10
+
+    # The same grid as when every reading is buffered until the end
+    points = []
+    for columns in resampler.finish():
+        points.extend(columns_to_points("resampled_vehicle", columns))
+    assert produced + len(points) == len(resample(readings, timedelta(seconds=10), chunk_size=1000))
+
+
+def test_upcoming_value_interpolates_across_chunks():
+    readings = [
+        {"timestamp": START + timedelta(seconds=i), "speed": None, "odometer": None, "elevation": None,
+         "soc": None, "shift_state": None}
+        for i in range(101)
+    ]
+    readings[0]["speed"], readings[100]["speed"] = 0.0, 100.0
+    expected = resample(readings, timedelta(seconds=5), chunk_size=len(readings))
+
+    resampler = Resampler(timedelta(seconds=5), FILLS, chunk_size=7)
+    resampler.set_upcoming("speed", START + timedelta(seconds=100), 100.0)
+    points = []
+    for i in range(0, len(readings), 30):
+        timestamps, values = to_columns(readings[i:i + 30])
+        for columns in resampler.feed(timestamps, values):
+            points.extend(columns_to_points("resampled_vehicle", columns))
+        # Every grid point before the last reading fed is produced
+        assert points[-1].timestamp >= START + timedelta(seconds=min(i + 30, 100) - 5)
+    for columns in resampler.finish():
+        points.extend(columns_to_points("resampled_vehicle", columns))
+    assert points == expected
+    assert [point.speed for point in points[:3]] == [0.0, 5.0, 10.0]
+
+
+@pytest.mark.asyncio
+async def test_streamed_service_looks_up_the_next_known_values(test_db):
+    readings = make_readings(200)
+    for row in readings[20:150]:
+        row["speed"] = None
+    db = TestingSessionLocal()
+    VehicleDataService(db).add_vehicle_data_bulk(readings)
+    db.close()
+
+    async with TestingAsyncSessionLocal() as db:
+        service = ResampleService(db)
+        expected = [point async for point in service.resample("resampled_vehicle", timedelta(seconds=30), FILLS)]
+        streamed = [
+            point async for point in service.resample("resampled_vehicle", timedelta(seconds=30), FILLS, chunk_size=3)
+        ]
+    assert streamed == expected
+    assert expected == resample(readings, timedelta(seconds=30), chunk_size=len(readings))
+
+
+def test_resample_endpoint_limits_the_grid(test_db, monkeypatch):
+    db = TestingSessionLocal()
+    VehicleDataService(db).add_vehicle_data_bulk([
+        {"vehicle_id": "resampled_vehicle", "timestamp": START + timedelta(minutes=i), "speed": float(i)}
+        for i in range(10)
+    ])
+    db.close()
+    monkeypatch.setattr(settings, "resample_max_points", 10)
+
+    # The range of the readings gives 10 points at 1 minute, and 541 points at 1 second
+    response = client.get("/api/v1/vehicle_data/resample/", params={"vehicle_id": "resampled_vehicle", "interval": 60})
+    assert len(response.json()) == 10
+    response = client.get("/api/v1/vehicle_data/resample/", params={"vehicle_id": "resampled_vehicle", "interval": 1})
+    assert response.status_code == 400
+    response = client.get(
+        "/api/v1/vehicle_data/resample/",
+        params={"vehicle_id": "resampled_vehicle", "interval": 60, "final-timestamp": "2032-01-02T00:00:00"},
+    )
+    assert response.status_code == 400
@@ -0,0 +1,117 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, select
+
+from app.api.services.aggregation_service import build_aggregate_statement
+from app.api.services.rollup_service import RollupService, build_rollup_statement, is_aligned, rollup_to_aggregate
+from app.api.services.vehicle_data_service import VehicleDataService
+from app.core.database.models import BucketWidth, VehicleDataRollupDatabase
+from tests.conftest import TestingSessionLocal, client
+
+
+def add_readings() -> None:
+    """
+    Add readings over two hours in three writes, out of time order.
+    """
+    start = datetime(2032, 1, 1, 10, 0, 0)
+
+    def reading(minutes: int, speed: float, odometer: float, shift_state: str) -> dict:
+        return {
+            "vehicle_id": "my_vehicle_id",
+            "timestamp": start + timedelta(minutes=minutes),
+            "speed": speed,
+            "odometer": odometer,
+            "soc": 90 - minutes / 10,
+            "elevation": 10 + minutes,
+            "shift_state": shift_state,
+        }
+
+    vehicle_data_service = VehicleDataService(db=TestingSessionLocal())
+    vehicle_data_service.add_vehicle_data_bulk([reading(50, 30, 105, "D"), reading(70, 45, 110, "D")])
+    vehicle_data_service.add_vehicle_data_bulk([reading(5, 10, 100, "P"), reading(30, None, None, "D")])
+
+    response = client.post(
+        "/api/v1/vehicle_data/",
+        json={**reading(100, 0, 112, "P"), "timestamp": "2032-01-01T11:40:00"},
+    )
+    assert response.status_code == 200
+
+
+def read_rollups(db, bucket_width: BucketWidth) -> list:
+    return [
+        rollup_to_aggregate(rollup, shift_state).dict()
+        for rollup, shift_state in db.execute(build_rollup_statement("my_vehicle_id", bucket_width))
+    ]
+
+
+def read_raw_aggregates(db, bucket_width: BucketWidth) -> list:
+    return [
+        {**row._asdict(), "bucket_start": datetime.utcfromtimestamp(row.bucket)}
+        for row in db.execute(build_aggregate_statement("my_vehicle_id", bucket_width))
+    ]
+
+
+def assert_same_aggregates(rollups: list, raw_aggregates: list) -> None:
+    assert len(rollups) == len(raw_aggregates)
+    for rollup, raw_aggregate in zip(rollups, raw_aggregates):
+        for key, value in rollup.items():
+            if isinstance(value, float):
+                assert abs(value - raw_aggregate[key]) < 1e-9, key
+            else:
+                assert value == raw_aggregate[key], key
+
+
+def test_rollups_match_raw_aggregates(test_db):
+    """
+    GIVEN readings written in several batches and out of time order
+    WHEN the rollups are read at every resolution
+    THEN they match the aggregates computed from the raw rows
+    """
+    add_readings()
+    db = TestingSessionLocal()
+
+    for bucket_width in [BucketWidth.ONE_MINUTE, BucketWidth.ONE_HOUR, BucketWidth.ONE_DAY]:
+        assert_same_aggregates(read_rollups(db, bucket_width), read_raw_aggregates(db, bucket_width))
+
+    first, second = read_rollups(db, BucketWidth.ONE_HOUR)
+    assert (first["count"], first["odometer_first"], first["odometer_last"], first["shift_state"]) == (3, 100, 105, "D")
+    assert (second["count"], second["odometer_first"], second["odometer_last"]) == (2, 110, 112)
+    db.close()
+
+
+def test_rebuild_rollups(test_db):
+    add_readings()
+    db = TestingSessionLocal()
+    expected = read_rollups(db, BucketWidth.ONE_HOUR)
+
+    db.execute(delete(VehicleDataRollupDatabase))
+    db.commit()
+    assert read_rollups(db, BucketWidth.ONE_HOUR) == []
+
+    assert RollupService(db).rebuild(chunk_size=2) == 5
+    assert read_rollups(db, BucketWidth.ONE_HOUR) == expected
+    assert db.execute(select(VehicleDataRollupDatabase)).scalars().first() is not None
+    db.close()
+
+
+def test_rollup_and_raw_paths_bound_the_range_alike(test_db):
+    """
+    GIVEN a reading at the final timestamp of a range aligned on minutes
+    WHEN the range is aggregated from the rollups and from the raw rows
+    THEN both leave the reading at the final timestamp out, and a sub-second bound is not aligned
+    """
+    add_readings()
+    initial, final = datetime(2032, 1, 1, 10), datetime(2032, 1, 1, 11, 40)
+    params = {"vehicle_id": "my_vehicle_id", "bucket": "1m", "initial-timestamp": initial.isoformat()}
+
+    rollups = client.get("/api/v1/vehicle_data/aggregate/", params={**params, "final-timestamp": final.isoformat()})
+    db = TestingSessionLocal()
+    raw = db.execute(build_aggregate_statement("my_vehicle_id", BucketWidth.ONE_MINUTE, initial, final)).all()
+    db.close()
+    assert [bucket["count"] for bucket in rollups.json()] == [row.count for row in raw] == [1, 1, 1, 1]
+
+    # Half a second past the boundary, the range is aggregated from the raw rows and takes the reading in
+    final = "2032-01-01T11:40:00.500000"
+    assert not is_aligned(datetime.fromisoformat(final), BucketWidth.ONE_MINUTE)
+    response = client.get("/api/v1/vehicle_data/aggregate/", params={**params, "final-timestamp": final})
+    assert len(response.json()) == 5
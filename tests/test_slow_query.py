@@ -0,0 +1,144 @@
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.orm import sessionmaker
+
+from app.api.services.vehicle_data_service import VehicleDataService
+from app.core.cache import query_cache
+from app.core.config import settings
+from app.core.database.models import Base, SortBy, VehicleDatabase
+from app.core.database.slow_query import SlowQueryLog, slow_query_log
+from tests.conftest import client
+
+
+def create_session_factory(log: SlowQueryLog):
+    engine = create_engine("sqlite://")
+    log.instrument(engine)
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)
+
+
+def test_slow_queries_are_logged_with_their_plan(caplog):
+    """
+    GIVEN a slow-query log catching every statement
+    WHEN the same query runs twice with different parameters
+    THEN both runs are logged, and the plan of their shared shape is captured once
+    """
+    log = SlowQueryLog(threshold_ms=0.000001)
+    session_factory = create_session_factory(log)
+    db = session_factory()
+    db.execute(insert(VehicleDatabase), [{"vehicle_id": "my_vehicle_id", "timestamp": datetime(2032, 1, 1)}])
+    db.commit()
+    log.clear()
+
+    cache_enabled, query_cache.enabled = query_cache.enabled, False
+    try:
+        service = VehicleDataService(db)
+        service.get_vehicle_data(vehicle_id="my_vehicle_id", sort_by=SortBy.ASC)
+        service.get_vehicle_data(vehicle_id="other_vehicle_id", sort_by=SortBy.ASC)
+    finally:
+        query_cache.enabled = cache_enabled
+
+    # Each read also looks up the partitions of its range
+    report = log.report()
+    selects = [query for query in report["queries"] if query["statement"].startswith("SELECT vehicle_data.")]
+    assert [query["parameters"][0] for query in selects] == ["other_vehicle_id", "my_vehicle_id"]
+    assert all(query["duration_ms"] > 0 for query in selects)
+
+    shapes = [shape for shape in report["plans"] if shape["statement"].startswith("SELECT vehicle_data.")]
+    assert len(shapes) == 1
+    assert shapes[0]["count"] == 2
+    assert any("ix_vehicle_data_vehicle_id_timestamp" in line for line in shapes[0]["plan"])
+    assert "Slow query" in caplog.text
+    db.close()
+
+
+def test_fast_queries_are_not_logged():
+    log = SlowQueryLog(threshold_ms=10000)
+    db = create_session_factory(log)()
+
+    VehicleDataService(db).get_vehicle_data(vehicle_id="my_vehicle_id")
+
+    assert log.report()["queries"] == []
+    db.close()
+
+
+def test_fetches_are_timed_and_counted():
+    """
+    GIVEN a SELECT on SQLite whose rows are slow to compute, which happens as they are fetched
+    WHEN its rows are fetched
+    THEN the fetches count in its duration, and its rows are counted
+    """
+    log = SlowQueryLog(threshold_ms=40)
+    engine = create_engine("sqlite://")
+
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        dbapi_connection.create_function("slow", 1, lambda value: time.sleep(0.01) or value)
+
+    log.instrument(engine)
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql(
+            "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 8) SELECT slow(i) FROM n"
+        ).all()
+
+    assert len(rows) == 8
+    [query] = log.report()["queries"]
+    assert query["rows"] == 8
+    assert query["duration_ms"] >= 80
+
+
+def test_failed_explain_is_rolled_back_to_a_savepoint():
+    """
+    GIVEN a slow query on Postgres, where a failed statement aborts the transaction
+    WHEN its EXPLAIN fails
+    THEN it is rolled back to a savepoint, so the transaction of the caller goes on
+    """
+    executed = []
+
+    class Cursor:
+        def execute(self, statement, parameters=None):
+            executed.append(statement)
+            if statement.startswith("EXPLAIN"):
+                raise Exception("relation does not exist")
+
+        def close(self):
+            pass
+
+    conn = SimpleNamespace(dialect=SimpleNamespace(name="postgresql"), connection=SimpleNamespace(cursor=Cursor))
+    assert SlowQueryLog.explain(conn, "SELECT 1", {}) == ["EXPLAIN failed: relation does not exist"]
+    assert executed == [
+        "SAVEPOINT slow_query_explain",
+        "EXPLAIN SELECT 1",
+        "ROLLBACK TO SAVEPOINT slow_query_explain",
+        "RELEASE SAVEPOINT slow_query_explain",
+    ]
+
+
+def test_slow_queries_endpoint(monkeypatch):
+    slow_query_log.clear()
+
+    response = client.get("/api/v1/debug/slow_queries/")
+
+    assert response.status_code == 200
+    assert response.json() == {"threshold_ms": slow_query_log.threshold_ms, "queries": [], "plans": []}
+
+    slow_query_log.queries.append(
+        {
+            "timestamp": datetime(2032, 1, 1),
+            "statement": "SELECT 1",
+            "parameters": ("my_vehicle_id", datetime(2032, 1, 1)),
+            "executemany": False,
+            "duration_ms": 600.0,
+            "rows": None,
+        }
+    )
+    response = client.get("/api/v1/debug/slow_queries/")
+    assert response.json()["queries"][0]["parameters"] is None
+
+    monkeypatch.setattr(settings, "slow_query_expose_parameters", True)
+    response = client.get("/api/v1/debug/slow_queries/")
+    assert response.json()["queries"][0]["parameters"] == ["my_vehicle_id", "2032-01-01T00:00:00"]
+    slow_query_log.clear()
@@ -0,0 +1,226 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import update
+from sqlalchemy.dialects import postgresql
+
+from app.api.services.trip_service import TripService, segment_trips
+from app.api.services.vehicle_data_service import VehicleDataService
+from app.core.database.models import TripDatabase, TripSegmentationDatabase
+from tests.conftest import TestingSessionLocal, client
+
+
+START = datetime(2032, 1, 1)
+MAX_GAP = timedelta(minutes=10)
+
+
+def make_trip(start, count, shift_state="D", odometer=1000.0, soc=80.0, vehicle_id="trip_vehicle"):
+    # One reading a minute, driving at 60 km/h
+    return [
+        {
+            "vehicle_id": vehicle_id,
+            "timestamp": start + timedelta(minutes=i),
+            "speed": 60.0 if shift_state in ("D", "R") else 0.0,
+            "odometer": odometer + (i if shift_state in ("D", "R") else 0),
+            "soc": soc - (i if shift_state in ("D", "R") else 0),
+            "elevation": 10.0 + i,
+            "shift_state": shift_state,
+        }
+        for i in range(count)
+    ]
+
+
+def segment(rows, **kwargs):
+    return segment_trips(
+        "trip_vehicle",
+        np.array([row["timestamp"] for row in rows], dtype="datetime64[us]"),
+        *[np.array([row[field] for row in rows], dtype=np.float64) for field in ("speed", "odometer", "soc", "elevation")],
+        np.array([row["shift_state"] for row in rows], dtype=object),
+        max_gap=MAX_GAP,
+        **kwargs,
+    )
+
+
+def test_segment_trips_splits_on_parking_and_gaps():
+    rows = (
+        make_trip(START, 10)
+        + make_trip(START + timedelta(minutes=10), 5, shift_state="P", odometer=1009.0, soc=71.0)
+        + make_trip(START + timedelta(minutes=15), 20, odometer=1009.0, soc=71.0)
+        # An hour without data
+        + make_trip(START + timedelta(hours=2), 3, shift_state="R", odometer=1028.0, soc=52.0)
+    )
+    trips = segment(rows)
+
+    assert [(trip["start_timestamp"], trip["count"]) for trip in trips] == [
+        (START, 10), (START + timedelta(minutes=15), 20), (START + timedelta(hours=2), 3)
+    ]
+    assert trips[0]["end_timestamp"] == START + timedelta(minutes=9)
+    assert trips[0]["distance"] == 9.0
+    assert trips[0]["soc_used"] == 9.0
+    assert trips[0]["max_speed"] == 60.0
+    assert trips[0]["avg_speed"] == 60.0
+    assert trips[0]["elevation_change"] == 9.0
+
+
+def test_segment_trips_ignores_missing_values():
+    rows = [dict(row, speed=np.nan) for row in make_trip(START, 5)]
+    rows[0]["odometer"] = np.nan
+    rows[-1]["soc"] = np.nan
+    trips = segment(rows)
+
+    assert trips[0]["start_odometer"] == 1001.0
+    assert trips[0]["end_soc"] == 77.0
+    assert trips[0]["max_speed"] is None
+    assert trips[0]["avg_speed"] is None
+
+
+def test_missing_shift_state_drives_when_moving():
+    rows = make_trip(START, 5)
+    for row in rows:
+        row["shift_state"] = None
+    assert segment(rows)[0]["count"] == 5
+    assert segment([dict(row, speed=0.0) for row in rows]) == []
+
+
+def test_incremental_segmentation_matches_full_segmentation(test_db):
+    rows = make_trip(START, 10) + make_trip(START + timedelta(minutes=10), 3, shift_state="P", odometer=1009.0)
+    db = TestingSessionLocal()
+    service = VehicleDataService(db)
+    service.add_vehicle_data_bulk(rows)
+    assert len(TripService(db, max_gap=MAX_GAP).get_trips("trip_vehicle")) == 1
+
+    # A trip continuing after the parking, then readings extending the first trip backwards
+    service.add_vehicle_data_bulk(make_trip(START + timedelta(minutes=13), 10, odometer=1009.0))
+    service.add_vehicle_data_bulk(make_trip(START - timedelta(minutes=5), 5, odometer=995.0))
+
+    incremental = [
+        (trip.start_timestamp, trip.end_timestamp, trip.count, trip.distance)
+        for trip in TripService(db, max_gap=MAX_GAP).get_trips("trip_vehicle")
+    ]
+    full = [
+        (trip["start_timestamp"], trip["end_timestamp"], trip["count"], trip["distance"])
+        for trip in segment(sorted(
+            rows + make_trip(START + timedelta(minutes=13), 10, odometer=1009.0)
+            + make_trip(START - timedelta(minutes=5), 5, odometer=995.0),
+            key=lambda row: row["timestamp"],
+        ))
+    ]
+    assert incremental == full
+    assert len(incremental) == 2
+    assert db.query(TripDatabase).count() == 2
+    db.close()
+
+
+def test_trips_endpoint(test_db):
+    db = TestingSessionLocal()
+    VehicleDataService(db).add_vehicle_data_bulk(
+        make_trip(START, 10) + make_trip(START + timedelta(hours=1), 10, odometer=1009.0, soc=71.0)
+    )
+    db.close()
+
+    response = client.get("/api/v1/vehicles/trip_vehicle/trips")
+    assert response.status_code == 200
+    trips = response.json()
+    assert len(trips) == 2
+    assert trips[1]["start_timestamp"] == "2032-01-01T01:00:00"
+    assert trips[1]["distance"] == 9.0
+
+    response = client.get(
+        "/api/v1/vehicles/trip_vehicle/trips", params={"initial-timestamp": "2032-01-01T00:30:00"}
+    )
+    assert len(response.json()) == 1
+
+
+def test_segmentation_state_is_locked_before_the_readings_are_read(test_db, monkeypatch):
+    """
+    GIVEN a vehicle never segmented
+    WHEN its trips are segmented
+    THEN its state row is committed and locked before its readings are read, so a write committed
+    meanwhile waits for the segmentation and marks the vehicle dirty again
+    """
+    db = TestingSessionLocal()
+    VehicleDataService(db).add_vehicle_data_bulk(make_trip(START, 10))
+
+    statements = []
+    execute = db.execute
+
+    def record(statement, *args, **kwargs):
+        statements.append(statement)
+        if "shift_state" in str(statement) and "trip_segmentation" not in str(statement):
+            other = TestingSessionLocal()
+            assert other.get(TripSegmentationDatabase, "trip_vehicle").dirty_from is not None
+            other.close()
+        return execute(statement, *args, **kwargs)
+
+    monkeypatch.setattr(db, "execute", record)
+    assert TripService(db, max_gap=MAX_GAP).update("trip_vehicle") == 1
+
+    locked = [str(statement.compile(dialect=postgresql.dialect())) for statement in statements]
+    assert any("FROM trip_segmentation" in sql and sql.endswith("FOR UPDATE") for sql in locked)
+    assert db.get(TripSegmentationDatabase, "trip_vehicle").dirty_from is None
+    db.close()
+
+
+def test_segmentation_holds_the_write_lock_on_sqlite(test_db, monkeypatch):
+    """
+    GIVEN a vehicle to segment on SQLite, where FOR UPDATE does nothing
+    WHEN its segmentation state is read, before its trips are deleted
+    THEN another connection cannot start writing until the segmentation is committed
+    """
+    db = TestingSessionLocal()
+    VehicleDataService(db).add_vehicle_data_bulk(make_trip(START, 10))
+    locked = []
+    execute = db.execute
+
+    def write_before_deleting_the_trips(statement, *args, **kwargs):
+        if str(statement).startswith("DELETE FROM trip "):
+            other = sqlite3.connect("test.db", timeout=0)
+            try:
+                other.execute("BEGIN IMMEDIATE")
+                other.rollback()
+            except sqlite3.OperationalError:
+                locked.append(True)
+            other.close()
+        return execute(statement, *args, **kwargs)
+
+    monkeypatch.setattr(db, "execute", write_before_deleting_the_trips)
+    assert TripService(db, max_gap=MAX_GAP).update("trip_vehicle") == 1
+    assert locked == [True]
+
+    other = sqlite3.connect("test.db", timeout=0)
+    other.execute("BEGIN IMMEDIATE")
+    other.rollback()
+    other.close()
+    db.close()
+
+
+def test_vehicle_marked_dirty_while_segmented_is_segmented_again(test_db, monkeypatch):
+    """
+    GIVEN a vehicle being segmented
+    WHEN it is marked dirty again from an earlier timestamp while its readings are read
+    THEN its mark is not cleared, and it is segmented again from that timestamp
+    """
+    db = TestingSessionLocal()
+    VehicleDataService(db).add_vehicle_data_bulk(make_trip(START, 10))
+    TripService(db, max_gap=MAX_GAP).update("trip_vehicle")
+    VehicleDataService(db).add_vehicle_data_bulk(make_trip(START + timedelta(hours=1), 10, odometer=1009.0))
+
+    reads = []
+    execute = db.execute
+
+    def mark_while_reading(statement, *args, **kwargs):
+        if "shift_state" in str(statement) and "trip_segmentation" not in str(statement):
+            reads.append(True)
+            if len(reads) == 1:
+                state = TripSegmentationDatabase
+                execute(update(state).where(state.vehicle_id == "trip_vehicle").values(dirty_from=START))
+        return execute(statement, *args, **kwargs)
+
+    monkeypatch.setattr(db, "execute", mark_while_reading)
+    TripService(db, max_gap=MAX_GAP).update("trip_vehicle")
+
+    assert len(reads) == 2
+    assert db.get(TripSegmentationDatabase, "trip_vehicle").dirty_from is None
+    assert [trip.count for trip in TripService(db, max_gap=MAX_GAP).get_trips("trip_vehicle")] == [10, 10]
+    db.close()
@@ -0,0 +1,177 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import create_engine, func, inspect, select, text
+
+from app.api.services.async_vehicle_data_service import AsyncVehicleDataService
+from app.api.services.latest_state_service import LatestStateService
+from app.api.services.vehicle_data_service import VehicleDataService
+from app.core.database.migrations import migrate
+from app.core.database.models import Base, VehicleDatabase, VehicleDataRollupDatabase
+from scripts.import_data import import_data
+from tests.conftest import TestingAsyncSessionLocal, TestingSessionLocal, client
+from tests.test_import_data import write_csv
+
+
+START = datetime(2032, 1, 1)
+
+
+def readings(count, vehicle_id="my_vehicle_id"):
+    return [
+        {"vehicle_id": vehicle_id, "timestamp": START + timedelta(seconds=i), "speed": float(i)}
+        for i in range(count)
+    ]
+
+
+def count_rows(db):
+    return db.scalar(select(func.count()).select_from(VehicleDatabase))
+
+
+def test_bulk_insert_is_idempotent(test_db):
+    """
+    GIVEN a batch of readings already stored
+    WHEN it is inserted again, with a duplicate inside the batch
+    THEN nothing is inserted, and the rollups and the latest state are unchanged
+    """
+    db = TestingSessionLocal()
+    vehicle_data_service = VehicleDataService(db=db)
+    assert vehicle_data_service.add_vehicle_data_bulk(readings(10)) == 10
+    rollup_count = db.scalar(select(func.sum(VehicleDataRollupDatabase.count)))
+    latest = LatestStateService(db).get_latest()
+
+    # The retry carries the same readings, one of them twice, and the timestamps in another time zone
+    retry = readings(10) + readings(1)
+    for row in retry:
+        row["timestamp"] = row["timestamp"].replace(tzinfo=timezone.utc).astimezone(timezone(timedelta(hours=2)))
+    assert vehicle_data_service.insert_vehicle_data(retry) == [False] * 11
+
+    assert count_rows(db) == 10
+    assert db.scalar(select(func.sum(VehicleDataRollupDatabase.count))) == rollup_count
+    assert LatestStateService(db).get_latest() == latest
+    db.close()
+
+
+def test_timestamps_with_an_offset_round_trip(test_db):
+    """
+    GIVEN a reading posted with a UTC offset
+    WHEN it is read back with bounds in the same offset
+    THEN it is stored in UTC and every read path finds it
+    """
+    response = client.post(
+        "/api/v1/vehicle_data/",
+        json={"vehicle_id": "my_vehicle_id", "timestamp": "2022-07-12T16:42:25+02:00", "speed": 50},
+    )
+    assert response.status_code == 200
+
+    bounds = {
+        "vehicle_id": "my_vehicle_id",
+        "initial-timestamp": "2022-07-12T16:00:00+02:00",
+        "final-timestamp": "2022-07-12T17:00:00+02:00",
+    }
+    for params in [bounds, {**bounds, "sort-by": "ASC"}, {**bounds, "sort-by": "DESC", "limit": 1}]:
+        response = client.get("/api/v1/vehicle_data/", params=params)
+        assert [row["timestamp"] for row in response.json()] == ["2022-07-12T14:42:25"]
+
+    response = client.get("/api/v1/vehicle_data/aggregate/", params={**bounds, "bucket": "15m"})
+    assert [aggregate["count"] for aggregate in response.json()] == [1]
+
+    db = TestingSessionLocal()
+    vehicles = VehicleDataService(db=db).get_vehicle_data(
+        vehicle_id="my_vehicle_id",
+        initial_timestamp=datetime(2022, 7, 12, 16, tzinfo=timezone(timedelta(hours=2))),
+        final_timestamp=datetime(2022, 7, 12, 17, tzinfo=timezone(timedelta(hours=2))),
+    )
+    assert [vehicle.timestamp for vehicle in vehicles] == [datetime(2022, 7, 12, 14, 42, 25)]
+    db.close()
+
+
+def test_duplicates_in_a_batch_are_inserted_once(test_db):
+    db = TestingSessionLocal()
+    inserted = VehicleDataService(db=db).insert_vehicle_data(readings(2) + readings(2) + readings(1, "other"))
+
+    assert inserted == [True, True, False, False, True]
+    assert count_rows(db) == 3
+    # The first reading of a (vehicle_id, timestamp) wins
+    assert db.scalar(select(VehicleDatabase.speed).where(VehicleDatabase.timestamp == START + timedelta(seconds=1))) == 1
+    db.close()
+
+
+def test_retried_post_returns_the_stored_reading(test_db):
+    reading = {"vehicle_id": "my_vehicle_id", "timestamp": "2032-01-01T00:00:00", "speed": 50}
+
+    first = client.post("/api/v1/vehicle_data/", json=reading)
+    retry = client.post("/api/v1/vehicle_data/", json={**reading, "speed": 60})
+
+    assert first.status_code == retry.status_code == 200
+    # The first write wins: the retry gets the reading stored by the first request
+    assert retry.json()["speed"] == 50
+    assert len(client.get("/api/v1/vehicle_data/?vehicle_id=my_vehicle_id").json()) == 1
+
+
+def test_batch_endpoint_reports_duplicates(test_db):
+    batch = [
+        {"vehicle_id": "my_vehicle_id", "timestamp": "2032-01-01T00:00:00"},
+        {"vehicle_id": "my_vehicle_id", "timestamp": "2032-01-01T00:00:00"},
+        {"vehicle_id": "my_vehicle_id", "timestamp": "not a timestamp"},
+    ]
+
+    data = client.post("/api/v1/vehicle_data/batch/", json=batch).json()
+    assert (data["inserted"], data["duplicates"], data["rejected"]) == (1, 1, 1)
+    assert [item["status"] for item in data["items"]] == ["created", "duplicate", "rejected"]
+
+    data = client.post("/api/v1/vehicle_data/batch/", json=batch[:1]).json()
+    assert (data["inserted"], data["duplicates"]) == (0, 1)
+
+
+@pytest.mark.asyncio
+async def test_async_insert_is_idempotent(test_db):
+    async with TestingAsyncSessionLocal() as db:
+        vehicle_data_service = AsyncVehicleDataService(db=db)
+        assert await vehicle_data_service.add_vehicle_data_bulk(readings(5)) == 5
+        assert await vehicle_data_service.insert_vehicle_data(readings(6)) == [False] * 5 + [True]
+
+        first = await vehicle_data_service.add_vehicle_data(VehicleDatabase(**readings(1)[0]))
+        assert first.speed == 0
+        assert await db.scalar(select(func.count()).select_from(VehicleDatabase)) == 6
+
+
+def test_reimporting_a_file_skips_the_stored_readings(test_db, tmp_path):
+    csv_file_path = write_csv(tmp_path / "my_vehicle_id.csv", 25)
+
+    assert import_data(csv_file_path, batch_size=10, session_factory=TestingSessionLocal) == 25
+    assert import_data(csv_file_path, batch_size=10, session_factory=TestingSessionLocal) == 0
+
+    db = TestingSessionLocal()
+    assert count_rows(db) == 25
+    db.close()
+
+
+def test_migration_removes_duplicate_readings(tmp_path):
+    """
+    GIVEN a database holding the same reading twice, created before the unique index
+    WHEN it is migrated
+    THEN the first copy is kept and the composite index becomes unique
+    """
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as connection:
+        connection.execute(text(
+            "CREATE TABLE vehicle_data (id INTEGER PRIMARY KEY, vehicle_id VARCHAR NOT NULL, timestamp DATETIME, "
+            "speed FLOAT, odometer FLOAT, soc FLOAT, elevation FLOAT, shift_state VARCHAR)"
+        ))
+        connection.execute(text(
+            "INSERT INTO vehicle_data (id, vehicle_id, timestamp, speed) VALUES "
+            "(1, 'a', '2032-01-01 00:00:00.000000', 1), (2, 'a', '2032-01-01 00:00:00.000000', 2), "
+            "(3, 'b', '2032-01-01 00:00:00.000000', 3), (4, 'a', NULL, 4), (5, 'a', NULL, 5)"
+        ))
+
+    # As on startup, the missing tables are created before the migrations run
+    Base.metadata.create_all(bind=engine)
+    migrate(engine)
+
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT id FROM vehicle_data ORDER BY id")).scalars().all() == [1, 3, 4, 5]
+    index = next(
+        index for index in inspect(engine).get_indexes("vehicle_data")
+        if index["name"] == "ix_vehicle_data_vehicle_id_timestamp"
+    )
+    assert index["unique"]
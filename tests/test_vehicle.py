@@ -330,3 +330,33 @@ def test_get_vehicle_data_with_invalid_vehicle_id(test_db, add_vehicle_id):
     # Check if the invalid vehicle list is empty
     assert len(invalid_vehicles) == 0
 
+
+
+def test_get_vehicle_data_rows_match_vehicle_model(test_db, add_vehicle_id):
+    """
+    GIVEN vehicle data in the database
+    WHEN it is read as plain rows
+    THEN every row holds the same values as the VehicleModel built from the ORM object
+    """
+    vehicle_data_service = VehicleDataService(db=next(override_get_db()))
+    vehicle_data_service.add_vehicle_data(
+        VehicleDatabase(
+            vehicle_id="my_vehicle_id",
+            timestamp=datetime(2032, 1, 2, 3, 4, 5, 123000),
+            speed=12.5,
+            odometer=100,
+            soc=80,
+            shift_state="D",
+        )
+    )
+
+    vehicles = vehicle_data_service.get_vehicle_data(vehicle_id="my_vehicle_id", sort_by=SortBy.ASC)
+    rows = vehicle_data_service.get_vehicle_data_rows(vehicle_id="my_vehicle_id", sort_by=SortBy.ASC)
+    assert rows == [VehicleModel.from_orm(vehicle).dict() for vehicle in vehicles]
+
+    page, next_cursor = vehicle_data_service.get_vehicle_data_rows_page(vehicle_id="my_vehicle_id", limit=1)
+    assert page == rows[:1] and next_cursor is not None
+
+    response = client.get("/api/v1/vehicle_data/?vehicle_id=my_vehicle_id&sort-by=DESC&limit=1")
+    assert response.json() == [{**rows[1], "timestamp": "2032-01-02T03:04:05.123000"}]
+    assert response.headers["X-Next-Cursor"]
@@ -0,0 +1,174 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import func, select
+from sqlalchemy.exc import OperationalError
+
+from app.api.endpoints import vehicle_data as vehicle_data_endpoints
+from app.api.services.async_vehicle_data_service import AsyncVehicleDataService
+from app.api.services.write_buffer import WriteBuffer, WriteBufferFullError
+from app.core.database.models import Durability, VehicleDatabase
+from main import app
+from tests.conftest import TestingAsyncSessionLocal
+
+
+START = datetime(2032, 1, 1)
+
+
+def reading(seconds, vehicle_id="buffered_vehicle"):
+    return {"vehicle_id": vehicle_id, "timestamp": START + timedelta(seconds=seconds), "speed": float(seconds)}
+
+
+async def count_rows():
+    async with TestingAsyncSessionLocal() as db:
+        return await db.scalar(select(func.count()).select_from(VehicleDatabase))
+
+
+@pytest.mark.asyncio
+async def test_concurrent_writes_are_committed_in_batches(test_db):
+    sessions = []
+
+    def session_factory():
+        sessions.append(None)
+        return TestingAsyncSessionLocal()
+
+    buffer = WriteBuffer(batch_size=5, flush_interval=10)
+    buffer.start(session_factory)
+    # Every submit returns once its batch is committed; full batches do not wait for the flush interval
+    await asyncio.wait_for(asyncio.gather(*[buffer.submit([reading(i)]) for i in range(20)]), timeout=5)
+    assert await count_rows() == 20
+    assert len(sessions) == 4
+
+    await buffer.stop()
+    assert not buffer.running
+
+
+@pytest.mark.asyncio
+async def test_enqueue_durability_returns_before_commit_and_drains_on_stop(test_db):
+    buffer = WriteBuffer(max_rows=2, flush_interval=10, durability=Durability.ENQUEUE)
+    buffer.start(TestingAsyncSessionLocal)
+    await buffer.submit([reading(0)])
+    await buffer.submit([reading(1)])
+    assert await count_rows() == 0
+
+    with pytest.raises(WriteBufferFullError):
+        await buffer.submit([reading(2)])
+
+    await buffer.stop()
+    assert await count_rows() == 2
+
+
+@pytest.mark.asyncio
+async def test_commit_durability_raises_the_error_of_the_batch(test_db):
+    buffer = WriteBuffer(flush_interval=0)
+    buffer.start(TestingAsyncSessionLocal)
+    with pytest.raises(HTTPException):
+        await buffer.submit([{"vehicle_id": None, "timestamp": START}])
+
+    # The flusher goes on after a failed batch
+    await buffer.submit([reading(0)])
+    await buffer.stop()
+    assert await count_rows() == 1
+
+
+@pytest.mark.asyncio
+async def test_a_failed_reading_only_fails_its_own_submit(test_db):
+    """
+    GIVEN submits committed in one batch, one of them with an invalid reading
+    WHEN the batch fails
+    THEN only that submit gets the error, and the readings of the others are committed
+    """
+    buffer = WriteBuffer(flush_interval=10, batch_size=6)
+    buffer.start(TestingAsyncSessionLocal)
+    submits = [buffer.submit([reading(i)]) for i in range(5)]
+    submits.insert(2, buffer.submit([{"vehicle_id": None, "timestamp": START}]))
+
+    results = await asyncio.wait_for(asyncio.gather(*submits, return_exceptions=True), timeout=5)
+    assert [isinstance(result, HTTPException) for result in results] == [False, False, True, False, False, False]
+    assert await count_rows() == 5
+    await buffer.stop()
+
+    buffer = WriteBuffer(flush_interval=10, batch_size=3, durability=Durability.ENQUEUE)
+    buffer.start(TestingAsyncSessionLocal)
+    await buffer.submit([reading(10)])
+    await buffer.submit([{"vehicle_id": None, "timestamp": START}])
+    await buffer.submit([reading(11)])
+    await buffer.stop()
+    assert await count_rows() == 7
+
+
+@pytest.mark.asyncio
+async def test_a_batch_failing_with_a_transient_error_is_retried_whole(test_db, monkeypatch):
+    """
+    GIVEN submits committed in one batch, while the database is locked
+    WHEN the batch fails with an OperationalError
+    THEN it is retried whole instead of being split, and fails whole once the retries are spent
+    """
+    attempts = []
+    add_vehicle_data_bulk = AsyncVehicleDataService.add_vehicle_data_bulk
+
+    async def locked(self, rows):
+        attempts.append(len(rows))
+        if len(attempts) <= failures:
+            try:
+                raise OperationalError("INSERT", {}, Exception("database is locked"))
+            except OperationalError as e:
+                raise HTTPException(status_code=500, detail=str(e))
+        return await add_vehicle_data_bulk(self, rows)
+
+    monkeypatch.setattr(AsyncVehicleDataService, "add_vehicle_data_bulk", locked)
+
+    failures = 2
+    buffer = WriteBuffer(flush_interval=10, batch_size=6, retries=2, retry_backoff=0)
+    buffer.start(TestingAsyncSessionLocal)
+    await asyncio.wait_for(asyncio.gather(*[buffer.submit([reading(i)]) for i in range(6)]), timeout=5)
+    assert attempts == [6, 6, 6]
+    assert await count_rows() == 6
+
+    attempts.clear()
+    failures = 10
+    results = await asyncio.wait_for(
+        asyncio.gather(*[buffer.submit([reading(i + 10)]) for i in range(6)], return_exceptions=True), timeout=5
+    )
+    assert attempts == [6, 6, 6]
+    assert all(isinstance(result, HTTPException) for result in results)
+    assert await count_rows() == 6
+    await buffer.stop()
+
+
+@pytest.mark.asyncio
+async def test_pending_submits_fail_when_the_flusher_dies(test_db, monkeypatch):
+    buffer = WriteBuffer(flush_interval=0)
+
+    async def crash():
+        raise RuntimeError("flusher crashed")
+
+    monkeypatch.setattr(buffer, "_flush", crash)
+    buffer.start(TestingAsyncSessionLocal)
+    with pytest.raises(RuntimeError, match="flusher crashed"):
+        await asyncio.wait_for(buffer.submit([reading(0)]), timeout=5)
+    assert not buffer.running
+
+    # Writes no longer go through the buffer
+    with pytest.raises(RuntimeError, match="not running"):
+        await buffer.submit([reading(0)])
+
+
+@pytest.mark.asyncio
+async def test_add_vehicle_data_endpoint_in_write_behind_mode(test_db, monkeypatch):
+    buffer = WriteBuffer(flush_interval=10, durability=Durability.ENQUEUE)
+    buffer.start(TestingAsyncSessionLocal)
+    monkeypatch.setattr(vehicle_data_endpoints, "write_buffer", buffer)
+
+    async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+        response = await client.post(
+            "/api/v1/vehicle_data/", json={"vehicle_id": "buffered_vehicle", "timestamp": "2032-01-01T00:00:00"}
+        )
+    assert response.status_code == 202
+    assert response.json()["vehicle_id"] == "buffered_vehicle"
+
+    await buffer.stop()
+    assert await count_rows() == 1